@@ -1,541 +1,1341 @@
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, date
 import os
+import time
+import shutil
+import sqlite3
+import hashlib
+import importlib.util
+import contextlib
+import cProfile
+import json
+import pstats
+import sys
+import uuid
+import unicodedata
+import re
+import pickle
+import glob
+import itertools
+import tempfile
+import zipfile
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import numpy as np
-from openpyxl.styles import numbers
+import openpyxl
+from openpyxl.cell.cell import ERROR_CODES
 
-def encontrar_oferta_mais_proxima(df_ofertas, codproduto, data_venda):
+try:
+    import resource
+except ImportError:  # Windows: o pico de memória vem do psutil, se instalado
+    resource = None
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11: regras em TOML indisponíveis
+    tomllib = None
+
+try:
+    import yaml
+except ImportError:  # Sem PyYAML as regras ficam em JSON ou TOML
+    yaml = None
+
+try:
+    import xlsxwriter
+    from xlsxwriter.exceptions import FileCreateError
+except ImportError:  # Sem xlsxwriter a exportação usa o openpyxl (mais lento e sem streaming)
+    xlsxwriter = None
+    FileCreateError = PermissionError
+
+# Exceções por nota fiscal: (NF-E, COD) -> comissão, avaliadas antes de qualquer outra regra.
+# Ficam num CSV ao lado do script e podem ser complementadas por uma aba da planilha de origem
+CAMINHO_EXCECOES_NFE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'excecoes_nfe.csv')
+ABA_EXCECOES_NFE = 'EXC_NFE'
+
+# Regras de comissão (por kg, fixas e descontos das ofertas) num arquivo versionado ao lado
+# do script (JSON; também aceita TOML e, com o PyYAML instalado, YAML). O plano compilado
+# fica em cache, indexado pelo hash do arquivo
+CAMINHO_REGRAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'regras_comissao.json')
+DIRETORIO_PLANOS_REGRAS = os.path.join(os.path.expanduser('~'), '.averiguar_comissoes', 'planos_regras')
+VERSAO_ARQUIVO_REGRAS = 1
+
+# Índice de ofertas: chaves (COD, data) ordenadas e preços alinhados, gravado em .npy. A pasta
+# é identificada pelas primeiras linhas da OFF_VOG, que se repetem nas planilhas das semanas
+# seguintes (a aba só cresce no fim), e não pelo nome do arquivo, que muda toda semana
+DIRETORIO_INDICE_OFERTAS = os.path.join(os.path.expanduser('~'), '.averiguar_comissoes', 'indice_ofertas')
+VERSAO_INDICE_OFERTAS = 3  # 3: pasta pelo conteúdo da OFF_VOG, com uma subpasta por versão do índice
+LINHAS_IDENTIFICACAO_INDICE = 100
+COLUNAS_PRECO_VOG = ['3%', '2%', '1%']
+# Índices já carregados neste processo: {pasta: ((colunas, hash das linhas), índice)}, do
+# menos para o mais recente. A vigia de pasta fica aberta semanas: só os últimos ficam
+INDICES_OFERTAS_EM_MEMORIA = 2
+_INDICES_OFERTAS = {}
+_DESLOCAMENTO_DIA = 2**31  # Dias desde 1970 viram inteiros positivos na metade baixa da chave
+
+def _dias(serie):
+    """Datas -> dias desde 1970 (int64); datas inválidas viram -1"""
+    datas = pd.to_datetime(serie, errors='coerce').to_numpy(dtype='datetime64[D]')
+    return np.where(np.isnat(datas), -1, datas.astype('int64') + _DESLOCAMENTO_DIA)
+
+def _linhas_indexaveis(df_ofertas):
+    """Chave (COD << 32 | dia) e preços das ofertas, na ordem da planilha"""
+    cod = pd.to_numeric(df_ofertas['COD'], errors='coerce').to_numpy(dtype='float64')
+    dia = _dias(df_ofertas['DT_REF_OFF'])
+    validas = ~np.isnan(cod) & (dia >= 0)
+    linhas = {'chave': (cod[validas].astype('int64') << 32) | dia[validas]}
+    for coluna in COLUNAS_PRECO_VOG:
+        if coluna in df_ofertas.columns:
+            linhas[coluna] = pd.to_numeric(df_ofertas[coluna], errors='coerce').to_numpy(dtype='float64')[validas]
+    return linhas
+
+def _fim_vigencia(chaves):
+    """
+    Último dia de vigência de cada oferta do índice: a véspera da oferta seguinte do
+    mesmo código, ou -1 para a última (vigente até nova oferta)
+    """
+    chaves = np.asarray(chaves)
+    fim = np.full(len(chaves), -1, dtype='int64')
+    mesmo_cod = (chaves[1:] >> 32) == (chaves[:-1] >> 32)
+    fim[:-1] = np.where(mesmo_cod, (chaves[1:] & 0xFFFFFFFF) - 1, -1)
+    return fim
+
+def construir_indice_ofertas(df_ofertas):
+    """
+    Ordena as ofertas por (COD, data) e monta o intervalo de vigência de cada uma: da
+    sua data até a véspera da próxima oferta do código. Mesma data para o mesmo código:
+    vale a primeira oferta cadastrada. Retorna {'chave': int64, 'fim': int64,
+    '3%'/'2%'/'1%': float64} alinhados
+    """
+    linhas = _linhas_indexaveis(df_ofertas)
+    ordem = np.argsort(linhas['chave'], kind='stable')
+    chaves = linhas['chave'][ordem]
+    primeira = np.ones(len(chaves), dtype=bool)
+    primeira[1:] = chaves[1:] != chaves[:-1]
+    indice = {coluna: valores[ordem][primeira] for coluna, valores in linhas.items()}
+    indice['fim'] = _fim_vigencia(indice['chave'])
+    return indice
+
+def acrescentar_ofertas(indice, df_novas):
+    """
+    Insere ofertas novas (linhas acrescentadas no fim da OFF_VOG) no índice já ordenado,
+    sem reordenar o que já existe. (COD, data) já indexado continua com a oferta antiga.
+    A vigência é recalculada: a oferta nova encerra a anterior do mesmo código.
     """
-    Encontra a oferta mais próxima no tempo (anterior ou posterior)
-    Prioridade: data exata > mais recente anterior > mais próxima futura
+    novas = construir_indice_ofertas(df_novas)
+    ja_existe = np.isin(novas['chave'], indice['chave'])
+    novas = {coluna: valores[~ja_existe] for coluna, valores in novas.items()}
+    posicoes = np.searchsorted(indice['chave'], novas['chave'])
+    indice = {coluna: np.insert(np.asarray(valores), posicoes, novas[coluna])
+              for coluna, valores in indice.items() if coluna != 'fim'}
+    indice['fim'] = _fim_vigencia(indice['chave'])
+    return indice
+
+def buscar_ofertas(indice, cod, dia):
+    """
+    Junção por intervalo: busca binária do início de vigência de cada venda no índice.
+    A venda fica com a oferta cuja vigência a contém (data exata ou mais recente
+    anterior) ou, antes da primeira oferta do código, com a mais próxima futura.
+    Retorna a posição da oferta no índice (-1 se não houver)
+    """
+    chaves = indice['chave']
+    if len(chaves) == 0:
+        return np.full(len(cod), -1, dtype='int64')
+    procurada = (cod << 32) | dia
+    anterior = np.searchsorted(chaves, procurada, side='right') - 1
+    posterior = anterior + 1
+    cod_anterior = chaves[np.clip(anterior, 0, None)] >> 32
+    cod_posterior = chaves[np.clip(posterior, None, len(chaves) - 1)] >> 32
+    tem_anterior = (anterior >= 0) & (cod_anterior == cod)
+    tem_posterior = (posterior < len(chaves)) & (cod_posterior == cod)
+    return np.where(tem_anterior, anterior, np.where(tem_posterior, posterior, -1))
+
+def _hash_linhas_ofertas(df_ofertas):
+    colunas = ['COD', 'DT_REF_OFF'] + [c for c in COLUNAS_PRECO_VOG if c in df_ofertas.columns]
+    return pd.util.hash_pandas_object(df_ofertas[colunas], index=False).to_numpy()
+
+def _abrir_versao_indice(pasta_versao, colunas):
+    return {c: np.load(os.path.join(pasta_versao, f"{c}.npy"), mmap_mode='r') for c in colunas}
+
+def _gravar_versao_indice(indice, pasta, meta):
+    """
+    Grava o índice numa subpasta própria desta versão (nunca sobrescrita) e só então aponta
+    o meta.json para ela; as duas trocas são renomeações, então outros processos do lote
+    sempre leem uma versão completa. As versões antigas são apagadas (no Windows, as que
+    ainda estiverem abertas com memmap ficam para a próxima gravação)
+    """
+    os.makedirs(pasta, exist_ok=True)
+    pasta_versao = os.path.join(pasta, meta['hash'][:16])
+    if not os.path.isdir(pasta_versao):
+        temporario = tempfile.mkdtemp(prefix='.gravando_', dir=pasta)
+        try:
+            for coluna, valores in indice.items():
+                np.save(os.path.join(temporario, f"{coluna}.npy"), valores)
+            try:
+                os.rename(temporario, pasta_versao)
+            except OSError:
+                # Outro processo gravou a mesma versão
+                if not os.path.isdir(pasta_versao):
+                    raise
+        finally:
+            shutil.rmtree(temporario, ignore_errors=True)
+    
+    meta_temporario = os.path.join(pasta, f".meta_{os.getpid()}.json")
+    with open(meta_temporario, 'w', encoding='utf-8') as arquivo:
+        json.dump(meta, arquivo)
+    os.replace(meta_temporario, os.path.join(pasta, 'meta.json'))
+    
+    for nome in os.listdir(pasta):
+        if nome not in ('meta.json', os.path.basename(pasta_versao)) and not nome.startswith('.'):
+            shutil.rmtree(os.path.join(pasta, nome), ignore_errors=True)
+    return pasta_versao
+
+def carregar_indice_ofertas(df_ofertas, diretorio=DIRETORIO_INDICE_OFERTAS):
     """
+    Índice persistente da OFF_VOG, compartilhado entre as planilhas que começam pelas mesmas
+    ofertas (as das semanas seguintes). Se a aba só ganhou linhas no fim desde a última
+    gravação, as novas são acrescentadas; se nada mudou, os arrays são abertos com memmap.
+    Qualquer outra alteração reconstrói o índice. Os INDICES_OFERTAS_EM_MEMORIA índices
+    usados por último também ficam em memória no processo, para quem processa várias
+    planilhas (vigia de pasta).
+    """
+    inicio = time.perf_counter()
+    hash_linhas = _hash_linhas_ofertas(df_ofertas)
+    colunas = ['chave', 'fim'] + [c for c in COLUNAS_PRECO_VOG if c in df_ofertas.columns]
+    identificacao = (colunas, hashlib.sha256(hash_linhas.tobytes()).hexdigest())
+    pasta = os.path.join(diretorio, hashlib.sha256(
+        pickle.dumps((VERSAO_INDICE_OFERTAS, colunas))
+        + hash_linhas[:LINHAS_IDENTIFICACAO_INDICE].tobytes()).hexdigest()[:16])
+    
+    if pasta in _INDICES_OFERTAS and _INDICES_OFERTAS[pasta][0] == identificacao:
+        # Volta para o fim da fila, como o mais recente
+        indice = _INDICES_OFERTAS.setdefault(pasta, _INDICES_OFERTAS.pop(pasta))[1]
+        print(f"Índice de ofertas em memória: {len(indice['chave'])} datas de oferta "
+              f"em {time.perf_counter() - inicio:.3f}s")
+        return indice
+    
+    indice, situacao = None, 'reconstruído'
     try:
-        cod = int(float(codproduto))
-        data = pd.to_datetime(data_venda).date()
-        
-        # Filtrar ofertas para o código do produto
-        ofertas_cod = df_ofertas[df_ofertas['COD'] == cod].copy()
+        with open(os.path.join(pasta, 'meta.json'), encoding='utf-8') as arquivo:
+            meta = json.load(arquivo)
+        if (meta.get('versao') == VERSAO_INDICE_OFERTAS and meta.get('colunas') == colunas
+                and meta['linhas'] <= len(df_ofertas)
+                and hashlib.sha256(hash_linhas[:meta['linhas']].tobytes()).hexdigest() == meta['hash']):
+            # Abertos com memmap; ao acrescentar, o np.insert copia só o resultado
+            indice = _abrir_versao_indice(os.path.join(pasta, meta['hash'][:16]), colunas)
+            if meta['linhas'] == len(df_ofertas):
+                situacao = 'carregado'
+            else:
+                indice = acrescentar_ofertas(indice, df_ofertas.iloc[meta['linhas']:])
+                situacao = f"+{len(df_ofertas) - meta['linhas']} ofertas acrescentadas"
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, KeyError) as e:
+        print(f"⚠️  Índice de ofertas ilegível ({e}), reconstruindo")
+        indice = None
+    
+    if indice is None:
+        indice = construir_indice_ofertas(df_ofertas)
+    
+    if situacao != 'carregado':
+        meta = {'versao': VERSAO_INDICE_OFERTAS, 'colunas': colunas, 'linhas': len(df_ofertas),
+                'hash': identificacao[1]}
+        try:
+            # Reaberto com memmap: as páginas ficam no cache do sistema, divididas entre os processos
+            indice = _abrir_versao_indice(_gravar_versao_indice(indice, pasta, meta), colunas)
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Não foi possível gravar o índice de ofertas em {pasta}: {e}")
+    
+    _INDICES_OFERTAS.pop(pasta, None)
+    _INDICES_OFERTAS[pasta] = (identificacao, indice)
+    while len(_INDICES_OFERTAS) > INDICES_OFERTAS_EM_MEMORIA:
+        del _INDICES_OFERTAS[next(iter(_INDICES_OFERTAS))]
+    print(f"Índice de ofertas {situacao}: {len(indice['chave'])} datas de oferta "
+          f"em {time.perf_counter() - inicio:.3f}s")
+    return indice
+
+def associar_ofertas_em_lote(df_vendas, df_ofertas, indice=None, verboso=True):
+    """
+    Associa a cada venda a oferta mais próxima no tempo por busca binária no índice
+    de ofertas (construído de df_ofertas se não for informado).
+    Prioridade: data exata > mais recente anterior > mais próxima futura.
+    Com verboso=False o tempo do matching não é impresso
+
+    Retorna um DataFrame alinhado ao índice de df_vendas com DT_REF_OFF, DT_FIM_OFF
+    (último dia de vigência; vazio se a oferta ainda vale), os preços (3%, 2%, 1%) e
+    'Tipo_Oferta'. Vendas sem oferta ficam com NaN.
+    """
+    inicio = time.perf_counter()
+    if indice is None:
+        indice = construir_indice_ofertas(df_ofertas)
+
+    cod = pd.to_numeric(df_vendas['CODPRODUTO'], errors='coerce').to_numpy(dtype='float64')
+    dia_venda = _dias(df_vendas['DATA'])
+    validas = ~np.isnan(cod) & (dia_venda >= 0)
+    posicoes = np.full(len(df_vendas), -1, dtype='int64')
+    posicoes[validas] = buscar_ofertas(indice, cod[validas].astype('int64'), dia_venda[validas])
+    
+    encontrada = posicoes >= 0
+    escolhidas = posicoes[encontrada]
+    dia_oferta = np.asarray(indice['chave'])[escolhidas] & 0xFFFFFFFF
+    
+    fim_oferta = np.asarray(indice['fim'])[escolhidas]
+    
+    def datas(dias, validos):
+        valores = np.full(len(df_vendas), np.nan, dtype=object)
+        posicoes_validas = np.flatnonzero(encontrada)[validos]
+        valores[posicoes_validas] = (dias[validos] - _DESLOCAMENTO_DIA).astype('datetime64[D]').astype(object)
+        return valores
+    
+    resultado = pd.DataFrame({
+        'DT_REF_OFF': datas(dia_oferta, np.ones(len(escolhidas), dtype=bool)),
+        'DT_FIM_OFF': datas(fim_oferta, fim_oferta >= 0),
+    }, index=df_vendas.index)
+    for coluna in COLUNAS_PRECO_VOG:
+        if coluna in indice:
+            precos = np.full(len(df_vendas), np.nan)
+            precos[encontrada] = np.asarray(indice[coluna])[escolhidas]
+            resultado[coluna] = precos
+    
+    tipo_oferta = np.full(len(df_vendas), None, dtype=object)
+    tipo_oferta[encontrada] = np.select(
+        [dia_oferta == dia_venda[encontrada], dia_oferta < dia_venda[encontrada]],
+        ['Exata', 'Data Proxima Ant'],
+        default='Data Proxima Pos'
+    )
+    resultado['Tipo_Oferta'] = tipo_oferta
+
+    if verboso:
+        duracao = time.perf_counter() - inicio
+        por_100k = duracao / len(df_vendas) * 100_000 if len(df_vendas) else 0.0
+        print(f"Matching de ofertas: {len(df_vendas)} vendas em {duracao:.3f}s "
+              f"({por_100k:.3f}s por 100k linhas)")
+
+    return resultado
+
+def carregar_excecoes_nfe(caminho_csv=CAMINHO_EXCECOES_NFE, df_planilha=None):
+    """
+    Carrega as exceções por nota fiscal (colunas NF-E, COD, COMISSAO) do CSV e,
+    se informada, da aba EXC_NFE já lida da planilha de origem (que prevalece
+    sobre o CSV). Retorna um dicionário {(nfe, cod): comissão}
+    """
+    tabelas = []
+    if caminho_csv and os.path.exists(caminho_csv):
+        tabelas.append(pd.read_csv(caminho_csv, sep=';', dtype={'NF-E': str, 'COMISSAO': str}))
+    if df_planilha is not None and not df_planilha.empty:
+        tabelas.append(df_planilha)
+    
+    if not tabelas:
+        print(f"ATENÇÃO: Nenhuma tabela de exceções por NF-E encontrada ({caminho_csv})")
+        return {}
+    
+    df_excecoes = pd.concat(tabelas, ignore_index=True)
+    df_excecoes['NF-E'] = df_excecoes['NF-E'].astype(str).str.strip()
+    df_excecoes['COD'] = pd.to_numeric(df_excecoes['COD'], errors='coerce')
+    df_excecoes['COMISSAO'] = pd.to_numeric(
+        df_excecoes['COMISSAO'].astype(str).str.replace(',', '.').str.strip(), errors='coerce')
+    
+    invalidas = df_excecoes['COD'].isna() | df_excecoes['COMISSAO'].isna()
+    if invalidas.any():
+        print(f"ATENÇÃO: {invalidas.sum()} exceções por NF-E ignoradas (COD ou COMISSAO inválidos)")
+    df_excecoes = df_excecoes[~invalidas]
+    
+    # A mesma NF-E/COD cadastrada de novo substitui a anterior (a aba da planilha vem por último)
+    df_excecoes = df_excecoes.drop_duplicates(subset=['NF-E', 'COD'], keep='last')
+    
+    excecoes = {
+        (nfe, int(cod)): float(comissao)
+        for nfe, cod, comissao in zip(df_excecoes['NF-E'], df_excecoes['COD'], df_excecoes['COMISSAO'])
+    }
+    print(f"Exceções por NF-E carregadas: {len(excecoes)}")
+    return excecoes
+
+def _rotulo_excecao_nfe(nfe, cod):
+    return f"NF-E {nfe} / COD {cod}"
+
+def _nome_regra_kg(vendedor, tipo, nome):
+    """Identificação de uma regra por kg no relatório de cobertura e na coluna Regra_Comissao"""
+    return f"kg {vendedor} / {tipo} {nome}"
+
+def compilar_regras_comissao_kg(regras):
+    """
+    Achata as regras de comissão por kg em etapas de busca por hash, uma única vez, na
+    ordem em que são avaliadas: grupos para todos os vendedores, (VENDEDOR, GRUPO, COD),
+    (VENDEDOR, GRUPO) quando vale qualquer código, (VENDEDOR, RAZAO, COD) e (VENDEDOR,
+    RAZAO) do caso 'PURURUCA 1KG'. Cada chave guarda o nome da regra que a criou
+    """
+    tabelas = {'grupos_todos': {}, 'vendedor_grupo_cod': {}, 'vendedor_grupo': {},
+               'vendedor_razao_cod': {}, 'vendedor_razao_pururuca': {}}
+    nomes = []
+    
+    def adicionar(tabela, chaves, nome):
+        nomes.append(nome)
+        for chave in chaves:
+            tabelas[tabela].setdefault(chave, nome)
+    
+    for grupo in _nomes(regras.get('TODOS', {}).get('grupo', [])):
+        adicionar('grupos_todos', [grupo], _nome_regra_kg('TODOS', 'grupo', grupo))
+    
+    for vendedor, regras_vendedor in regras.items():
+        vendedor = normalizar_nome(vendedor)
+        for grupo, codigos in regras_vendedor.get('grupo_codigos', {}).items():
+            grupo = normalizar_nome(grupo)
+            nome = _nome_regra_kg(vendedor, 'grupo', grupo)
+            if 'TODOS' in codigos:
+                adicionar('vendedor_grupo', [(vendedor, grupo)], nome)
+            adicionar('vendedor_grupo_cod', [(vendedor, grupo, cod) for cod in codigos if cod != 'TODOS'], nome)
         
-        if ofertas_cod.empty:
-            return None
-            
-        # Converter datas
-        ofertas_cod['DT_REF_OFF'] = pd.to_datetime(ofertas_cod['DT_REF_OFF']).dt.date
-        
-        # 1. Buscar oferta na data exata
-        oferta_exata = ofertas_cod[ofertas_cod['DT_REF_OFF'] == data]
-        if not oferta_exata.empty:
-            return oferta_exata.iloc[0]
-        
-        # 2. Buscar a oferta mais recente ANTERIOR
-        ofertas_anteriores = ofertas_cod[ofertas_cod['DT_REF_OFF'] < data]
-        if not ofertas_anteriores.empty:
-            # Ordenar por data DESCENDENTE (mais recente primeiro)
-            ofertas_anteriores = ofertas_anteriores.sort_values('DT_REF_OFF', ascending=False)
-            return ofertas_anteriores.iloc[0]
-        
-        # 3. Se não houver anteriores, buscar a PRIMEIRA oferta POSTERIOR
-        ofertas_posteriores = ofertas_cod[ofertas_cod['DT_REF_OFF'] > data]
-        if not ofertas_posteriores.empty:
-            # Ordenar por data ASCENDENTE (mais próxima no futuro)
-            ofertas_posteriores = ofertas_posteriores.sort_values('DT_REF_OFF', ascending=True)
-            return ofertas_posteriores.iloc[0]
+        for razao, codigos in regras_vendedor.get('razao_codigos', {}).items():
+            razao = normalizar_nome(razao)
+            nome = _nome_regra_kg(vendedor, 'razão', razao)
+            if 'PURURUCA 1KG' in codigos:  # Caso especial do produto: vale a descrição, não o código
+                adicionar('vendedor_razao_pururuca', [(vendedor, razao)], nome)
+            else:
+                adicionar('vendedor_razao_cod', [(vendedor, razao, cod) for cod in codigos], nome)
+    
+    colunas = {
+        'grupos_todos': ['GRUPO'],
+        'vendedor_grupo_cod': ['VENDEDOR', 'GRUPO', 'CODPRODUTO'],
+        'vendedor_grupo': ['VENDEDOR', 'GRUPO'],
+        'vendedor_razao_cod': ['VENDEDOR', 'RAZAO', 'CODPRODUTO'],
+        'vendedor_razao_pururuca': ['VENDEDOR', 'RAZAO'],
+    }
+    etapas = []
+    for tabela, chaves in tabelas.items():
+        if chaves:
+            etapa = _etapa_tabela(colunas[tabela], dict.fromkeys(chaves), regras=chaves)
+            if tabela == 'vendedor_razao_pururuca':
+                etapa['descricao'] = normalizar_nome('PURURUCA 1KG')
+            etapas.append(etapa)
+    return {'etapas': etapas, 'regras': list(dict.fromkeys(nomes))}
+
+def _contem(coluna, trecho):
+    """Máscara das linhas cuja coluna categórica contém o trecho (testado uma vez por categoria)"""
+    categorias = coluna.cat
+    return categorias.categories.str.contains(trecho, regex=False)[categorias.codes.to_numpy()]
+
+def _registrar_tempo(tempos_regras, plano, posicao, segundos):
+    """Acumula o tempo de uma etapa do plano (chave: nome do plano e posição da etapa)"""
+    if tempos_regras is not None:
+        chave = (plano, posicao)
+        tempos_regras[chave] = tempos_regras.get(chave, 0.0) + segundos
+
+def regras_comissao_kg_em_lote(df, plano, tempos_regras=None):
+    """
+    Retorna, para o DataFrame inteiro, o nome da regra por kg que decide cada linha
+    (None quando a linha não é de comissão por kg).
+    Cada etapa só busca as linhas ainda sem regra; o tempo de cada uma vai para tempos_regras
+    """
+    chaves = _chaves_regras(df)
+    regra = np.full(len(df), None, dtype=object)
+    pendente = np.ones(len(df), dtype=bool)
+    
+    for posicao, etapa in enumerate(plano['etapas']):
+        inicio = time.perf_counter()
+        pendentes = np.flatnonzero(pendente)
+        if len(pendentes) == 0:
+            break
+        posicoes = _posicoes_na_tabela(chaves.iloc[pendentes], etapa['colunas'], etapa['indice'])
+        casou = posicoes >= 0
+        if 'descricao' in etapa:
+            casou &= _contem(_chave(df, 'DESCRICAO'), etapa['descricao'])[pendentes]
+        linhas = pendentes[casou]
+        regra[linhas] = etapa['regras'][posicoes[casou]]
+        pendente[linhas] = False
+        _registrar_tempo(tempos_regras, 'comissao_kg', posicao, time.perf_counter() - inicio)
+    
+    return pd.Series(regra, index=df.index, name='Regra_Comissao')
+
+# Cada texto distinto é normalizado uma única vez por processo (entre etapas, planilhas e regras)
+_NOMES_NORMALIZADOS = {}
+
+def normalizar_nome(valor):
+    """
+    Forma canônica dos nomes (VENDEDOR, GRUPO, RAZAO, GRUPO PRODUTO, DESCRICAO e os
+    das regras): sem espaços nas pontas, em maiúsculas e sem acentos, de modo que
+    'EMBUTIDOS PERDIGÃO' e 'EMBUTIDOS PERDIGAO' sejam o mesmo nome
+    """
+    try:
+        return _NOMES_NORMALIZADOS[valor]
+    except (KeyError, TypeError):
+        pass
+    texto = unicodedata.normalize('NFD', str(valor).strip().upper())
+    normalizado = ''.join(c for c in texto if not unicodedata.combining(c))
+    try:
+        _NOMES_NORMALIZADOS[valor] = normalizado
+    except TypeError:
+        pass
+    return normalizado
+
+def _nomes(valores):
+    """Nomes das regras na forma canônica de normalizar_nome"""
+    return [normalizar_nome(valor) for valor in valores]
+
+def _normalizar_texto(serie, maiusculas=True):
+    """
+    Equivalente vetorizado de normalizar_nome (ou de str(valor).strip(), com
+    maiusculas=False): normaliza cada valor distinto uma única vez e devolve uma
+    coluna categórica
+    """
+    codigos, unicos = pd.factorize(serie, use_na_sentinel=False)
+    if maiusculas:
+        normalizados = [normalizar_nome(valor) for valor in unicos]
+    else:
+        normalizados = [str(valor).strip() for valor in unicos]
+    # Valores diferentes podem normalizar para o mesmo texto (' rede x' e 'REDE X')
+    codigos_normalizados, categorias = pd.factorize(pd.Index(normalizados, dtype=object))
+    return pd.Series(
+        pd.Categorical.from_codes(codigos_normalizados[codigos], categories=categorias),
+        index=serie.index, name=serie.name
+    )
+
+# Chaves canônicas calculadas uma vez na leitura (colunas 'chave_<coluna>', categóricas)
+# e reaproveitadas por todas as etapas; não vão para a planilha de saída
+PREFIXO_CHAVE = 'chave_'
+COLUNAS_CHAVE_NOME = ['VENDEDOR', 'GRUPO', 'RAZAO', 'GRUPO PRODUTO', 'DESCRICAO']
+COLUNAS_CHAVE_TEXTO = ['CF', 'NF-E']  # Só sem espaços nas pontas
+
+def normalizar_chaves(df_base):
+    """Acrescenta ao DataFrame as chaves canônicas de nomes, CF e NF-E"""
+    for coluna in COLUNAS_CHAVE_NOME + COLUNAS_CHAVE_TEXTO:
+        if coluna in df_base.columns:
+            df_base[PREFIXO_CHAVE + coluna] = _normalizar_texto(df_base[coluna], coluna in COLUNAS_CHAVE_NOME)
+    return df_base
+
+def _chave(df, coluna):
+    """Chave canônica da coluna: a já calculada na leitura ou, se faltar, calculada agora"""
+    if PREFIXO_CHAVE + coluna in df.columns:
+        return df[PREFIXO_CHAVE + coluna]
+    return _normalizar_texto(df[coluna], coluna in COLUNAS_CHAVE_NOME)
+
+def _sem_chaves(df):
+    return df.drop(columns=[col for col in df.columns if str(col).startswith(PREFIXO_CHAVE)])
+
+def _eh_devolucao(chave_cf):
+    """Equivalente vetorizado de str(cf).startswith('DEV') sobre a chave de CF"""
+    cf = chave_cf.cat
+    return cf.categories.str.startswith('DEV')[cf.codes.to_numpy()]
+
+def _chaves_regras(df):
+    """Colunas normalizadas usadas como chave pelas tabelas de regras compiladas"""
+    return pd.DataFrame({
+        'VENDEDOR': _chave(df, 'VENDEDOR'),
+        'GRUPO': _chave(df, 'GRUPO'),
+        'RAZAO': _chave(df, 'RAZAO'),
+        'GRUPO PRODUTO': _chave(df, 'GRUPO PRODUTO'),
+        'NF-E': _chave(df, 'NF-E'),
+        'CODPRODUTO': df['CODPRODUTO'],
+    }, index=df.index)
+
+def _posicoes_na_tabela(chaves, colunas, indice):
+    """Posição de cada linha de chaves no índice da etapa (-1 quando não está na tabela)"""
+    if len(colunas) > 1:
+        return indice.get_indexer(pd.MultiIndex.from_arrays([chaves[c] for c in colunas]))
+    coluna = chaves[colunas[0]]
+    if isinstance(coluna.dtype, pd.CategoricalDtype):
+        # Busca cada categoria uma vez só e espalha pelos códigos
+        return indice.get_indexer(coluna.cat.categories)[coluna.cat.codes.to_numpy()]
+    return indice.get_indexer(coluna)
+
+def _etapa_tabela(colunas, tabela, rotulos=None, regras=None):
+    """
+    Etapa de busca exata: tabela {chave: comissão} vira um índice hash do pandas.
+    rotulos (opcional) identifica qual entrada da tabela decidiu a linha e regras
+    ({chave: nome}) a regra de onde veio cada entrada
+    """
+    chaves = list(tabela.keys())
+    if len(colunas) == 1:
+        indice = pd.Index(chaves)
+    else:
+        indice = pd.MultiIndex.from_tuples(chaves, names=colunas)
+    taxas = np.array([np.nan if t is None else t for t in tabela.values()], dtype='float64')
+    etapa = {'colunas': colunas, 'tabela': tabela, 'indice': indice, 'taxas': taxas}
+    if rotulos is not None:
+        etapa['rotulos'] = np.array([rotulos[chave] for chave in chaves], dtype=object)
+    if regras is not None:
+        etapa['regras'] = np.array([regras[chave] for chave in chaves], dtype=object)
+    return etapa
+
+def _normalizar_tabela(colunas, tabela):
+    """Normaliza os nomes das chaves de uma tabela de regras; se duas chaves viram uma só, vale a primeira"""
+    nomes = [coluna in COLUNAS_CHAVE_NOME for coluna in colunas]
+    normalizada = {}
+    for chave, taxa in tabela.items():
+        partes = chave if len(colunas) > 1 else (chave,)
+        partes = tuple(normalizar_nome(parte) if eh_nome else parte for parte, eh_nome in zip(partes, nomes))
+        normalizada.setdefault(partes if len(colunas) > 1 else partes[0], taxa)
+    return normalizada
+
+def compilar_regras_comissao_fixa(regras_fixas):
+    """
+    Compila as regras fixas do arquivo de regras em etapas de busca por hash, na
+    ordem em que aparecem (a primeira regra que casar decide a linha).
+
+    Cada regra 'quando' vira uma tabela indexada pelas suas colunas (VENDEDOR, GRUPO,
+    (GRUPO, GRUPO PRODUTO), (GRUPO, COD)...) com todas as combinações dos valores; cada
+    regra 'contem' vira um teste de substring. Comissão NaN numa etapa significa
+    "decidido sem comissão fixa" (ex.: VAREJO CALVO processado por ofertas).
+    """
+    etapas = []
+
+    def adicionar(colunas, tabela, nome):
+        tabela = _normalizar_tabela(colunas, tabela)
+        regras = dict.fromkeys(tabela, nome)
+        # Etapas vizinhas sobre as mesmas colunas viram uma só tabela (vale a primeira chave)
+        if etapas and etapas[-1].get('colunas') == colunas and 'rotulos' not in etapas[-1]:
+            anterior = etapas.pop()
+            tabela = {**tabela, **anterior['tabela']}
+            regras = {**regras, **dict(zip(anterior['tabela'], anterior['regras']))}
+        if tabela:
+            etapas.append(_etapa_tabela(colunas, tabela, regras=regras))
+
+    for regra in regras_fixas:
+        taxa = None if regra['comissao'] == COMISSAO_POR_OFERTAS else regra['comissao']
+        if 'contem' in regra:
+            etapas.append({'contem': {coluna: normalizar_nome(trecho) for coluna, trecho in regra['contem'].items()},
+                           'taxa': np.nan if taxa is None else taxa, 'regra': regra['nome']})
+            continue
+        colunas = list(regra['quando'])
+        combinacoes = itertools.product(*regra['quando'].values())
+        if len(colunas) == 1:
+            adicionar(colunas, {valor: taxa for (valor,) in combinacoes}, regra['nome'])
+        else:
+            adicionar(colunas, {combinacao: taxa for combinacao in combinacoes}, regra['nome'])
+
+    return {'etapas': etapas, 'regras': [regra['nome'] for regra in regras_fixas]}
+
+def com_excecoes_nfe(plano_comissao_fixa, excecoes_nfe):
+    """Plano de regras fixas com as exceções por NF-E avaliadas antes de qualquer regra"""
+    if not excecoes_nfe:
+        return plano_comissao_fixa
+    rotulos = {chave: _rotulo_excecao_nfe(*chave) for chave in excecoes_nfe}
+    etapa_excecoes = _etapa_tabela(['NF-E', 'CODPRODUTO'], excecoes_nfe, rotulos=rotulos, regras=rotulos)
+    return {
+        **plano_comissao_fixa,
+        'etapas': [etapa_excecoes] + plano_comissao_fixa['etapas'],
+        'regras': list(rotulos.values()) + plano_comissao_fixa['regras'],
+        'excecoes_nfe': list(rotulos.values()),
+    }
+
+def aplicar_regras_comissao_fixa_em_lote(df, plano, tempos_regras=None, linhas=None):
+    """
+    Percorre as etapas do plano compilado (com as exceções por NF-E na frente) sobre
+    o DataFrame inteiro (ou só as linhas marcadas na máscara `linhas`) e retorna um
+    DataFrame com 'Comissao_Esperada' (NaN quando nenhuma regra fixa se aplica ou a
+    linha ficou de fora), 'Excecao_NFE' (exceção por nota fiscal que decidiu a linha,
+    quando houver) e 'Regra_Comissao' (nome da regra que decidiu a linha). O tempo de
+    cada etapa vai para tempos_regras, se informado
+    """
+    chaves = _chaves_regras(df)
+    comissao = np.full(len(df), np.nan)
+    excecao_nfe = np.full(len(df), None, dtype=object)
+    regra = np.full(len(df), None, dtype=object)
+    # Linhas fora da máscara contam como já decididas: nenhuma etapa as avalia
+    decidido = np.zeros(len(df), dtype=bool) if linhas is None else ~np.asarray(linhas, dtype=bool)
+
+    for posicao, etapa in enumerate(plano['etapas']):
+        inicio = time.perf_counter()
+        pendentes = np.flatnonzero(~decidido)
+        if len(pendentes) == 0:
+            break
+        chaves_pendentes = chaves.iloc[pendentes]
+
+        if 'contem' in etapa:
+            casou = np.ones(len(pendentes), dtype=bool)
+            for coluna, trecho in etapa['contem'].items():
+                casou &= _contem(chaves_pendentes[coluna], trecho)
+            linhas = pendentes[casou]
+            comissao[linhas] = etapa['taxa']
+            regra[linhas] = etapa['regra']
+        else:
+            posicoes = _posicoes_na_tabela(chaves_pendentes, etapa['colunas'], etapa['indice'])
+            casou = posicoes >= 0
+            linhas = pendentes[casou]
+            comissao[linhas] = etapa['taxas'][posicoes[casou]]
+            regra[linhas] = etapa['regras'][posicoes[casou]]
+            if 'rotulos' in etapa:
+                excecao_nfe[linhas] = etapa['rotulos'][posicoes[casou]]
+
+        decidido[linhas] = True
+        _registrar_tempo(tempos_regras, 'comissao_fixa', posicao, time.perf_counter() - inicio)
+
+    is_devolucao = _eh_devolucao(_chave(df, 'CF'))
+    comissao = np.where(is_devolucao, -comissao, comissao)
+
+    return pd.DataFrame({'Comissao_Esperada': comissao, 'Excecao_NFE': excecao_nfe, 'Regra_Comissao': regra},
+                        index=df.index)
+
+# ===== Arquivo de regras =====
+
+COMISSAO_POR_OFERTAS = 'ofertas'  # Regra fixa que manda a linha para a conferência pelas ofertas VOG
+COLUNAS_REGRA_FIXA = ['VENDEDOR', 'GRUPO', 'RAZAO', 'GRUPO PRODUTO', 'CODPRODUTO']
+CHAVES_ARQUIVO_REGRAS = {'versao', 'comissao_kg', 'regras_fixas', 'ofertas'}
+CHAVES_COMISSAO_KG = {'grupo', 'grupo_codigos', 'razao_codigos'}
+CHAVES_REGRA_FIXA = {'nome', 'quando', 'contem', 'comissao'}
+CHAVES_OFERTAS = {'grupos_desconto_5', 'grupo_produto_desconto_5'}
+
+# Planos já carregados neste processo, pela mesma chave do cache em disco
+_PLANOS_REGRAS = {}
+
+def _eh_codigo(valor):
+    return isinstance(valor, int) and not isinstance(valor, bool)
+
+def _eh_lista_de_nomes(valores, vazia=False):
+    return (isinstance(valores, list) and (vazia or bool(valores))
+            and all(isinstance(valor, str) and valor.strip() for valor in valores))
+
+def _validar_comissao_kg(comissao_kg, problemas):
+    if not isinstance(comissao_kg, dict):
+        problemas.append("comissao_kg deve ser um objeto {vendedor: regras}")
+        return
+    for vendedor, regras_vendedor in comissao_kg.items():
+        local = f"comissao_kg[{vendedor!r}]"
+        if not isinstance(regras_vendedor, dict):
+            problemas.append(f"{local} deve ser um objeto")
+            continue
+        for chave in sorted(set(regras_vendedor) - CHAVES_COMISSAO_KG):
+            problemas.append(f"{local}: chave desconhecida {chave!r}")
+        if 'grupo' in regras_vendedor and not _eh_lista_de_nomes(regras_vendedor['grupo']):
+            problemas.append(f"{local}.grupo deve ser uma lista de nomes")
+        for chave, especial in (('grupo_codigos', 'TODOS'), ('razao_codigos', 'PURURUCA 1KG')):
+            tabela = regras_vendedor.get(chave, {})
+            if not isinstance(tabela, dict):
+                problemas.append(f"{local}.{chave} deve ser um objeto {{nome: códigos}}")
+                continue
+            for nome, codigos in tabela.items():
+                if not (isinstance(codigos, list) and codigos
+                        and all(_eh_codigo(cod) or cod == especial for cod in codigos)):
+                    problemas.append(f"{local}.{chave}[{nome!r}] deve ser uma lista de códigos (ou {especial!r})")
+
+def _validar_regras_fixas(regras_fixas, problemas):
+    if not isinstance(regras_fixas, list):
+        problemas.append("regras_fixas deve ser uma lista de regras")
+        return
+    nomes = set()
+    for posicao, regra in enumerate(regras_fixas, 1):
+        local = f"regras_fixas[{posicao}]"
+        if not isinstance(regra, dict):
+            problemas.append(f"{local} deve ser um objeto")
+            continue
+        nome = regra.get('nome')
+        if not isinstance(nome, str) or not nome.strip():
+            problemas.append(f"{local}: falta o 'nome'")
+        elif nome in nomes:
+            problemas.append(f"{local}: nome repetido {nome!r}")
+        else:
+            nomes.add(nome)
+            local = f"{local} ({nome})"
+        for chave in sorted(set(regra) - CHAVES_REGRA_FIXA):
+            problemas.append(f"{local}: chave desconhecida {chave!r}")
         
-        return None
+        if ('quando' in regra) == ('contem' in regra):
+            problemas.append(f"{local}: use 'quando' ou 'contem' (um dos dois)")
+        elif 'quando' in regra:
+            quando = regra['quando']
+            if not isinstance(quando, dict) or not quando:
+                problemas.append(f"{local}: 'quando' deve ser um objeto {{coluna: valores}}")
+            else:
+                for coluna, valores in quando.items():
+                    if coluna not in COLUNAS_REGRA_FIXA:
+                        problemas.append(f"{local}: coluna {coluna!r} não é uma de {', '.join(COLUNAS_REGRA_FIXA)}")
+                    elif coluna == 'CODPRODUTO':
+                        if not (isinstance(valores, list) and valores and all(map(_eh_codigo, valores))):
+                            problemas.append(f"{local}: CODPRODUTO deve ser uma lista de códigos inteiros")
+                    elif not _eh_lista_de_nomes(valores):
+                        problemas.append(f"{local}: {coluna} deve ser uma lista de nomes")
+        else:
+            contem = regra['contem']
+            if not isinstance(contem, dict) or not contem:
+                problemas.append(f"{local}: 'contem' deve ser um objeto {{coluna: trecho}}")
+            else:
+                for coluna, trecho in contem.items():
+                    if coluna not in COLUNAS_REGRA_FIXA or coluna == 'CODPRODUTO':
+                        problemas.append(f"{local}: 'contem' não vale para a coluna {coluna!r}")
+                    elif not isinstance(trecho, str) or not trecho.strip():
+                        problemas.append(f"{local}: o trecho de {coluna} deve ser um texto")
         
-    except Exception as e:
-        print(f"Erro ao buscar oferta para {codproduto}: {str(e)}")
-        return None
+        comissao = regra.get('comissao')
+        eh_taxa = isinstance(comissao, (int, float)) and not isinstance(comissao, bool) and 0 <= comissao <= 1
+        if not eh_taxa and comissao != COMISSAO_POR_OFERTAS:
+            problemas.append(f"{local}: comissao deve ser um número entre 0 e 1 ou {COMISSAO_POR_OFERTAS!r}")
 
-def criar_regras_comissao_kg():
-    regras = {
-        'TODOS': {
-            'grupo': ['REDE LOURENCINI'] 
-        },
-        'FELIPE RAMALHO GOMES': {
-            'grupo_codigos': {
-                'VAREJO BERGAMINI': [700],
-                'REDE PEDREIRA': [700]
-                } 
-        },
-        'LUIZ FERNANDO VOLTERO BARBOSA': {
-            'grupo_codigos': {
-                'REDE PLUS': [812],
-                'REDE CHAMA': [812],
-                'REDE PARANA': [812]
-            }
-        },
-        'VALDENIR VOLTERO - PRETO': {
-            'grupo_codigos': {'REDE RICOY': [812, 937, 1624]},
-        },
-        'VERA LUCIA MUNIZ': {
-            'grupo_codigos': {'VAREJO MOTA NOVO': [812]},
-            'razao_codigos': {'SUPERMERCADO FEDERZONI LTDA': [812],
-                              'HX3698 HOUSE CENTER LTDA': [812]}
-        },
-        'PAMELA FERREIRA VIEIRA': {
-            'grupo_codigos': {
-                'REDE PLUS': [812],
-                'REDE VIOLETA': [812],
-                'REDE HANJO': [812]
-            },
-            'razao_codigos': {
-                'MERCADINHO VILA NOVA BONSUCESSO LTDA': [812],
-                'RODOSNACK G E G LANCHONETE E RESTAURANTE': [812],
-                'SUPERMERCADO CATANDUVA LTDA': [812],
-                'MERCADINHO SUBLIME MARTINS LTDA': [812],
-                'JMW FOODS DISTRIBUIDORA DE ALIMENTOS LTDA': [812],
-                'JMW FOODS DISTRIBUIDORA DE ALIMENTOS LTD': [812],
-                'MERCADINHO SUBLIME CUMBICA LTDA': [812],
-                'SUPER E DIST D ALIM E HORTF BRASIL LTDA': [812]
-            }
-        },
-        'ROSE VOLTERO': {
-            'razao_codigos': {
-                'SUPERMERCADO REMIX EMPORIO JAVRI LTDA': [812],
-                'HORTIFRUTI CHACARA FLORA LTDA': [812],
-                'JC MIXMERC LTDA': [812],
-                'SUPERMERCADO EMPORIO MIX LTDA': [812],
-                'SUPERMERCADO DOM PETROPOLIS LTDA': [812]
-            }
-        }
-    }
+def _validar_ofertas(ofertas, problemas):
+    if not isinstance(ofertas, dict):
+        problemas.append("ofertas deve ser um objeto")
+        return
+    for chave in sorted(set(ofertas) - CHAVES_OFERTAS):
+        problemas.append(f"ofertas: chave desconhecida {chave!r}")
+    if not _eh_lista_de_nomes(ofertas.get('grupos_desconto_5', []), vazia=True):
+        problemas.append("ofertas.grupos_desconto_5 deve ser uma lista de grupos")
+    por_grupo = ofertas.get('grupo_produto_desconto_5', {})
+    if not isinstance(por_grupo, dict) or not all(_eh_lista_de_nomes(gps) for gps in por_grupo.values()):
+        problemas.append("ofertas.grupo_produto_desconto_5 deve ser um objeto {grupo: grupos de produto}")
+
+def validar_regras(regras):
+    """Lista os problemas encontrados nas regras lidas do arquivo (vazia se estiver tudo certo)"""
+    if not isinstance(regras, dict):
+        return ["o arquivo deve conter um objeto com " + ', '.join(sorted(CHAVES_ARQUIVO_REGRAS))]
+    problemas = []
+    if regras.get('versao') != VERSAO_ARQUIVO_REGRAS:
+        problemas.append(f"versao {regras.get('versao')!r} não suportada (esperada {VERSAO_ARQUIVO_REGRAS})")
+    for chave in sorted(set(regras) - CHAVES_ARQUIVO_REGRAS):
+        problemas.append(f"chave desconhecida {chave!r}")
+    _validar_comissao_kg(regras.get('comissao_kg', {}), problemas)
+    _validar_regras_fixas(regras.get('regras_fixas'), problemas)
+    _validar_ofertas(regras.get('ofertas', {}), problemas)
+    return problemas
+
+def _interpretar_regras(conteudo, caminho):
+    """Converte o conteúdo do arquivo (JSON, TOML ou YAML, pela extensão) e valida as regras"""
+    extensao = os.path.splitext(caminho)[1].lower()
+    erros_leitura = (ValueError,) + ((yaml.YAMLError,) if yaml is not None else ())
+    try:
+        if extensao == '.json':
+            regras = json.loads(conteudo.decode('utf-8'))
+        elif extensao == '.toml':
+            if tomllib is None:
+                raise ValueError("regras em TOML exigem Python 3.11 ou mais novo")
+            regras = tomllib.loads(conteudo.decode('utf-8'))
+        elif extensao in ('.yaml', '.yml'):
+            if yaml is None:
+                raise ValueError("regras em YAML exigem o PyYAML (pip install pyyaml)")
+            regras = yaml.safe_load(conteudo)
+        else:
+            raise ValueError(f"extensão {extensao!r} não suportada (use .json, .toml ou .yaml)")
+    except erros_leitura as e:
+        raise ValueError(f"Arquivo de regras ilegível ({caminho}): {e}") from e
+    
+    problemas = validar_regras(regras)
+    if problemas:
+        raise ValueError(f"Arquivo de regras inválido ({caminho}):\n" + '\n'.join(f"  - {p}" for p in problemas))
     return regras
 
-def criar_regras_comissao_fixa():
+def carregar_regras(caminho=CAMINHO_REGRAS):
+    """Lê e valida o arquivo de regras; problemas viram um ValueError que lista cada um deles"""
+    with open(caminho, 'rb') as arquivo:
+        return _interpretar_regras(arquivo.read(), caminho)
+
+def compilar_regras_ofertas(regras_ofertas):
+    """Grupos (e pares grupo/grupo de produto) com desconto de 5% no preço comparado às ofertas"""
     return {
-        'geral': {
-            0.00: { 
-                'grupos': [
-                    'REDE AKKI', 'VAREJO ANDORINHA', 'VAREJO BERGAMINI', 'REDE DA PRACA', 'REDE DOVALE',
-                    'REDE REIMBERG', 'REDE SEMAR', 'REDE TRIMAIS', 'REDE VOVO ZUZU',
-                    'REDE BENGALA', 'VAREJO OURINHOS', 'REDE RICOY', 'REDE MERCADAO'
-                ],
-                'razoes': [
-                    'COMERCIO DE CARNES E ROTISSERIE DUTRA LT',
-                    'COMERCIO DE CARNES E ROTISSERIE DUTRA LTDA',
-                    'DISTRIBUIDORA E COMERCIO UAI SP LTDA',
-                    "LATICINIO SOBERANO LTDA VILA ALPINA",
-                    "SAO LORENZO ALIMENTOS LTDA",
-                    "QUE DELICIA MENDES COMERCIO DE ALIMENTOS",
-                    "MARIANA OLIVEIRA MAZZEI",
-                    "LS SANTOS COMERCIO DE ALIMENTOS LTDA",
-                    "MERCADINHO LESSA LTDA",
-                    "JSV SUPERMERCADOS EIRELI- LOJA 3"
-                ]
-            },
-            0.03: {
-                'grupos': ['VAREJO CALVO', 'REDE CHAMA', 'REDE ESTRELA AZUL', 'REDE TENDA', 'REDE HIGAS']
-            },
-            0.01: { 
-                'razoes': ['SHOPPING FARTURA VALINHOS COMERCIO LTDA']
-            }
-        },
-        'grupos_especificos': {
-            'REDE ROSSI': {
-                0.03: {
-                    'codigos': [937, 1698, 1701, 1587, 1700, 1586, 1699, 943, 1735, 1624, 1134]
-                },
-                0.01: {
-                    'grupos_produto': [
-                        'CORTES BOVINOS'
-                    ],
-                    'codigos': [1265, 1266, 812, 1115, 798, 1211],
-                },
-                0.00: {
-                    'grupos_produto': [
-                        'EMBUTIDOS', 'EMBUTIDOS NOBRE', 'EMBUTIDOS SADIA', 
-                        'EMBUTIDOS PERDIGAO', 'EMBUTIDOS AURORA', 'EMBUTIDOS SEARA', 
-                        'SALAME UAI'
-                    ],
-                    'codigos': [1139]
-                },
-                0.02: {
-                    'grupos_produto': ['MIUDOS BOVINOS', 'SUINOS', 'SALGADOS SUINOS A GRANEL'],
-                    'codigos': [700]    
-                },
-
-                0.03: {
-                    'grupos_produto': ['TORRESMO'],
-                }             
-            },
-            'REDE PLUS': {
-                0.03: {
-                    'grupos_produto': ['TEMPERADOS'],
-                    'codigos': [812]
-                }
-            },
-            'REDE CENCOSUD': {
-                0.01: {
-                    'grupos_produto': ['SALAME UAI']
-                },
-            },
-            'REDE AYUMI': {
-                0.03: {
-                    'grupos_produto': ['SALAME UAI']
-                },
-            },
-            'REDE ROLDAO': {
-                0.02: {
-                    'grupos_produto': [
-                        'CONGELADOS', 'CORTES BOVINOS', 'CORTES DE FRANGO', 'EMBUTIDOS', 
-                        'EMBUTIDOS AURORA', 'EMBUTIDOS NOBRE', 'EMBUTIDOS PERDIGÃO', 
-                        'EMBUTIDOS SADIA', 'EMBUTIDOS SEARA', 'EMPANADOS', 
-                        'KITS FEIJOADA', 'MIUDOS BOVINOS', 'SUINOS', 'TEMPERADOS'
-                    ]
-                },
-                0.00: {
-                    'todos_exceto': [
-                        'CONGELADOS', 'CORTES BOVINOS', 'CORTES DE FRANGO', 'EMBUTIDOS', 
-                        'EMBUTIDOS AURORA', 'EMBUTIDOS NOBRE', 'EMBUTIDOS PERDIGÃO', 
-                        'EMBUTIDOS SADIA', 'EMBUTIDOS SEARA', 'EMPANADOS', 
-                        'KITS FEIJOADA', 'MIUDOS BOVINOS', 'SUINOS', 'TEMPERADOS'
-                    ]
-                }
-            }
-        },
-        'razoes_especificas': {
-            'PAES E DOCES LEKA LTDA': {
-                0.03: [1893, 1886]
-            },
-            'PAES E DOCES MICHELLI LTDA': {
-                0.03: [1893, 1886]
-            },
-            'WANDERLEY GOMES MORENO': {
-                0.03: [1893, 1886]
-            }
-        }
+        'grupos_desconto': _nomes(regras_ofertas.get('grupos_desconto_5', [])),
+        'grupo_produto_desconto': [
+            (normalizar_nome(grupo), normalizar_nome(grupo_produto))
+            for grupo, grupos_produto in regras_ofertas.get('grupo_produto_desconto_5', {}).items()
+            for grupo_produto in grupos_produto
+        ],
     }
 
-def pertence_comissao_kg(row, regras):
-    """Verifica se o registro pertence à comissão por kg"""
-    vendedor = str(row['VENDEDOR']).strip().upper()
-    grupo = str(row['GRUPO']).strip().upper()
-    razao = str(row['RAZAO']).strip().upper()
-    codproduto = row['CODPRODUTO']
-    descricao = str(row['DESCRICAO']).strip().upper()
-    
-    # Primeiro verifica a regra geral (LOURENCINI)
-    if 'TODOS' in regras:
-        if 'grupo' in regras['TODOS']:
-            if grupo in regras['TODOS']['grupo']:
-                return True
+def compilar_regras(regras):
+    """Plano de decisão das regras já validadas: por kg, fixas (sem as exceções por NF-E) e ofertas"""
+    return {
+        'comissao_kg': compilar_regras_comissao_kg(regras.get('comissao_kg', {})),
+        'comissao_fixa': compilar_regras_comissao_fixa(regras['regras_fixas']),
+        'ofertas': compilar_regras_ofertas(regras.get('ofertas', {})),
+    }
+
+def _codigo_modulo():
+    with open(os.path.abspath(__file__), 'rb') as arquivo:
+        return arquivo.read()
+
+def carregar_plano_regras(caminho=CAMINHO_REGRAS, diretorio_cache=DIRETORIO_PLANOS_REGRAS):
+    """
+    Plano compilado do arquivo de regras, em cache (no processo e em `diretorio_cache`)
+    pelo hash do arquivo e do código: enquanto nenhum dos dois mudar, o arquivo não
+    é interpretado, validado nem compilado de novo. 'hash' identifica o arquivo.
+    """
+    with open(caminho, 'rb') as arquivo:
+        conteudo = arquivo.read()
+    chave = hashlib.sha256(conteudo + _codigo_modulo()).hexdigest()[:32]
+    if chave in _PLANOS_REGRAS:
+        return _PLANOS_REGRAS[chave]
     
-    # Depois verifica as regras específicas por vendedor
-    if vendedor in regras:
-        regras_vendedor = regras[vendedor]
-        
-        # Verifica por grupo com códigos específicos
-        if 'grupo_codigos' in regras_vendedor:
-            for grp, codigos in regras_vendedor['grupo_codigos'].items():
-                if grupo == grp and (codproduto in codigos or 'TODOS' in codigos):
-                    return True
-        
-        # Verifica por razão social com códigos específicos
-        if 'razao_codigos' in regras_vendedor:
-            for rz, codigos in regras_vendedor['razao_codigos'].items():
-                if razao == rz:
-                    if 'PURURUCA 1KG' in codigos:  # Caso especial do produto
-                        return 'PURURUCA 1KG' in descricao
-                    return codproduto in codigos
-    return False
+    caminho_cache = os.path.join(diretorio_cache, f"{chave}.pkl") if diretorio_cache else None
+    plano = None
+    if caminho_cache and os.path.exists(caminho_cache):
+        try:
+            with open(caminho_cache, 'rb') as arquivo:
+                plano = pickle.load(arquivo)
+            print(f"Regras: plano compilado de {os.path.basename(caminho)} lido do cache")
+        except Exception as e:
+            print(f"⚠️  Cache do plano de regras ilegível ({e}), compilando de novo")
+    
+    if plano is None:
+        plano = compilar_regras(_interpretar_regras(conteudo, caminho))
+        plano['hash'] = hashlib.sha256(conteudo).hexdigest()
+        print(f"Regras: {os.path.basename(caminho)} validado e compilado")
+        if caminho_cache:
+            try:
+                os.makedirs(diretorio_cache, exist_ok=True)
+                temporario = f"{caminho_cache}.{uuid.uuid4().hex}.tmp"
+                with open(temporario, 'wb') as arquivo:
+                    pickle.dump(plano, arquivo, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(temporario, caminho_cache)
+            except OSError as e:
+                print(f"⚠️  Não foi possível gravar o cache do plano de regras: {e}")
+    
+    _PLANOS_REGRAS[chave] = plano
+    return plano
 
-def aplicar_regras_comissao_fixa(row, regras):
-    """Aplica as regras de comissão fixa de forma dinâmica"""
-    vendedor = str(row['VENDEDOR']).strip().upper()
-    grupo = str(row['GRUPO']).strip().upper()
-    razao = str(row['RAZAO']).strip().upper()
-    codproduto = row['CODPRODUTO']
-    grupo_produto = str(row['GRUPO PRODUTO']).strip().upper()
-    nfe = str(row['NF-E']).strip()
-    is_devolucao = str(row['CF']).startswith('DEV')
-
-    if nfe == '131009' and codproduto == 1477:
-            return _ajustar_para_devolucao(0.03, is_devolucao) 
-    if nfe == '136119' and codproduto == 4011:
-            return _ajustar_para_devolucao(0.005, is_devolucao) 
-    if nfe == '136129' and codproduto == 1384:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '136130' and codproduto == 4011:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '136130' and codproduto == 1384:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '136148' and codproduto == 4011:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '136148' and codproduto == 1384:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '136150' and codproduto == 4011:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '136150' and codproduto == 1384:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '136169' and codproduto == 1384:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '136171' and codproduto == 1384:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '136171' and codproduto == 1874:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '136172' and codproduto == 4011:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '136172' and codproduto == 1384:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '136173' and codproduto == 1384:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '136949' and codproduto == 1878:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '137033' and codproduto == 1878:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '137271' and codproduto == 1584:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '137319' and codproduto == 1584:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '137426' and codproduto == 1584:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '137560' and codproduto == 1567:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '137596' and codproduto == 1878:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '137596' and codproduto == 1567:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '137842' and codproduto == 8006:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '137933' and codproduto == 1584:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '137939' and codproduto == 2198:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '137939' and codproduto == 1584:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '137939' and codproduto == 1567:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '137941' and codproduto == 1584:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '137943' and codproduto == 1584:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '137992' and codproduto == 1584:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '138031' and codproduto == 1567:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '138067' and codproduto == 1584:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '138078' and codproduto == 1567:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '138143' and codproduto == 1567:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '138378' and codproduto == 1584:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '138521' and codproduto == 1584:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-    if nfe == '138753' and codproduto == 2198:
-            return _ajustar_para_devolucao(0.005, is_devolucao)
-
-    
-
-    if codproduto == 1807 or codproduto == 947 or codproduto == 1914 or codproduto == 2000 or codproduto == 3002 or codproduto == 2094:
-        return _ajustar_para_devolucao(0.01, is_devolucao)
-    
-    if vendedor == "PROPRIO":
-        return _ajustar_para_devolucao(0.00, is_devolucao)
-    
-    if grupo == 'REDE RICOY':
-        return _ajustar_para_devolucao(0.00, is_devolucao)
-    
-    if grupo == 'REDE ROLDAO':
-        grupos_2_percent = [
-            'CONGELADOS', 'CORTES BOVINOS', 'CORTES DE FRANGO', 'EMBUTIDOS', 
-            'EMBUTIDOS AURORA', 'EMBUTIDOS NOBRE', 'EMBUTIDOS PERDIGÃO', 
-            'EMBUTIDOS SADIA', 'EMBUTIDOS SEARA', 'EMPANADOS', 
-            'KITS FEIJOADA', 'MIUDOS BOVINOS', 'SUINOS', 'TEMPERADOS'
-        ]
-        
-        if grupo_produto in grupos_2_percent:
-            return _ajustar_para_devolucao(0.02, is_devolucao)
-        else:
-            return _ajustar_para_devolucao(0.00, is_devolucao)
-        
+VALORES_VAZIOS = ['-', '#N/D', 'N/A', 'NAN', 'NULL', '', 'N/D']
 
-    if grupo == 'VAREJO CALVO':
-        if grupo_produto in ['MIUDOS BOVINOS', 'CORTES DE FRANGO', 'SUINOS']:
-            return None  # Processar por ofertas
-        
-        return _ajustar_para_devolucao(0.03, is_devolucao)
+def converter_coluna_numerica(serie):
+    """
+    Converte uma coluna inteira para float64: textos com vírgula decimal viram número
+    e os marcadores de vazio ('-', '#N/D', 'N/A', 'NULL', '') viram NaN.
+    Retorna (coluna convertida, Series com os valores originais que não puderam ser convertidos)
+    """
+    if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+        return serie.astype('float64'), serie.iloc[0:0]
     
-    if 'REDE CENCOSUD' in grupo:
-        if 'SALAME UAI' in grupo_produto:
-            return _ajustar_para_devolucao(0.01, is_devolucao)
-        return _ajustar_para_devolucao(0.03, is_devolucao)
+    serie = serie.astype(object)
+    # .str só enxerga as células de texto; as demais ficam NaN aqui
+    texto = serie.str.strip().str.upper()
+    eh_texto = texto.notna()
+    vazio = texto.isin(VALORES_VAZIOS)
     
-    if grupo == 'REDE ROSSI':
-        if codproduto in [937, 1698, 1701, 1587, 1700, 1586, 1699, 943, 1735, 1624, 1134]:
-            return _ajustar_para_devolucao(0.03, is_devolucao)
-        
-        if grupo_produto in ["CORTES BOVINOS"]:
-            return _ajustar_para_devolucao(0.01, is_devolucao)
-            
-        if codproduto == 1139:
-            return _ajustar_para_devolucao(0.00, is_devolucao)
-        
-        if grupo_produto in ['EMBUTIDOS', 'EMBUTIDOS NOBRE', 'EMBUTIDOS SADIA', 
-                           'EMBUTIDOS PERDIGAO', 'EMBUTIDOS AURORA', 'EMBUTIDOS SEARA', 
-                           'SALAME UAI']:
-            return _ajustar_para_devolucao(0.00, is_devolucao)
-        
-        if grupo_produto in ["MIUDOS BOVINOS", "SUINOS", "SALGADOS SUINOS A GRANEL", 
-                             "SALGADOS SUINOS EMBALADOS", "CORTES DE FRANGO"]:
-            return _ajustar_para_devolucao(0.02, is_devolucao)
+    convertido_texto = pd.to_numeric(
+        texto.where(eh_texto & ~vazio).str.replace(',', '.', regex=False), errors='coerce')
+    convertido_numero = pd.to_numeric(serie.where(~eh_texto), errors='coerce')
+    resultado = convertido_texto.where(eh_texto, convertido_numero).astype('float64')
+    
+    falhas = serie[serie.notna() & ~vazio & resultado.isna()]
+    return resultado, falhas
 
-        if grupo_produto in ['TORRESMO']:
-                    return _ajustar_para_devolucao(0.03, is_devolucao)
-        
-        if codproduto == 700:
-            return _ajustar_para_devolucao(0.02, is_devolucao)
-        
-        if codproduto in [1265, 1266, 812, 1115, 798, 1211]:
-            return _ajustar_para_devolucao(0.01, is_devolucao)
+def converter_coluna_percentual(serie):
+    """
+    Como o converter_coluna_numerica, para colunas de comissão: textos com '%' ('3%',
+    '1,5 %') viram a fração (0.03, 0.015). Números e textos sem '%' ficam como estão
+    (a conferência trata os valores > 1 como percentuais)
+    """
+    if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+        return converter_coluna_numerica(serie)
     
-    if grupo == 'REDE PLUS':
-        if grupo_produto in ['TEMPERADOS']:
-            return _ajustar_para_devolucao(0.03, is_devolucao)
-        
-        if codproduto == 812:
-            return _ajustar_para_devolucao(0.03, is_devolucao)
+    original = serie.astype(object)
+    texto = original.str.strip()
+    percentual = texto.str.endswith('%').eq(True)
+    resultado, falhas = converter_coluna_numerica(original.where(~percentual, texto.str[:-1]))
+    return resultado.where(~percentual, resultado / 100.0), original.loc[falhas.index]
+
+def _converter_colunas_numericas(df, colunas, aba, percentuais=()):
+    """
+    Converte as colunas in-place e mostra um resumo por coluna das células inválidas.
+    As colunas em `percentuais` aceitam também textos com '%' (converter_coluna_percentual)
+    """
+    for coluna in colunas:
+        conversor = converter_coluna_percentual if coluna in percentuais else converter_coluna_numerica
+        df[coluna], falhas = conversor(df[coluna])
+        if not falhas.empty:
+            exemplos = ', '.join(repr(v) for v in falhas.unique()[:5])
+            print(f"ATENÇÃO: {len(falhas)} valores inválidos em '{coluna}' ({aba}), "
+                  f"considerados vazios. Ex.: {exemplos}")
+
+def _converter_para_decimal_percentual(serie):
+    """Coluna de comissão em fração decimal: '3%', '3,0' e 3 viram 0.03 (valores > 1 são divididos por 100)"""
+    if not pd.api.types.is_numeric_dtype(serie):
+        serie = serie.astype(object)
+        texto = serie.str.replace('%', '', regex=False)
+        serie = texto.where(texto.notna(), serie)
+    valores, _ = converter_coluna_numerica(serie)
+    return valores.where(valores <= 1, valores / 100.0)
+
+def _produto_exato(a, b):
+    """Produto com o erro de arredondamento separado (Dekker): a * b == alto + baixo exatamente"""
+    alto = a * b
+    divisor = 134217729.0  # 2**27 + 1
+    c = divisor * a
+    a_alto = c - (c - a)
+    a_baixo = a - a_alto
+    c = divisor * b
+    b_alto = c - (c - b)
+    b_baixo = b - b_alto
+    baixo = ((a_alto * b_alto - alto) + a_alto * b_baixo + a_baixo * b_alto) + a_baixo * b_baixo
+    return alto, baixo
+
+def _arredondar_como_python(valores, casas=2):
+    """
+    Mesmo resultado de round(x, casas) do Python para cada elemento. O np.round
+    multiplica por 10**casas antes de arredondar e erra nos valores próximos de
+    ...,5 (ex.: preços * 0.95); aqui o empate é decidido pelo valor binário exato
+    """
+    valores = np.asarray(valores, dtype='float64')
+    escala = 10.0 ** casas
+    alto, baixo = _produto_exato(valores, escala)
+    inteiro = np.floor(alto)
+    # (alto - inteiro - 0.5) é exato; somado ao erro do produto dá o sinal certo da distância ao empate
+    distancia = (alto - inteiro - 0.5) + baixo
+    par = np.fmod(inteiro, 2) == 0
+    arredondado = np.where((distancia > 0) | ((distancia == 0) & ~par), inteiro + 1, inteiro)
+    return arredondado / escala
+
+def comparar_comissoes_em_lote(comissao_atual, comissao_esperada, decimal_places=4, tolerancia=None):
+    """
+    Compara duas colunas de comissão de uma só vez, com a mesma normalização
+    percentual e arredondamento (decimal_places, como o round do Python) da
+    conferência linha a linha.
+    tolerancia (opcional) aceita diferença absoluta até esse valor após o arredondamento.
+    Valores vazios ou inválidos nunca são considerados corretos.
+    """
+    atual = _converter_para_decimal_percentual(pd.Series(comissao_atual)).to_numpy()
+    esperada = _converter_para_decimal_percentual(pd.Series(comissao_esperada)).to_numpy()
     
-    if grupo in regras['grupos_especificos']:
-        regras_grupo = regras['grupos_especificos'][grupo]
-        
-        for porcentagem in [0.00, 0.02, 0.01, 0.03]:
-            if porcentagem in regras_grupo:
-                condicoes = regras_grupo[porcentagem]
-                
-                if isinstance(condicoes, list):
-                    if codproduto in condicoes:
-                        return _ajustar_para_devolucao(porcentagem, is_devolucao)
-                
-                elif isinstance(condicoes, dict):
-                    match = True
-                    
-                    if 'grupos_produto' in condicoes:
-                        if grupo_produto not in condicoes['grupos_produto']:
-                            match = False
-                    
-                    if 'codigos' in condicoes and match:
-                        if codproduto not in condicoes['codigos']:
-                            match = False
-                    
-                    if match:
-                        return _ajustar_para_devolucao(porcentagem, is_devolucao)
-    
-    for porcentagem, condicoes in regras['geral'].items():
-        if 'grupos' in condicoes:
-            if grupo in condicoes['grupos']:
-                return _ajustar_para_devolucao(porcentagem, is_devolucao)
-        
-        if 'razoes' in condicoes:
-            if razao in condicoes['razoes']:
-                return _ajustar_para_devolucao(porcentagem, is_devolucao)
+    atual = _arredondar_como_python(atual, decimal_places)
+    esperada = _arredondar_como_python(esperada, decimal_places)
     
-    return None
+    if tolerancia is None:
+        return atual == esperada
+    return _arredondar_como_python(np.abs(atual - esperada), decimal_places) <= tolerancia
 
-def _ajustar_para_devolucao(valor, is_devolucao):
-    return valor if not is_devolucao else -valor
+def _status_comissao(comissao_atual, comissao_esperada, decimal_places=4, tolerancia=None):
+    return np.where(
+        comparar_comissoes_em_lote(comissao_atual, comissao_esperada, decimal_places, tolerancia),
+        'Correto', 'Incorreto')
 
-def _converter_para_decimal_percentual(valor):
-    try:
-        if pd.isna(valor):
-            return None
-        
-        if isinstance(valor, str):
-            valor = valor.replace(',', '.').replace('%', '').strip()
-        
-        valor_float = float(valor)
+def classificar_comissao_por_oferta_em_lote(preco, preco_oferta_3, preco_oferta_2, preco_oferta_1,
+                                            grupo, grupo_produto, is_devolucao, plano_ofertas=None):
+    """
+    Classifica a comissão pelos preços de oferta, sobre colunas já associadas às
+    ofertas (grupo e grupo_produto normalizados):
+    - preço >= oferta 3%: 3%; preço >= oferta 2%: 2%; senão 1% (também sem oferta válida)
+    - os grupos (ou grupo/grupo de produto) com desconto no arquivo de regras comparam
+      o preço com 5% de desconto, arredondado para 2 casas
+    Colunas de oferta ausentes podem ser passadas como None. Retorna um array com a
+    comissão esperada de cada venda (negativa nas devoluções).
+    """
+    if plano_ofertas is None:
+        plano_ofertas = carregar_plano_regras()['ofertas']
+    preco = np.asarray(preco, dtype='float64')
+    grupo = pd.Series(grupo)
+    grupo_produto = pd.Series(grupo_produto)
+    
+    def preco_oferta(coluna):
+        if coluna is None:
+            return np.full(len(preco), np.nan)
+        return np.asarray(coluna, dtype='float64')
+    
+    preco_oferta_3 = preco_oferta(preco_oferta_3)
+    preco_oferta_2 = preco_oferta(preco_oferta_2)
+    preco_oferta_1 = preco_oferta(preco_oferta_1)
+    
+    # Desconto de 5% (arredondado para 2 casas) para os grupos especiais
+    especial = grupo.isin(plano_ofertas['grupos_desconto']).to_numpy(dtype=bool, copy=True)
+    if plano_ofertas['grupo_produto_desconto']:
+        especial |= pd.MultiIndex.from_arrays([grupo, grupo_produto]).isin(plano_ofertas['grupo_produto_desconto'])
+    preco_comparacao = np.where(especial, _arredondar_como_python(preco * 0.95, 2), preco)
+    
+    with np.errstate(invalid='ignore'):
+        preco_oferta_3_valido = preco_oferta_3 > 0
+        preco_oferta_2_valido = preco_oferta_2 > 0
+        preco_oferta_1_valido = preco_oferta_1 > 0
         
-        if valor_float > 1:
-            return valor_float / 100.0
+        comissao = np.select(
+            [preco_oferta_3_valido & (preco_comparacao >= preco_oferta_3),
+             preco_oferta_2_valido & (preco_comparacao >= preco_oferta_2),
+             preco_oferta_1_valido],
+            [0.03, 0.02, 0.01],
+            default=0.01  # Fallback padrão
+        )
+    
+    return np.where(np.asarray(is_devolucao, dtype=bool), -comissao, comissao)
+
+COLUNAS_FEC_PQ = {
+    'CF': 'CF',
+    'RAZAO': 'RAZAO',
+    'GRUPO': 'GRUPO',
+    'NF-E': 'NF-E',
+    'DATA': 'DATA',
+    'VENDEDOR': 'VENDEDOR',
+    'CODPRODUTO': 'CODPRODUTO',
+    'GRUPO PRODUTO': 'GRUPO PRODUTO',
+    'DESCRICAO': 'DESCRICAO',
+    'P. Com': 'P. Com',
+    'Preço Venda': 'PRECO VENDA',
+    'Romaneio': 'ROMANEIO'
+}
+
+# Coluna opcional da FEC_PQ: com ela, o valor da linha nos resumos em R$ é Preço_Venda x QTDE
+COLUNA_QUANTIDADE_FEC_PQ = 'QTDE'
+
+COLUNAS_OFF_VOG = ['COD', 'ITENS', '3%', '2%', '1%', 'DT_REF_OFF', 'Data', 'Coluna1', 'PK_OFF']
+
+# Snapshot colunar da planilha já tratada, reaproveitado enquanto o arquivo não mudar
+DIRETORIO_CACHE = os.path.join(os.path.expanduser('~'), '.averiguar_comissoes', 'cache')
+VERSAO_SNAPSHOT = 7  # NF-E, CF e nomes da FEC_PQ sempre como texto: invalida snapshots antigos
+FORMATO_SNAPSHOT = 'parquet' if importlib.util.find_spec('pyarrow') else 'pickle'
+
+# Nomes repetidos em milhares de linhas: guardados uma vez só, como category
+COLUNAS_CATEGORICAS_FEC_PQ = ['CF', 'RAZAO', 'GRUPO', 'VENDEDOR', 'GRUPO PRODUTO', 'DESCRICAO']
+
+def _memoria_mb(df):
+    return df.memory_usage(deep=True).sum() / 2**20
+
+def converter_coluna_texto(serie):
+    """
+    Coluna de identificadores (NF-E, CF, nomes) como texto, igual para qualquer mistura
+    de números e textos: número inteiro sem '.0' (123456.0 -> '123456'), vazio como NaN.
+    Assim o tipo não depende das outras linhas lidas junto (a planilha inteira ou um bloco)
+    """
+    codigos, unicos = pd.factorize(serie)
+    textos = [str(int(valor)) if isinstance(valor, (int, float, np.integer, np.floating))
+              and not isinstance(valor, bool) and float(valor).is_integer() else str(valor)
+              for valor in unicos]
+    valores = np.array(textos + [np.nan], dtype=object)[codigos]
+    return pd.Series(valores, index=serie.index, name=serie.name, dtype='str')
+
+def compactar_tipos(df_base):
+    """Converte as colunas de nomes da FEC_PQ para category (no próprio DataFrame)"""
+    for coluna in COLUNAS_CATEGORICAS_FEC_PQ:
+        if coluna in df_base.columns and not isinstance(df_base[coluna].dtype, pd.CategoricalDtype):
+            df_base[coluna] = df_base[coluna].astype('category')
+    return df_base
+
+def _preparar_fec_pq(df_base, verboso=True):
+    """
+    Seleciona, renomeia e converte as colunas da aba FEC_PQ. Os avisos (ATENÇÃO) saem
+    sempre; com verboso=False o ganho de memória não é impresso
+    """
+    # Mapeamento de colunas
+    colunas_necessarias = dict(COLUNAS_FEC_PQ)
+    
+    # Verificar e ajustar colunas
+    for col_original, col_nova in colunas_necessarias.items():
+        if col_nova not in df_base.columns:
+            print(f"ATENÇÃO: Coluna '{col_nova}' não encontrada na aba FEC_PQ")
+            colunas_encontradas = [c for c in df_base.columns if c.upper().strip() == col_nova.upper().strip()]
+            if colunas_encontradas:
+                print(f"  Encontrada coluna similar: {colunas_encontradas[0]}")
+                colunas_necessarias[col_original] = colunas_encontradas[0]
+            else:
+                print(f"  Coluna não encontrada! Valores disponíveis: {list(df_base.columns)[:20]}")
+    
+    quantidade = [col for col in df_base.columns if str(col).upper().strip() == COLUNA_QUANTIDADE_FEC_PQ][:1]
+    if not quantidade:
+        print(f"ATENÇÃO: Coluna '{COLUNA_QUANTIDADE_FEC_PQ}' não encontrada na aba FEC_PQ: "
+              f"os resumos em R$ usam o preço de venda de uma unidade por linha")
+    
+    # Selecionar e renomear colunas
+    df_base = df_base[list(colunas_necessarias.values()) + quantidade]
+    df_base = df_base.rename(columns={
+        **{coluna: COLUNA_QUANTIDADE_FEC_PQ for coluna in quantidade},
+        colunas_necessarias['CF']: 'CF',
+        colunas_necessarias['RAZAO']: 'RAZAO',
+        colunas_necessarias['GRUPO']: 'GRUPO',
+        colunas_necessarias['NF-E']: 'NF-E',
+        colunas_necessarias['DATA']: 'DATA',
+        colunas_necessarias['VENDEDOR']: 'VENDEDOR',
+        colunas_necessarias['CODPRODUTO']: 'CODPRODUTO',
+        colunas_necessarias['GRUPO PRODUTO']: 'GRUPO PRODUTO',
+        colunas_necessarias['DESCRICAO']: 'DESCRICAO',
+        colunas_necessarias['P. Com']: 'P. Com',
+        colunas_necessarias['Preço Venda']: 'Preço_Venda',
+        colunas_necessarias['Romaneio']: 'Romaneio'
+    })
+    
+    # Converter e formatar dados
+    memoria_antes = _memoria_mb(df_base)
+    datas = pd.to_datetime(df_base['DATA'], errors='coerce', format='mixed')
+    invalidas = df_base['DATA'][datas.isna() & df_base['DATA'].notna()]
+    if not invalidas.empty:
+        exemplos = ', '.join(repr(v) for v in invalidas.unique()[:5])
+        print(f"ATENÇÃO: {len(invalidas)} datas inválidas em 'DATA' (FEC_PQ), consideradas vazias "
+              f"(as vendas vão para os logs de erros). Ex.: {exemplos}")
+    df_base['DATA'] = datas.dt.normalize()
+    df_base['CODPRODUTO'] = pd.to_numeric(df_base['CODPRODUTO'], errors='coerce').fillna(0).astype('int32')
+    colunas_numericas = ['P. Com', 'Preço_Venda'] + ([COLUNA_QUANTIDADE_FEC_PQ] if quantidade else [])
+    _converter_colunas_numericas(df_base, colunas_numericas, 'FEC_PQ', percentuais=['P. Com'])
+    for coluna in COLUNAS_CHAVE_NOME + COLUNAS_CHAVE_TEXTO:
+        df_base[coluna] = converter_coluna_texto(df_base[coluna])
+    compactar_tipos(df_base)
+    normalizar_chaves(df_base)
+    if verboso:
+        print(f"Memória da FEC_PQ: {memoria_antes:.1f} MB -> {_memoria_mb(df_base):.1f} MB")
+    
+    return df_base
+
+def _preparar_off_vog(df_ofertas_vog):
+    """Seleciona e converte as colunas da aba OFF_VOG"""
+    colunas_vog_disponiveis = df_ofertas_vog.columns.tolist()
+    print(f"Colunas disponíveis em OFF_VOG: {colunas_vog_disponiveis}")
+    
+    colunas_ofertas_vog = []
+    if 'COD' in colunas_vog_disponiveis:
+        colunas_ofertas_vog.append('COD')
+    if 'ITENS' in colunas_vog_disponiveis:
+        colunas_ofertas_vog.append('ITENS')
+    if '3%' in colunas_vog_disponiveis:
+        colunas_ofertas_vog.append('3%')
+    if '2%' in colunas_vog_disponiveis:
+        colunas_ofertas_vog.append('2%')
+    if '1%' in colunas_vog_disponiveis:
+        colunas_ofertas_vog.append('1%')
+    
+    if 'DT_REF_OFF' in colunas_vog_disponiveis:
+        colunas_ofertas_vog.append('DT_REF_OFF')
+    elif 'Data' in colunas_vog_disponiveis:
+        colunas_ofertas_vog.append('Data')
+        df_ofertas_vog = df_ofertas_vog.rename(columns={'Data': 'DT_REF_OFF'})
+    else:
+        raise ValueError("Não encontrada coluna de data em OFF_VOG")
+    
+    for col in ['Coluna1', 'PK_OFF']:
+        if col in colunas_vog_disponiveis:
+            colunas_ofertas_vog.append(col)
+    
+    df_ofertas_vog = df_ofertas_vog[colunas_ofertas_vog].dropna(subset=['COD', 'DT_REF_OFF'])
+    df_ofertas_vog['DT_REF_OFF'] = pd.to_datetime(df_ofertas_vog['DT_REF_OFF']).dt.date
+    df_ofertas_vog['COD'] = pd.to_numeric(df_ofertas_vog['COD'], errors='coerce').fillna(0).astype('int64')
+    
+    colunas_preco = [col for col in ['3%', '2%', '1%'] if col in colunas_ofertas_vog]
+    _converter_colunas_numericas(df_ofertas_vog, colunas_preco, 'OFF_VOG')
+    
+    print(f"Total de ofertas cadastradas: {len(df_ofertas_vog)}")
+    print(f"Colunas em OFF_VOG: {colunas_ofertas_vog}")
+    
+    return df_ofertas_vog
+
+def _chave_snapshot(caminho):
+    """Identifica o arquivo de origem pelo hash do conteúdo e pela data de modificação"""
+    sha = hashlib.sha256()
+    with open(caminho, 'rb') as arquivo:
+        for bloco in iter(lambda: arquivo.read(1 << 20), b''):
+            sha.update(bloco)
+    nome = os.path.splitext(os.path.basename(caminho))[0]
+    return f"{nome}_{sha.hexdigest()[:16]}_{int(os.path.getmtime(caminho))}_v{VERSAO_SNAPSHOT}"
+
+def _tem_tipos_misturados(df):
+    """Se alguma coluna (ou categoria) mistura tipos, como a NF-E com números e texto"""
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            if df[col].cat.categories.map(type).nunique() > 1:
+                return True
+        elif df[col].dtype == object and df[col].dropna().map(type).nunique() > 1:
+            return True
+    return False
+
+def _salvar_snapshot(dados, diretorio):
+    os.makedirs(diretorio, exist_ok=True)
+    for aba, df in dados.items():
+        if df is None:
+            continue
+        # O Parquet exige um tipo por coluna; abas com tipos misturados vão em pickle
+        # para voltarem como foram lidas (números continuam números na saída)
+        if FORMATO_SNAPSHOT == 'parquet' and not _tem_tipos_misturados(df):
+            df.to_parquet(os.path.join(diretorio, f"{aba}.parquet"), index=False)
         else:
-            return valor_float
-            
-    except Exception as e:
-        print(f"Erro ao converter valor '{valor}': {str(e)}")
-        return None
+            df.to_pickle(os.path.join(diretorio, f"{aba}.pickle"))
 
-def _comparar_comissoes(comissao_atual, comissao_esperada, decimal_places=4):
+def _carregar_snapshot(diretorio):
+    dados = {'FEC_PQ': None, 'OFF_VOG': None, 'EXC_NFE': None}
+    for aba in dados:
+        caminho = os.path.join(diretorio, f"{aba}.parquet")
+        if FORMATO_SNAPSHOT == 'parquet' and os.path.exists(caminho):
+            dados[aba] = pd.read_parquet(caminho)
+        elif os.path.exists(os.path.join(diretorio, f"{aba}.pickle")):
+            dados[aba] = pd.read_pickle(os.path.join(diretorio, f"{aba}.pickle"))
+    return dados
+
+def _ler_fec_pq(planilha):
+    """Aba FEC_PQ (cabeçalho na linha 10), só com as colunas usadas, já tratada"""
+    nomes_fec_pq = {nome.upper().strip() for nome in [*COLUNAS_FEC_PQ.values(), COLUNA_QUANTIDADE_FEC_PQ]}
+    # Cabeçalho da FEC_PQ na linha 10 (A10)
+    df_base = pd.read_excel(planilha, sheet_name='FEC_PQ', header=9,
+                            usecols=lambda col: str(col).upper().strip() in nomes_fec_pq)
+    print(f"TOTAL DE REGISTROS NA BASE: {len(df_base)}")
+    return _preparar_fec_pq(df_base)
+
+def _ler_off_vog_e_excecoes(planilha):
+    """Abas OFF_VOG (tratada) e EXC_NFE (None se não existir) de uma planilha já aberta"""
+    nomes_off_vog = set(COLUNAS_OFF_VOG)
+    print("\n--- Lendo aba OFF_VOG ---")
+    df_ofertas_vog = pd.read_excel(planilha, sheet_name='OFF_VOG',
+                                   usecols=lambda col: str(col) in nomes_off_vog)
+    df_ofertas_vog = _preparar_off_vog(df_ofertas_vog)
+    
+    df_excecoes = None
+    if ABA_EXCECOES_NFE in planilha.sheet_names:
+        df_excecoes = pd.read_excel(planilha, sheet_name=ABA_EXCECOES_NFE,
+                                    dtype={'NF-E': str, 'COMISSAO': str})
+    return df_ofertas_vog, df_excecoes
+
+def _ler_snapshot_origem(diretorio_snapshot):
+    """Abas já tratadas do snapshot, ou None se ele não existir ou estiver incompleto"""
+    if not os.path.isdir(diretorio_snapshot):
+        return None
     try:
-        atual = _converter_para_decimal_percentual(comissao_atual)
-        esperada = _converter_para_decimal_percentual(comissao_esperada)
-        
-        if atual is None or esperada is None:
-            return False
-        
-        atual_rounded = round(atual, decimal_places)
-        esperada_rounded = round(esperada, decimal_places)
-        
-        return atual_rounded == esperada_rounded
-    except (ValueError, TypeError) as e:
-        print(f"Erro na comparação: {str(e)}, atual={comissao_atual}, esperada={comissao_esperada}")
-        return False
+        dados = _carregar_snapshot(diretorio_snapshot)
+    except (OSError, ValueError) as e:
+        # Snapshot apagado ou corrompido no meio da leitura: a planilha é relida do Excel
+        print(f"ATENÇÃO: Não foi possível ler o snapshot da planilha: {str(e)}")
+        return None
+    if dados['FEC_PQ'] is None or dados['OFF_VOG'] is None:
+        return None
+    return dados
 
-def _converter_valor_oferta(valor):
+def _gravar_snapshot_origem(dados, caminho_origem, chave):
+    """
+    Grava o snapshot `chave` das abas tratadas e apaga os snapshots antigos do mesmo arquivo.
+    O snapshot é montado numa pasta temporária e renomeado para `chave` só quando completo,
+    de modo que outro processo (do lote) nunca lê um snapshot pela metade
+    """
     try:
-        if pd.isna(valor):
-            return np.nan
-        
-        if isinstance(valor, str):
-            valor_str = valor.strip().upper()
-            
-            if valor_str in ['-', '#N/D', 'N/A', 'NAN', 'NULL', '', 'N/D']:
-                return np.nan
-            
-            valor_str = valor_str.replace(',', '.')
-            
-            return float(valor_str)
-        
-        return float(valor)
+        os.makedirs(DIRETORIO_CACHE, exist_ok=True)
+        diretorio_snapshot = os.path.join(DIRETORIO_CACHE, chave)
+        temporario = tempfile.mkdtemp(prefix=f".{chave}_", dir=DIRETORIO_CACHE)
+        try:
+            _salvar_snapshot(dados, temporario)
+            os.rename(temporario, diretorio_snapshot)
+        except OSError:
+            # Outro processo já gravou o mesmo snapshot
+            if not os.path.isdir(diretorio_snapshot):
+                raise
+        finally:
+            shutil.rmtree(temporario, ignore_errors=True)
         
+        # Snapshots antigos do mesmo arquivo não servem mais. Só contam as chaves com exatamente
+        # este nome seguido de hash, mtime e versão (X.xlsx não apaga os de X_1.xlsx ou X_MRG.xlsx)
+        nome = os.path.splitext(os.path.basename(caminho_origem))[0]
+        padrao = re.compile(re.escape(nome) + r'_[0-9a-f]{16}_\d+_v\d+')
+        for antigo in os.listdir(DIRETORIO_CACHE):
+            if padrao.fullmatch(antigo) and antigo != chave:
+                # Renomeado antes de apagar: some de uma vez para quem for procurá-lo
+                descartado = os.path.join(DIRETORIO_CACHE, f".{antigo}_apagar{os.getpid()}")
+                try:
+                    os.rename(os.path.join(DIRETORIO_CACHE, antigo), descartado)
+                except OSError:
+                    continue
+                shutil.rmtree(descartado, ignore_errors=True)
     except Exception as e:
-        print(f"Erro ao converter valor de oferta '{valor}': {str(e)}")
-        return np.nan
+        print(f"ATENÇÃO: Não foi possível gravar o snapshot da planilha: {str(e)}")
 
-def classificar_comissao_por_oferta(preco, preco_oferta_3, preco_oferta_2, preco_oferta_1, grupo, grupo_produto, is_devolucao):
+def ler_planilha_origem(caminho_origem, usar_cache=True):
     """
-    Classifica a comissão baseada nos preços de oferta
-    Lógica:
-    - Se preço >= oferta_3%: 3%
-    - Se preço >= oferta_2%: 2% 
-    - Se preço >= oferta_1%: 1%
-    - Caso contrário: 1% (fallback)
-    
-    Aplica -5% para grupos especiais antes da comparação
+    Lê as abas FEC_PQ, OFF_VOG e (se existir) EXC_NFE abrindo a planilha uma única vez
+    e carregando só as colunas usadas. O resultado já tratado é gravado num snapshot
+    (Parquet, ou pickle sem pyarrow ou para abas com tipos misturados) identificado pelo hash e mtime do arquivo, de
+    modo que uma nova execução sobre a mesma planilha não precisa reler o Excel.
+
+    Retorna {'FEC_PQ': df_base, 'OFF_VOG': df_ofertas_vog, 'EXC_NFE': df ou None}
     """
+    inicio = time.perf_counter()
+    chave = _chave_snapshot(caminho_origem)
     
-    # Aplicar desconto de 5% para grupos especiais
-    grupos_especiais = ['REDE STYLLUS', 'REDE ROD E RAF']
-    if grupo == 'VAREJO CALVO' and grupo_produto in ['MIUDOS BOVINOS', 'CORTES DE FRANGO', 'SUINOS']:
-        grupos_especiais.append('VAREJO CALVO')
+    if usar_cache:
+        dados = _ler_snapshot_origem(os.path.join(DIRETORIO_CACHE, chave))
+        if dados is not None:
+            print(f"Planilha carregada do snapshot {chave} em {time.perf_counter() - inicio:.3f}s")
+            return dados
     
-    if grupo in grupos_especiais:
-        # Aplicar desconto de 5% e ARREDONDAR para 2 casas decimais
-        preco_comparacao = round(preco * 0.95, 2)
-    else:
-        preco_comparacao = preco
-    
-    # Verificar se os preços de oferta são válidos
-    preco_oferta_3_valido = preco_oferta_3 is not None and not np.isnan(preco_oferta_3) and preco_oferta_3 > 0
-    preco_oferta_2_valido = preco_oferta_2 is not None and not np.isnan(preco_oferta_2) and preco_oferta_2 > 0
-    preco_oferta_1_valido = preco_oferta_1 is not None and not np.isnan(preco_oferta_1) and preco_oferta_1 > 0
-    
-    # Lógica de classificação
-    if preco_oferta_3_valido and preco_comparacao >= preco_oferta_3:
-        comissao = 0.03
-    elif preco_oferta_2_valido and preco_comparacao >= preco_oferta_2:
-        comissao = 0.02
-    elif preco_oferta_1_valido:
-        comissao = 0.01
-    else:
-        comissao = 0.01  # Fallback padrão
+    with pd.ExcelFile(caminho_origem) as planilha:
+        df_base = _ler_fec_pq(planilha)
+        df_ofertas_vog, df_excecoes = _ler_off_vog_e_excecoes(planilha)
+    
+    dados = {'FEC_PQ': df_base, 'OFF_VOG': df_ofertas_vog, 'EXC_NFE': df_excecoes}
+    print(f"Planilha lida do Excel em {time.perf_counter() - inicio:.3f}s")
     
-    # Ajustar para devolução
-    if is_devolucao:
-        comissao *= -1
+    if usar_cache:
+        _gravar_snapshot_origem(dados, caminho_origem, chave)
     
-    return comissao
+    return dados
 
 def padronizar_colunas(df, tipo='comissao'):
     """
@@ -612,343 +1412,1813 @@ def padronizar_colunas(df, tipo='comissao'):
     
     return df[ordem_colunas_sem_duplicatas]
 
-def processar_planilhas():
-    caminho_origem = r"C:\Users\DELL\Downloads\260722_MRG.xlsx"
-    caminho_downloads = os.path.join(os.path.expanduser('~'), 'Downloads', 'Averiguar_Comissoes (MARGEM).xlsx')
+FORMATO_PERCENTUAL = '0.00%'
+FORMATO_DATA = 'yyyy-mm-dd'
+FORMATO_MOEDA = '#,##0.00'
+LINHAS_POR_BLOCO_EXPORTACAO = 10_000
+
+def _eh_coluna_percentual(nome_coluna):
+    return any(keyword in str(nome_coluna) for keyword in ['Com', 'Com Atual', 'P. Com'])
+
+def _eh_coluna_moeda(nome_coluna):
+    return 'R$' in str(nome_coluna)
+
+def _formatos_colunas(df):
+    """Formato das colunas de valor, porcentagem e data: {coluna: 'moeda' | 'percentual' | 'data'}"""
+    formatos = {}
+    for col_idx, col_name in enumerate(df.columns):
+        serie = df.iloc[:, col_idx]
+        if _eh_coluna_moeda(col_name):
+            formatos[col_name] = 'moeda'
+        elif _eh_coluna_percentual(col_name):
+            formatos[col_name] = 'percentual'
+        elif (pd.api.types.is_datetime64_any_dtype(serie)
+              or isinstance(serie.dropna().iloc[0] if serie.notna().any() else None, date)):
+            formatos[col_name] = 'data'
+    return formatos
+
+def _abrir_workbook_xlsxwriter(caminho):
+    """
+    Abre um workbook do xlsxwriter em modo constant_memory, em que as linhas vão para o
+    disco à medida que são escritas. Devolve o workbook e os formatos do cabeçalho e das
+    colunas ({'cabecalho' | 'moeda' | 'percentual' | 'data': formato})
+    """
+    workbook = xlsxwriter.Workbook(caminho, {'constant_memory': True})
+    estilos = {
+        'cabecalho': workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}),
+        'percentual': workbook.add_format({'num_format': FORMATO_PERCENTUAL}),
+        'data': workbook.add_format({'num_format': FORMATO_DATA}),
+        'moeda': workbook.add_format({'num_format': FORMATO_MOEDA}),
+    }
+    return workbook, estilos
+
+def _escrever_aba_xlsxwriter(workbook, estilos, sheet_name, colunas, formatos, blocos):
+    """
+    Acrescenta uma aba ao workbook com os formatos de porcentagem/data definidos por coluna,
+    sem passar célula a célula depois. `blocos` são DataFrames com as `colunas`, na ordem das linhas
+    """
+    worksheet = workbook.add_worksheet(sheet_name)
+    
+    for col_idx, col_name in enumerate(colunas):
+        if col_name in formatos:
+            worksheet.set_column(col_idx, col_idx, None, estilos[formatos[col_name]])
+    
+    worksheet.write_row(0, 0, [str(col) for col in colunas], estilos['cabecalho'])
+    
+    # constant_memory exige escrever linha a linha, em ordem
+    linha = 1
+    for df in blocos:
+        for inicio in range(0, len(df), LINHAS_POR_BLOCO_EXPORTACAO):
+            bloco = df.iloc[inicio:inicio + LINHAS_POR_BLOCO_EXPORTACAO].astype(object)
+            bloco = bloco.where(bloco.notna(), None)
+            for valores in bloco.itertuples(index=False, name=None):
+                worksheet.write_row(linha, 0, valores)
+                linha += 1
+
+def _escrever_abas_xlsxwriter(abas, caminho):
+    """
+    Grava as abas com o xlsxwriter em modo constant_memory. `abas` é {nome: (colunas,
+    formatos, blocos)}, com os blocos (DataFrames com essas colunas) na ordem das linhas
+    """
+    workbook, estilos = _abrir_workbook_xlsxwriter(caminho)
+    try:
+        for sheet_name, (colunas, formatos, blocos) in abas.items():
+            _escrever_aba_xlsxwriter(workbook, estilos, sheet_name, colunas, formatos, blocos)
+    finally:
+        workbook.close()
+
+def _escrever_excel_streaming(df_dict, caminho):
+    """Grava as abas (DataFrames inteiros) pelo xlsxwriter em modo constant_memory"""
+    _escrever_abas_xlsxwriter({
+        sheet_name: (list(df.columns), _formatos_colunas(df), [df])
+        for sheet_name, df in df_dict.items() if df is not None and not df.empty
+    }, caminho)
+
+def _escrever_excel_openpyxl(df_dict, caminho):
+    with pd.ExcelWriter(caminho, engine='openpyxl') as writer:
+        for sheet_name, df in df_dict.items():
+            if df is not None and not df.empty:
+                df.to_excel(writer, sheet_name=sheet_name, index=False)
+        
+        # Aplicar formatação de valores e de porcentagem
+        for sheet_name in writer.sheets:
+            worksheet = writer.sheets[sheet_name]
+            for col_idx, col_name in enumerate(next(worksheet.iter_rows(min_row=1, max_row=1, values_only=True))):
+                if _eh_coluna_moeda(col_name):
+                    formato = FORMATO_MOEDA
+                elif _eh_coluna_percentual(col_name):
+                    formato = FORMATO_PERCENTUAL
+                else:
+                    continue
+                for row in worksheet.iter_rows(min_row=2, min_col=col_idx+1, max_col=col_idx+1):
+                    for cell in row:
+                        cell.number_format = formato
+
+def salvar_com_alternativas(df_dict, caminho_base):
+    """Salva as abas; se o arquivo estiver aberto (sem permissão), tenta nome_1, nome_2, ..."""
+    def escrever(caminho):
+        if xlsxwriter is not None:
+            _escrever_excel_streaming(df_dict, caminho)
+        else:
+            _escrever_excel_openpyxl(df_dict, caminho)
+    
+    return _gravar_com_alternativas(escrever, caminho_base)
+
+def _gravar_com_alternativas(escrever, caminho_base):
+    """Chama escrever(caminho) e, se o arquivo estiver aberto (sem permissão), tenta nome_1, nome_2, ..."""
+    caminho_atual = caminho_base
+    contador = 1
+    
+    while True:
+        try:
+            escrever(caminho_atual)
+            return caminho_atual
+            
+        except (PermissionError, FileCreateError):
+            nome_base, ext = os.path.splitext(caminho_base)
+            caminho_atual = f"{nome_base}_{contador}{ext}"
+            contador += 1
+            print(f"⚠️  Arquivo {caminho_base} está aberto. Tentando salvar como: {caminho_atual}")
+            
+            if contador > 10:
+                raise Exception("Não foi possível salvar o arquivo após várias tentativas")
+
+# Medições por etapa (JSON lines, uma linha por etapa de cada execução) e perfis do cProfile
+DIRETORIO_METRICAS = os.path.join(os.path.expanduser('~'), '.averiguar_comissoes', 'metricas')
+CAMINHO_METRICAS = os.path.join(DIRETORIO_METRICAS, 'etapas.jsonl')
+
+def _pico_rss_mb():
+    """Pico de memória residente do processo em MB (None se não houver como medir)"""
+    if resource is not None:
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux informa em KB, macOS em bytes
+        return round(pico / (2**20 if sys.platform == 'darwin' else 2**10), 1)
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().peak_wset / 2**20, 1)
+    except (ImportError, AttributeError):
+        return None
+
+@contextlib.contextmanager
+def medir_etapa(medicoes, etapa, linhas_entrada=None):
+    """
+    Cronometra uma etapa do processamento e acrescenta a medição em `medicoes`.
+    Quem chama preenche registro['linhas_saida'] no dicionário devolvido.
+    """
+    registro = {'etapa': etapa, 'linhas_entrada': linhas_entrada, 'linhas_saida': None}
+    inicio = time.perf_counter()
+    try:
+        yield registro
+    except Exception as e:
+        registro['erro'] = str(e)
+        raise
+    finally:
+        segundos = time.perf_counter() - inicio
+        linhas = registro['linhas_entrada'] if registro['linhas_entrada'] is not None else registro['linhas_saida']
+        registro['segundos'] = round(segundos, 4)
+        registro['linhas_por_segundo'] = round(linhas / segundos) if linhas and segundos > 0 else None
+        registro['pico_rss_mb'] = _pico_rss_mb()
+        medicoes.append(registro)
+
+def registrar_medicoes(medicoes, caminho=CAMINHO_METRICAS, **contexto):
+    """Acrescenta as medições de uma execução ao arquivo JSON lines (uma linha por etapa)"""
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    execucao = {'execucao': uuid.uuid4().hex[:12], 'data': datetime.now().isoformat(timespec='seconds'), **contexto}
+    with open(caminho, 'a', encoding='utf-8') as arquivo:
+        for registro in medicoes:
+            arquivo.write(json.dumps({**execucao, **registro}, ensure_ascii=False, default=str) + '\n')
+
+def imprimir_resumo_etapas(medicoes):
+    """Tabela com tempo, linhas e memória de cada etapa"""
+    total = sum(registro['segundos'] for registro in medicoes)
+    print(f"\n{'Etapa':<22}{'Tempo (s)':>11}{'%':>7}{'Entrada':>11}{'Saída':>11}{'Linhas/s':>12}{'Pico RSS (MB)':>15}")
+    for registro in medicoes:
+        def valor(chave):
+            return '-' if registro.get(chave) is None else f"{registro[chave]:,}"
+        percentual = 100 * registro['segundos'] / total if total else 0
+        print(f"{registro['etapa']:<22}{registro['segundos']:>11.3f}{percentual:>6.1f}%"
+              f"{valor('linhas_entrada'):>11}{valor('linhas_saida'):>11}{valor('linhas_por_segundo'):>12}"
+              f"{valor('pico_rss_mb'):>15}")
+    print(f"{'TOTAL':<22}{total:>11.3f}")
+
+def _salvar_perfil(perfil, quantidade=25):
+    """Grava o perfil do cProfile em DIRETORIO_METRICAS e imprime as funções mais custosas"""
+    os.makedirs(DIRETORIO_METRICAS, exist_ok=True)
+    caminho = os.path.join(DIRETORIO_METRICAS, f"perfil_{datetime.now():%Y%m%d_%H%M%S}.prof")
+    perfil.dump_stats(caminho)
+    print(f"\nPerfil (cProfile) salvo em: {caminho}")
+    pstats.Stats(perfil).sort_stats('cumulative').print_stats(quantidade)
+    return caminho
+
+def separar_comissao_kg(df_base, plano_comissao_kg, tempos_regras=None, verboso=True):
+    """
+    Etapa 3: marca 'Comissao_Kg' e separa os itens por kg (excluídos da averiguação),
+    com a regra por kg de cada um em 'Regra_Comissao'. Retorna (df_comissao_kg, linhas_sem_kg):
+    as demais linhas seguem como máscara sobre df_base, sem virar um DataFrame à parte
+    """
+    regra_kg = regras_comissao_kg_em_lote(df_base, plano_comissao_kg, tempos_regras)
+    mask_kg = regra_kg.notna().to_numpy()
+    df_base['Comissao_Kg'] = mask_kg
+    
+    df_comissao_kg = df_base[mask_kg].assign(Regra_Comissao=regra_kg[mask_kg])
+    
+    if verboso:
+        print(f"- Itens para comissão por kg: {len(df_comissao_kg)}")
+    
+    return df_comissao_kg, ~mask_kg
+
+def aplicar_regras_fixas(df_base, plano_comissao_fixa, tempos_regras=None, linhas=None, verboso=True):
+    """
+    Etapa 4: calcula a comissão fixa esperada e o Status das linhas de df_base marcadas em
+    `linhas` (máscara do separar_comissao_kg; todas se None); retorna (df_regras, df_sem_regra)
+    """
+    linhas = np.ones(len(df_base), dtype=bool) if linhas is None else np.asarray(linhas, dtype=bool)
+    resultado_regras = aplicar_regras_comissao_fixa_em_lote(df_base, plano_comissao_fixa, tempos_regras, linhas)
+    
+    mask_regras = resultado_regras['Comissao_Esperada'].notna().to_numpy()
+    mask_sem_regra = linhas & ~mask_regras
+    df_regras = df_base[mask_regras].assign(**resultado_regras[mask_regras])
+    df_sem_regra = df_base[mask_sem_regra].assign(**resultado_regras[mask_sem_regra])
+    
+    df_regras['Status'] = _status_comissao(df_regras['P. Com'], df_regras['Comissao_Esperada'], 4)
+    
+    if verboso:
+        print(f"- Registros com regras fixas aplicadas: {len(df_regras)}")
+        print(f"  → Corretos: {(df_regras['Status'] == 'Correto').sum()}")
+        print(f"  → Incorretos: {(df_regras['Status'] == 'Incorreto').sum()}")
+        print(f"  → Com exceção por NF-E: {df_regras['Excecao_NFE'].notna().sum()}")
+    
+    return df_regras, df_sem_regra
+
+COLUNAS_PRECO_OFERTA = {'3%': 'Preço_Oferta_3%', '2%': 'Preço_Oferta_2%', '1%': 'Preço_Oferta_1%'}
+COLUNAS_LOGS_ERROS = ['CODPRODUTO', 'DATA', 'GRUPO', 'RAZAO']
+MENSAGEM_SEM_DATA = 'Data da venda vazia ou inválida: sem como escolher a oferta'
+
+def _ordenar_colunas_ofertas(df_ofertas):
+    """
+    Cada preço de oferta só aparece se alguma linha tiver esse preço, logo antes do
+    Status, na ordem em que surge pela primeira vez nas linhas (3%, 2%, 1% empatados)
+    """
+    precos = list(COLUNAS_PRECO_OFERTA.values())
+    vazias = [col for col in precos if col in df_ofertas.columns and not df_ofertas[col].notna().any()]
+    df_ofertas = df_ofertas.drop(columns=vazias)
+    presentes = [col for col in precos if col in df_ofertas.columns]
+    if not presentes:
+        return df_ofertas
+    primeira_linha = {col: int(np.argmax(df_ofertas[col].notna().to_numpy())) for col in presentes}
+    presentes.sort(key=lambda col: (primeira_linha[col], precos.index(col)))
+    demais = [col for col in df_ofertas.columns if col not in presentes]
+    if 'Status' in demais:
+        return df_ofertas[demais[:demais.index('Status')] + presentes + demais[demais.index('Status'):]]
+    return df_ofertas[demais + presentes]
+
+def processar_ofertas_vog(df_sem_regra, df_ofertas_vog, indice_ofertas=None, plano_ofertas=None, verboso=True):
+    """
+    Etapa 5: confere pelas ofertas VOG os itens sem regra fixa; retorna (resultados, sem oferta, erros).
+    As colunas da oferta são acrescentadas direto nas linhas com oferta, e a separação
+    entre com oferta e sem oferta é feita por máscara. Venda sem data (vazia ou inválida
+    na planilha) não tem como escolher a oferta: vai para os logs de erros, com o motivo
+    """
+    if verboso:
+        print(f"\n--- Processando ofertas VOG ---")
+        print(f"Códigos com oferta disponível: {df_ofertas_vog['COD'].nunique()}")
+    
+    if plano_ofertas is None:
+        plano_ofertas = carregar_plano_regras()['ofertas']
+    ofertas_associadas = associar_ofertas_em_lote(df_sem_regra, df_ofertas_vog, indice_ofertas, verboso)
+    
+    grupo = _chave(df_sem_regra, 'GRUPO')
+    comissoes_oferta = classificar_comissao_por_oferta_em_lote(
+        df_sem_regra['Preço_Venda'],
+        ofertas_associadas.get('3%'), ofertas_associadas.get('2%'), ofertas_associadas.get('1%'),
+        grupo, _chave(df_sem_regra, 'GRUPO PRODUTO'),
+        _eh_devolucao(_chave(df_sem_regra, 'CF')), plano_ofertas
+    )
+    
+    tem_oferta = ofertas_associadas['DT_REF_OFF'].notna().to_numpy()
+    
+    preco = df_sem_regra['Preço_Venda'].astype('float64')
+    colunas_oferta = {
+        'Preço - 5%': preco.where(grupo.isin(plano_ofertas['grupos_desconto']).to_numpy()) * 0.95,
+        'Data_Oferta': ofertas_associadas['DT_REF_OFF'],
+        'Data_Fim_Oferta': ofertas_associadas['DT_FIM_OFF'],
+        'Comissão_Correta': pd.Series(comissoes_oferta, index=df_sem_regra.index),
+        'Tipo': 'VOG',
+        'Tipo_Oferta': ofertas_associadas['Tipo_Oferta'],
+    }
+    for coluna, nome in COLUNAS_PRECO_OFERTA.items():
+        if coluna in ofertas_associadas.columns:
+            colunas_oferta[nome] = ofertas_associadas[coluna]
+    
+    df_resultados_ofertas = df_sem_regra[tem_oferta].assign(**{
+        nome: valores[tem_oferta] if isinstance(valores, pd.Series) else valores
+        for nome, valores in colunas_oferta.items()})
+    df_resultados_ofertas['Status'] = _status_comissao(
+        df_resultados_ofertas['P. Com'], df_resultados_ofertas['Comissão_Correta'], 4)
+    df_resultados_ofertas = _ordenar_colunas_ofertas(df_resultados_ofertas)
+    
+    sem_data = df_sem_regra['DATA'].isna().to_numpy()
+    df_sem_oferta_final = df_sem_regra[~tem_oferta & ~sem_data]
+    df_logs_erros = df_sem_regra.loc[sem_data, COLUNAS_LOGS_ERROS].assign(Mensagem=MENSAGEM_SEM_DATA)
+
+    if verboso:
+        print(f"- Itens com oferta VOG encontrada: {len(df_resultados_ofertas)}")
+        print(f"- Itens sem oferta encontrada: {len(df_sem_oferta_final)}")
+        print(f"- Vendas sem data (logs de erros): {len(df_logs_erros)}")
+    
+    if verboso and not df_resultados_ofertas.empty:
+        print(f"  → Ofertas Corretas: {(df_resultados_ofertas['Status'] == 'Correto').sum()}")
+        print(f"  → Ofertas Incorretas: {(df_resultados_ofertas['Status'] == 'Incorreto').sum()}")
+    
+    return df_resultados_ofertas, df_sem_oferta_final, df_logs_erros
+
+def _abas_comissao_kg(df_comissao_kg):
+    """Aba 'Comissão-kg', já padronizada (vazia se não houver itens por kg)"""
+    df_comissao_kg = _sem_chaves(df_comissao_kg)
+    if df_comissao_kg.empty:
+        return {}
+    df_comissao_kg = df_comissao_kg.drop(columns=['Comissao_Kg'], errors='ignore')
+    return {'Comissão-kg': padronizar_colunas(df_comissao_kg)}
+
+def _abas_regras(df_regras):
+    """Abas 'O Regras' (corretas) e 'X Regras' (incorretas), já padronizadas"""
+    df_regras = _sem_chaves(df_regras)
+    abas = {}
+    for nome_aba, status in (('O Regras', 'Correto'), ('X Regras', 'Incorreto')):
+        df_status = df_regras[df_regras['Status'] == status]
+        if not df_status.empty:
+            df_status = df_status.drop(columns=['Comissao_Kg', 'Status'], errors='ignore')
+            abas[nome_aba] = padronizar_colunas(df_status)
+    return abas
+
+def _abas_ofertas(df_resultados_ofertas, df_sem_oferta_final):
+    """Abas 'O Ofertas', 'X Ofertas' e 'Sem Oferta', já padronizadas"""
+    df_resultados_ofertas, df_sem_oferta_final = _sem_chaves(df_resultados_ofertas), _sem_chaves(df_sem_oferta_final)
+    abas = {}
+    if not df_resultados_ofertas.empty:
+        for nome_aba, status in (('O Ofertas', 'Correto'), ('X Ofertas', 'Incorreto')):
+            df_status = df_resultados_ofertas[df_resultados_ofertas['Status'] == status]
+            if not df_status.empty:
+                df_status = df_status.drop(
+                    columns=['Comissao_Kg', 'Comissao_Esperada', 'Excecao_NFE', 'Status', 'Tipo_Oferta'],
+                    errors='ignore')
+                abas[nome_aba] = padronizar_colunas(df_status)
+
+    if not df_sem_oferta_final.empty:
+        df_sem_oferta_final = df_sem_oferta_final.drop(
+            columns=['Comissao_Kg', 'Comissao_Esperada', 'Excecao_NFE'],
+            errors='ignore')
+        abas['Sem Oferta'] = padronizar_colunas(df_sem_oferta_final)
+    return abas
+
+def _abas_cobertura_e_erros(df_cobertura, df_logs_erros):
+    """Abas de cobertura das regras e de logs de erros (cada uma só se tiver linhas)"""
+    abas = {}
+    if df_cobertura is not None and not df_cobertura.empty:
+        abas[ABA_COBERTURA_REGRAS] = df_cobertura
+    if not df_logs_erros.empty:
+        abas['Logs Erros'] = df_logs_erros
+    return abas
+
+def montar_abas_saida(df_comissao_kg, df_regras, df_resultados_ofertas, df_sem_oferta_final, df_logs_erros,
+                      df_diferencas=None, df_cobertura=None):
+    """
+    Etapa 6: monta o dicionário aba -> DataFrame, já padronizado, para exportação.
+    Com df_diferencas (de agregar_diferencas) inclui as abas de resumo em R$ e, com
+    df_cobertura (de relatorio_cobertura_regras), a aba de cobertura das regras
+    """
+    # Preparar dicionário com todos os DataFrames
+    dfs_para_salvar = {}
+    
+    # 1. Comissão por Kg
+    dfs_para_salvar.update(_abas_comissao_kg(df_comissao_kg))
+    
+    # 2 e 3. Regras corretas e incorretas
+    dfs_para_salvar.update(_abas_regras(df_regras))
+    
+    # 4 a 6. Ofertas corretas, incorretas e itens sem oferta
+    dfs_para_salvar.update(_abas_ofertas(df_resultados_ofertas, df_sem_oferta_final))
+
+    # 7. Resumos da diferença em R$
+    dfs_para_salvar.update(montar_abas_resumo(df_diferencas))
+
+    # 8 e 9. Cobertura das regras e logs de erros
+    dfs_para_salvar.update(_abas_cobertura_e_erros(df_cobertura, df_logs_erros))
+    
+    return dfs_para_salvar
+
+def executar_etapas(df_base, df_ofertas_vog, plano_comissao_kg, plano_comissao_fixa, medicoes, indice_ofertas=None,
+                    plano_ofertas=None, tempos_regras=None, verboso=True):
+    """
+    Etapas 3 a 5 sobre as linhas de df_base; retorna os DataFrames de cada destino.
+    tempos_regras (opcional) acumula o tempo de cada etapa dos planos de regras;
+    verboso=False cala as contagens de cada etapa (os avisos saem sempre)
+    """
+    with medir_etapa(medicoes, 'comissao_kg', len(df_base)) as registro:
+        df_comissao_kg, linhas_sem_kg = separar_comissao_kg(df_base, plano_comissao_kg, tempos_regras, verboso)
+        registro['linhas_saida'] = int(linhas_sem_kg.sum())
+    
+    with medir_etapa(medicoes, 'regras_fixas', int(linhas_sem_kg.sum())) as registro:
+        df_regras, df_sem_regra = aplicar_regras_fixas(df_base, plano_comissao_fixa, tempos_regras, linhas_sem_kg,
+                                                       verboso)
+        registro['linhas_saida'] = len(df_regras)
+    
+    with medir_etapa(medicoes, 'ofertas_vog', len(df_sem_regra)) as registro:
+        df_resultados_ofertas, df_sem_oferta_final, df_logs_erros = processar_ofertas_vog(
+            df_sem_regra, df_ofertas_vog, indice_ofertas, plano_ofertas, verboso)
+        registro['linhas_saida'] = len(df_resultados_ofertas)
+    
+    return {
+        'comissao_kg': df_comissao_kg,
+        'regras': df_regras,
+        'ofertas': df_resultados_ofertas,
+        'sem_oferta': df_sem_oferta_final,
+        'erros': df_logs_erros,
+    }
+
+# ===== Resumo das diferenças em R$ =====
+
+# Origem da comissão esperada das linhas conferidas: destino -> coluna da comissão esperada
+COMISSAO_ESPERADA_DESTINO = {'regras': 'Comissao_Esperada', 'ofertas': 'Comissão_Correta'}
+CHAVES_RESUMO = ['VENDEDOR', 'GRUPO', 'RAZAO', 'Mes']
+MEDIDAS_RESUMO = ['Linhas', 'Linhas Incorretas', 'Vendas R$', 'Diferença R$', 'Pago a Mais R$', 'Pago a Menos R$']
+# Aba -> chaves do agrupamento, tiradas da base já agregada (sem voltar às linhas)
+ABAS_RESUMO = {
+    'Resumo Vendedor': ['VENDEDOR', 'Mes'],
+    'Resumo Grupo': ['GRUPO', 'Mes'],
+    'Resumo Razão': ['GRUPO', 'RAZAO', 'Mes'],
+}
+ABA_PIVO_RESUMO = 'Vendedor x Mês'
+
+def _somar_diferencas(partes):
+    """Junta bases de diferenças (de destinos ou blocos) e soma as medidas por VENDEDOR, GRUPO, RAZAO e mês"""
+    partes = [parte for parte in partes if parte is not None and not parte.empty]
+    if not partes:
+        return pd.DataFrame(columns=CHAVES_RESUMO + MEDIDAS_RESUMO)
+    df = pd.concat(partes, ignore_index=True) if len(partes) > 1 else partes[0]
+    # Categorias diferentes entre as partes viram object no concat; o groupby fica mais leve em category,
+    # com as categorias em ordem alfabética para as abas saírem ordenadas por nome
+    df = df.assign(**{chave: df[chave].astype('category') for chave in CHAVES_RESUMO[:-1]})
+    df = df.assign(**{chave: df[chave].cat.set_categories(sorted(df[chave].cat.categories))
+                      for chave in CHAVES_RESUMO[:-1]})
+    return df.groupby(CHAVES_RESUMO, observed=True, dropna=False, sort=False)[MEDIDAS_RESUMO].sum().reset_index()
+
+def agregar_diferencas(resultados):
+    """
+    Impacto em R$ das linhas conferidas pelas regras fixas e pelas ofertas VOG: nas
+    incorretas, (P. Com - comissão esperada) x Preço_Venda x QTDE (sem a coluna QTDE,
+    uma unidade), positivo quando a comissão foi paga a mais. As comissões passam pela
+    mesma normalização percentual da conferência (P. Com 3 é 3%). Retorna as somas por VENDEDOR, GRUPO, RAZAO (chaves normalizadas)
+    e mês (primeiro dia), base de todas as abas de resumo
+    """
+    partes = []
+    for destino, coluna_esperada in COMISSAO_ESPERADA_DESTINO.items():
+        df = resultados[destino]
+        if df.empty:
+            continue
+        incorreta = (df['Status'] == 'Incorreto').to_numpy()
+        valor = df['Preço_Venda'].to_numpy(dtype='float64')
+        if COLUNA_QUANTIDADE_FEC_PQ in df.columns:
+            valor = valor * df[COLUNA_QUANTIDADE_FEC_PQ].to_numpy(dtype='float64')
+        atual = _converter_para_decimal_percentual(df['P. Com']).to_numpy()
+        esperada = _converter_para_decimal_percentual(df[coluna_esperada]).to_numpy()
+        diferenca = np.where(incorreta, (atual - esperada) * valor, 0.0)
+        partes.append(pd.DataFrame({
+            **{chave: _chave(df, chave).reset_index(drop=True) for chave in CHAVES_RESUMO[:-1]},
+            'Mes': df['DATA'].to_numpy(dtype='datetime64[M]').astype('datetime64[s]'),
+            'Linhas': 1,
+            'Linhas Incorretas': incorreta.astype('int64'),
+            'Vendas R$': valor,
+            'Diferença R$': diferenca,
+            'Pago a Mais R$': np.where(diferenca > 0, diferenca, 0.0),
+            'Pago a Menos R$': np.where(diferenca < 0, -diferenca, 0.0),
+        }))
+    return _somar_diferencas(partes)
+
+def _rotulo_mes(meses):
+    """'AAAA-MM' de cada mês (formatando só os meses distintos); 'Sem data' para NaT"""
+    posicoes, unicos = pd.factorize(meses)
+    rotulos = np.append(pd.DatetimeIndex(unicos).strftime('%Y-%m').to_numpy(dtype=object), 'Sem data')
+    return pd.Series(rotulos[posicoes], index=meses.index)  # NaT fica na posição -1: 'Sem data'
+
+def montar_abas_resumo(df_diferencas):
+    """Abas de resumo (por vendedor, grupo e razão, mês a mês) e a tabela vendedor x mês da diferença em R$"""
+    if df_diferencas is None or df_diferencas.empty:
+        return {}
+    abas = {}
+    for nome, chaves in ABAS_RESUMO.items():
+        df_resumo = (df_diferencas.groupby(chaves, observed=True, dropna=False)[MEDIDAS_RESUMO].sum()
+                     .reset_index())
+        df_resumo['Mes'] = _rotulo_mes(df_resumo['Mes'])
+        abas[nome] = df_resumo.rename(columns={'Mes': 'MES'})
+    
+    df_pivo = df_diferencas.pivot_table(index='VENDEDOR', columns='Mes', values='Diferença R$', aggfunc='sum',
+                                        fill_value=0.0, observed=True, dropna=False)
+    df_pivo.columns = [f"R$ {rotulo}" for rotulo in _rotulo_mes(pd.Series(df_pivo.columns, dtype='datetime64[s]'))]
+    df_pivo['R$ Total'] = df_pivo.sum(axis=1)
+    abas[ABA_PIVO_RESUMO] = df_pivo.reset_index()
+    return abas
+
+# ===== Cobertura das regras =====
+
+ABA_COBERTURA_REGRAS = 'Cobertura Regras'
+SEM_REGRA = '(sem regra: conferida pelas ofertas VOG)'
+TIPOS_PLANO_REGRAS = {'comissao_kg': 'Comissão por kg', 'comissao_fixa': 'Regra fixa'}
+
+def contar_regras(resultados):
+    """Linhas decididas por cada regra (coluna Regra_Comissao) em todos os destinos"""
+    regras = [df['Regra_Comissao'] for nome, df in resultados.items()
+              if nome != 'erros' and 'Regra_Comissao' in df.columns]
+    if not regras:
+        return {}
+    return pd.concat(regras).fillna(SEM_REGRA).value_counts().to_dict()
+
+def _etapas_das_regras(plano):
+    """Posição da etapa do plano que avalia cada regra (regras sem chave própria ficam de fora)"""
+    etapas = {}
+    for posicao, etapa in enumerate(plano['etapas']):
+        nomes = [etapa['regra']] if 'regra' in etapa else pd.unique(etapa['regras'])
+        for nome in nomes:
+            etapas.setdefault(nome, posicao)
+    return etapas
+
+def relatorio_cobertura_regras(contagens, plano_comissao_kg, plano_comissao_fixa, tempos_regras=None):
+    """
+    Todas as regras na ordem em que são avaliadas (por kg, exceções por NF-E e regras
+    fixas), com as linhas que cada uma decidiu e o tempo da etapa que a avalia (etapas
+    vizinhas sobre as mesmas colunas são uma tabela só e dividem o tempo). Regras que
+    não decidiram nenhuma linha saem como 'Nunca usada'
+    """
+    tempos_regras = tempos_regras or {}
+    linhas = []
+    for chave_plano, plano in (('comissao_kg', plano_comissao_kg), ('comissao_fixa', plano_comissao_fixa)):
+        etapa_da_regra = _etapas_das_regras(plano)
+        excecoes_nfe = set(plano.get('excecoes_nfe', ()))
+        for nome in plano['regras']:
+            posicao = etapa_da_regra.get(nome)
+            linhas.append({
+                'Ordem': len(linhas) + 1,
+                'Tipo': 'Exceção NF-E' if nome in excecoes_nfe else TIPOS_PLANO_REGRAS[chave_plano],
+                'Regra': nome,
+                'Etapa': None if posicao is None else posicao + 1,
+                'Linhas': contagens.get(nome, 0),
+                'Segundos Etapa': None if posicao is None else round(tempos_regras.get((chave_plano, posicao), 0.0), 6),
+                'Situação': '' if contagens.get(nome, 0) else 'Nunca usada',
+            })
+    linhas.append({'Ordem': len(linhas) + 1, 'Tipo': 'Ofertas VOG', 'Regra': SEM_REGRA,
+                   'Linhas': contagens.get(SEM_REGRA, 0), 'Situação': ''})
+    return pd.DataFrame(linhas).astype({'Etapa': 'Int64'})
+
+def imprimir_regras_nunca_usadas(df_cobertura, limite=10):
+    nunca_usadas = df_cobertura.loc[df_cobertura['Situação'] == 'Nunca usada', 'Regra']
+    total = int((df_cobertura['Regra'] != SEM_REGRA).sum())
+    print(f"\nRegras nunca usadas: {len(nunca_usadas)} de {total} (detalhes na aba '{ABA_COBERTURA_REGRAS}')")
+    for nome in nunca_usadas.head(limite):
+        print(f"  - {nome}")
+    if len(nunca_usadas) > limite:
+        print(f"  ... e mais {len(nunca_usadas) - limite}")
+
+# ===== Reauditoria incremental =====
+
+# Estado da última execução por planilha: resultado de cada linha, com o hash do conteúdo
+DIRETORIO_ESTADO = os.path.join(os.path.expanduser('~'), '.averiguar_comissoes', 'estado')
+VERSAO_ESTADO = 2  # 2: NF-E, CF e nomes da FEC_PQ sempre como texto
+COLUNAS_CHAVE_LINHA = ['NF-E', 'Romaneio', 'CODPRODUTO']
+COLUNAS_IMPRESSAO_OFERTA = ['COD', 'DT_REF_OFF', '3%', '2%', '1%']
+DESTINOS_OFERTA = ('ofertas', 'sem_oferta', 'erros')  # Dependem das ofertas do código
+
+def _identificar_linhas(df_base):
+    """
+    Identificador de cada linha (NF-E|Romaneio|COD|ocorrência, para repetições da mesma
+    chave) e hash do conteúdo da linha
+    """
+    chave = df_base[COLUNAS_CHAVE_LINHA[0]].astype(str)
+    for coluna in COLUNAS_CHAVE_LINHA[1:]:
+        chave = chave + '|' + df_base[coluna].astype(str)
+    ocorrencia = chave.groupby(chave, sort=False).cumcount().astype(str)
+    return pd.DataFrame({
+        '_linha': (chave + '#' + ocorrencia).to_numpy(),
+        'hash': pd.util.hash_pandas_object(df_base, index=False).to_numpy(),
+        'COD': df_base['CODPRODUTO'].to_numpy(),
+    }, index=df_base.index)
+
+def _impressao_ofertas(df_ofertas_vog):
+    """Hash das ofertas de cada código (datas e preços, na ordem da planilha)"""
+    ofertas = df_ofertas_vog[[col for col in COLUNAS_IMPRESSAO_OFERTA if col in df_ofertas_vog.columns]].copy()
+    ofertas['_ordem'] = ofertas.groupby('COD', sort=False).cumcount()
+    ofertas['_hash'] = pd.util.hash_pandas_object(ofertas, index=False).to_numpy()
+    # Soma módulo 2**64 dos hashes das linhas (a ordem já entra pelo _ordem)
+    return ofertas.groupby('COD')['_hash'].sum()
+
+def _impressao_regras(identificacao_regras):
+    """Muda quando o arquivo de regras, as exceções por NF-E ou o próprio código mudam"""
+    conteudo = pickle.dumps((VERSAO_ESTADO, identificacao_regras))
+    return hashlib.sha256(_codigo_modulo() + conteudo).hexdigest()
+
+def _caminho_estado(caminho_origem):
+    nome = os.path.splitext(os.path.basename(caminho_origem))[0]
+    return os.path.join(DIRETORIO_ESTADO, f"{nome}.pkl")
+
+def _carregar_estado(caminho_estado, impressao_regras):
+    if not os.path.exists(caminho_estado):
+        print("Reauditoria incremental: sem estado anterior, processando todas as linhas")
+        return None
+    try:
+        with open(caminho_estado, 'rb') as arquivo:
+            estado = pickle.load(arquivo)
+    except Exception as e:
+        print(f"⚠️  Estado incremental ilegível ({e}), processando todas as linhas")
+        return None
+    if estado.get('versao') != VERSAO_ESTADO or estado.get('impressao_regras') != impressao_regras:
+        print("Reauditoria incremental: regras ou código alterados, processando todas as linhas")
+        return None
+    return estado
+
+def _salvar_estado(estado, caminho_estado):
+    os.makedirs(os.path.dirname(caminho_estado), exist_ok=True)
+    temporario = caminho_estado + '.tmp'
+    with open(temporario, 'wb') as arquivo:
+        pickle.dump(estado, arquivo, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporario, caminho_estado)
+
+def reauditar_incremental(df_base, df_ofertas_vog, plano_comissao_kg, identificacao_regras, plano_comissao_fixa,
+                          caminho_estado, medicoes, indice_ofertas=None, plano_ofertas=None, tempos_regras=None):
+    """
+    Reprocessa só as linhas novas ou alteradas e, entre as que foram conferidas pelas
+    ofertas VOG, as de códigos cujas ofertas mudaram. As demais reaproveitam o resultado
+    guardado da última execução. O resultado é o mesmo de uma execução completa.
+    `identificacao_regras` (hash do arquivo de regras e exceções por NF-E) invalida o
+    estado quando as regras mudam.
+    """
+    with medir_etapa(medicoes, 'incremental', len(df_base)) as registro:
+        linhas = _identificar_linhas(df_base)
+        impressao_ofertas = _impressao_ofertas(df_ofertas_vog)
+        impressao_regras = _impressao_regras(identificacao_regras)
+        estado = _carregar_estado(caminho_estado, impressao_regras)
+        
+        reaproveitar = np.zeros(len(df_base), dtype=bool)
+        if estado is not None:
+            anteriores = estado['linhas'].set_index('_linha')
+            posicoes = anteriores.index.get_indexer(linhas['_linha'])
+            conhecidas = posicoes >= 0
+            reaproveitar[conhecidas] = anteriores['hash'].to_numpy()[posicoes[conhecidas]] == linhas['hash'].to_numpy()[conhecidas]
+            
+            # Linhas que dependem das ofertas: só reaproveita se as ofertas do código não mudaram
+            destino = np.full(len(df_base), None, dtype=object)
+            destino[conhecidas] = anteriores['destino'].to_numpy()[posicoes[conhecidas]]
+            depende_oferta = pd.Series(destino).isin(DESTINOS_OFERTA).to_numpy()
+            oferta_atual = impressao_ofertas.reindex(linhas['COD']).to_numpy()
+            oferta_anterior = estado['ofertas'].reindex(linhas['COD']).to_numpy()
+            oferta_igual = (oferta_atual == oferta_anterior) | (pd.isna(oferta_atual) & pd.isna(oferta_anterior))
+            reaproveitar &= ~depende_oferta | oferta_igual
+        
+        registro['linhas_saida'] = int((~reaproveitar).sum())
+        print(f"Reauditoria incremental: {int(reaproveitar.sum())} linhas reaproveitadas, "
+              f"{int((~reaproveitar).sum())} a processar")
+    
+    df_processar = df_base[~reaproveitar].assign(_linha=linhas['_linha'][~reaproveitar])
+    # Roda mesmo sem linhas a processar: os destinos vazios saem com as colunas de uma execução completa
+    novos = executar_etapas(df_processar, df_ofertas_vog, plano_comissao_kg, plano_comissao_fixa, medicoes,
+                            indice_ofertas, plano_ofertas, tempos_regras)
+    # Os logs de erro não trazem a linha: são as que não chegaram a nenhum outro destino, na mesma ordem
+    if not novos['erros'].empty:
+        com_destino = set().union(*(novos[nome]['_linha'] for nome in novos if nome != 'erros' and not novos[nome].empty))
+        novos['erros']['_linha'] = [linha for linha in df_processar['_linha'] if linha not in com_destino]
+    
+    # Juntar o que foi reaproveitado e o que foi processado, na ordem da planilha
+    posicao_linha = pd.Series(np.arange(len(df_base)), index=linhas['_linha'].to_numpy())
+    linhas_reaproveitadas = set(linhas['_linha'][reaproveitar])
+    resultados = {}
+    for nome in ('comissao_kg', 'regras', 'ofertas', 'sem_oferta', 'erros'):
+        partes = []
+        if estado is not None and not estado['resultados'][nome].empty:
+            anterior = estado['resultados'][nome]
+            partes.append(anterior[anterior['_linha'].isin(linhas_reaproveitadas)])
+        partes = [parte for parte in partes + [novos[nome]] if not parte.empty]
+        if not partes:
+            resultados[nome] = novos[nome]
+            continue
+        df_destino = pd.concat(partes) if len(partes) > 1 else partes[0]
+        ordem = np.argsort(posicao_linha.reindex(df_destino['_linha']).to_numpy(), kind='stable')
+        df_destino = df_destino.iloc[ordem]
+        if nome in DESTINOS_OFERTA:
+            df_destino = df_destino.reset_index(drop=True)
+        resultados[nome] = _ordenar_colunas_ofertas(df_destino) if nome == 'ofertas' else df_destino
+    
+    destino_linha = pd.Series(None, index=linhas['_linha'].to_numpy(), dtype=object)
+    for nome, df_destino in resultados.items():
+        if not df_destino.empty:
+            destino_linha.loc[df_destino['_linha'].to_numpy()] = nome
+    _salvar_estado({
+        'versao': VERSAO_ESTADO,
+        'impressao_regras': impressao_regras,
+        'linhas': linhas.assign(destino=destino_linha.to_numpy()),
+        'ofertas': impressao_ofertas,
+        'resultados': resultados,
+    }, caminho_estado)
+    
+    return {nome: df_destino.drop(columns=['_linha'], errors='ignore') for nome, df_destino in resultados.items()}
+
+# ===== Histórico de resultados =====
+
+# Linhas classificadas de cada execução num SQLite local, indexado para consultas entre
+# meses (ex.: as linhas incorretas de um grupo no último ano) sem abrir as planilhas
+CAMINHO_HISTORICO = os.path.join(os.path.expanduser('~'), '.averiguar_comissoes', 'historico.sqlite')
+VERSAO_HISTORICO = 1
+DESTINOS_HISTORICO = ('comissao_kg', 'regras', 'ofertas', 'sem_oferta')
+# Coluna do histórico -> colunas dos resultados (vale a primeira presente no destino)
+COLUNAS_HISTORICO = {
+    'cf': ['CF'],
+    'razao': ['RAZAO'],
+    'chave_razao': ['chave_RAZAO'],
+    'grupo': ['GRUPO'],
+    'chave_grupo': ['chave_GRUPO'],
+    'nfe': ['NF-E'],
+    'data': ['DATA'],
+    'vendedor': ['VENDEDOR'],
+    'chave_vendedor': ['chave_VENDEDOR'],
+    'codproduto': ['CODPRODUTO'],
+    'grupo_produto': ['GRUPO PRODUTO'],
+    'descricao': ['DESCRICAO'],
+    'p_com': ['P. Com'],
+    'comissao_esperada': ['Comissão_Correta', 'Comissao_Esperada'],
+    'preco_venda': ['Preço_Venda'],
+    'romaneio': ['Romaneio'],
+    'excecao_nfe': ['Excecao_NFE'],
+    'tipo_oferta': ['Tipo_Oferta'],
+    'data_oferta': ['Data_Oferta'],
+    'data_fim_oferta': ['Data_Fim_Oferta'],
+    'status': ['Status'],
+}
+COLUNAS_DATA_HISTORICO = ('data', 'data_oferta', 'data_fim_oferta')
+ESQUEMA_HISTORICO = """
+CREATE TABLE IF NOT EXISTS execucoes (
+    id INTEGER PRIMARY KEY,
+    arquivo TEXT NOT NULL,
+    caminho TEXT,
+    processado_em TEXT NOT NULL,
+    hash_regras TEXT,
+    linhas INTEGER,
+    concluida INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS linhas (
+    execucao INTEGER NOT NULL REFERENCES execucoes (id),
+    destino TEXT NOT NULL,
+    cf TEXT, razao TEXT, chave_razao TEXT, grupo TEXT, chave_grupo TEXT, nfe INTEGER, data TEXT,
+    vendedor TEXT, chave_vendedor TEXT, codproduto INTEGER, grupo_produto TEXT, descricao TEXT,
+    p_com REAL, comissao_esperada REAL, preco_venda REAL, romaneio INTEGER, excecao_nfe TEXT,
+    tipo_oferta TEXT, data_oferta TEXT, data_fim_oferta TEXT, status TEXT
+);
+CREATE INDEX IF NOT EXISTS linhas_vendedor ON linhas (chave_vendedor, data);
+CREATE INDEX IF NOT EXISTS linhas_grupo ON linhas (chave_grupo, data);
+CREATE INDEX IF NOT EXISTS linhas_codproduto ON linhas (codproduto, data);
+CREATE INDEX IF NOT EXISTS linhas_status ON linhas (status, data);
+CREATE INDEX IF NOT EXISTS linhas_data ON linhas (data);
+CREATE INDEX IF NOT EXISTS linhas_execucao ON linhas (execucao);
+CREATE INDEX IF NOT EXISTS execucoes_arquivo ON execucoes (arquivo);
+"""
+
+def abrir_historico(caminho=CAMINHO_HISTORICO):
+    """Abre (criando, se preciso) o banco do histórico"""
+    os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+    # O timeout espera os outros processos do lote, que gravam no mesmo arquivo
+    conexao = sqlite3.connect(caminho, timeout=60)
+    conexao.execute('PRAGMA journal_mode=WAL')
+    conexao.execute('PRAGMA synchronous=NORMAL')
+    conexao.execute('PRAGMA cache_size=-65536')  # 64 MB: os índices crescem fora de ordem a cada inserção em bloco
+    versao = conexao.execute('PRAGMA user_version').fetchone()[0]
+    if versao not in (0, VERSAO_HISTORICO):
+        conexao.close()
+        raise ValueError(f"Histórico {caminho} está na versão {versao}; esperada {VERSAO_HISTORICO}")
+    conexao.executescript(ESQUEMA_HISTORICO)
+    conexao.execute(f'PRAGMA user_version = {VERSAO_HISTORICO}')
+    return conexao
+
+def iniciar_execucao_historico(conexao, caminho_origem, hash_regras=None):
+    """Registra a execução da planilha e retorna o seu id; as consultas só a veem depois de concluída"""
+    cursor = conexao.execute(
+        'INSERT INTO execucoes (arquivo, caminho, processado_em, hash_regras, linhas) VALUES (?, ?, ?, ?, 0)',
+        (os.path.basename(caminho_origem), os.path.abspath(caminho_origem),
+         datetime.now().isoformat(timespec='seconds'), hash_regras))
+    return cursor.lastrowid
+
+def descartar_execucao_historico(conexao, execucao):
+    """Remove uma execução e as suas linhas do histórico"""
+    conexao.execute('DELETE FROM linhas WHERE execucao = ?', (execucao,))
+    conexao.execute('DELETE FROM execucoes WHERE id = ?', (execucao,))
+
+def concluir_execucao_historico(conexao, execucao):
+    """
+    Confirma a execução. Uma planilha reprocessada substitui as linhas das execuções
+    anteriores dela, para que a mesma planilha não conte duas vezes nas consultas
+    """
+    anteriores = conexao.execute(
+        'SELECT id FROM execucoes WHERE arquivo = (SELECT arquivo FROM execucoes WHERE id = ?) AND id <> ?',
+        (execucao, execucao)).fetchall()
+    for (anterior,) in anteriores:
+        descartar_execucao_historico(conexao, anterior)
+    conexao.execute('UPDATE execucoes SET concluida = 1 WHERE id = ?', (execucao,))
+    conexao.commit()
+    conexao.execute('PRAGMA analysis_limit = 1000')  # Estatísticas por amostragem: rápido mesmo com anos de histórico
+    conexao.execute('PRAGMA optimize = 0x10002')
+
+def _valores_historico(df, coluna):
+    """Coluna do histórico como lista de valores Python (None no lugar de NaN/NaT)"""
+    origem = next((nome for nome in COLUNAS_HISTORICO[coluna] if nome in df.columns), None)
+    if origem is None:
+        return itertools.repeat(None, len(df))
+    serie = df[origem]
+    if coluna in COLUNAS_DATA_HISTORICO:
+        serie = pd.to_datetime(serie, errors='coerce').dt.strftime('%Y-%m-%d')
+    valores = serie.to_numpy(dtype=object)
+    valores[pd.isna(valores)] = None
+    return valores
+
+def gravar_historico(conexao, execucao, resultados):
+    """Insere em bloco as linhas de cada destino dos resultados; retorna quantas foram gravadas"""
+    colunas = list(COLUNAS_HISTORICO)
+    instrucao = (f"INSERT INTO linhas (execucao, destino, {', '.join(colunas)}) "
+                 f"VALUES ({', '.join('?' * (len(colunas) + 2))})")
+    gravadas = 0
+    for destino in DESTINOS_HISTORICO:
+        df = resultados.get(destino)
+        if df is None or df.empty:
+            continue
+        conexao.executemany(instrucao, zip(itertools.repeat(execucao), itertools.repeat(destino),
+                                           *(_valores_historico(df, coluna) for coluna in colunas)))
+        gravadas += len(df)
+    conexao.execute('UPDATE execucoes SET linhas = linhas + ? WHERE id = ?', (gravadas, execucao))
+    return gravadas
+
+def _fechar_historico(conexao):
+    """Fecha a conexão (o que não foi confirmado é desfeito); retorna None para descartá-la"""
+    if conexao is not None:
+        conexao.close()
+    return None
+
+def registrar_historico(resultados, caminho_origem, hash_regras=None, caminho=CAMINHO_HISTORICO):
+    """Grava os resultados de uma planilha no histórico, numa única transação"""
+    conexao = abrir_historico(caminho)
+    try:
+        execucao = iniciar_execucao_historico(conexao, caminho_origem, hash_regras)
+        gravadas = gravar_historico(conexao, execucao, resultados)
+        concluir_execucao_historico(conexao, execucao)
+        return gravadas
+    finally:
+        _fechar_historico(conexao)
+
+def _descartar_historico_parcial(conexao, execucao):
+    """Desfaz os blocos já confirmados de uma execução interrompida e fecha a conexão"""
+    try:
+        conexao.rollback()
+        descartar_execucao_historico(conexao, execucao)
+        conexao.commit()
+    except sqlite3.Error as e:
+        print(f"⚠️  Execução {execucao} ficou incompleta no histórico: {e}")
+    return _fechar_historico(conexao)
+
+def consultar_historico(status=None, vendedor=None, grupo=None, codproduto=None, desde=None, ate=None,
+                        caminho=CAMINHO_HISTORICO):
+    """
+    Linhas do histórico que atendem a todos os filtros informados, com o arquivo de
+    origem de cada uma. VENDEDOR e GRUPO são comparados pela chave normalizada;
+    `desde` e `ate` (datas ou 'AAAA-MM-DD') limitam a DATA da venda, inclusive.
+
+    Ex.: consultar_historico(status='Incorreto', grupo='REDE ROSSI', desde='2025-08-01')
+    """
+    filtros = ['e.concluida = 1']
+    parametros = []
+    for expressao, valor in (('l.status = ?', status),
+                             ('l.chave_vendedor = ?', normalizar_nome(vendedor) if vendedor is not None else None),
+                             ('l.chave_grupo = ?', normalizar_nome(grupo) if grupo is not None else None),
+                             ('l.codproduto = ?', int(codproduto) if codproduto is not None else None),
+                             ('l.data >= ?', pd.Timestamp(desde).strftime('%Y-%m-%d') if desde is not None else None),
+                             ('l.data <= ?', pd.Timestamp(ate).strftime('%Y-%m-%d') if ate is not None else None)):
+        if valor is not None:
+            filtros.append(expressao)
+            parametros.append(valor)
+    consulta = ("SELECT e.arquivo, l.* FROM linhas l JOIN execucoes e ON e.id = l.execucao "
+                f"WHERE {' AND '.join(filtros)} ORDER BY l.data, e.arquivo")
+    
+    conexao = abrir_historico(caminho)
+    try:
+        return pd.read_sql_query(consulta, conexao, params=parametros, parse_dates=list(COLUNAS_DATA_HISTORICO))
+    finally:
+        conexao.close()
+
+# Planilha processada quando o script é executado sem argumentos
+CAMINHO_ORIGEM_PADRAO = r"C:\Users\DELL\Downloads\260722_MRG.xlsx"
+NOME_SAIDA_PADRAO = 'Averiguar_Comissoes (MARGEM).xlsx'
+
+def compilar_planos(caminho_regras=CAMINHO_REGRAS):
+    """
+    Carrega o plano compilado do arquivo de regras e as exceções do CSV uma única vez,
+    para serem reaproveitados entre planilhas (e enviados aos processos do lote)
+    """
+    plano_regras = carregar_plano_regras(caminho_regras)
+    excecoes_nfe = carregar_excecoes_nfe()
+    return {
+        'hash_regras': plano_regras['hash'],
+        'comissao_kg': plano_regras['comissao_kg'],
+        'regras_fixas': plano_regras['comissao_fixa'],
+        'ofertas': plano_regras['ofertas'],
+        'excecoes_nfe': excecoes_nfe,
+        'comissao_fixa': com_excecoes_nfe(plano_regras['comissao_fixa'], excecoes_nfe),
+    }
+
+def _plano_comissao_fixa(planos, df_excecoes_planilha):
+    """Exceções por NF-E e plano das regras fixas; as exceções mudam só se a planilha trouxer a aba EXC_NFE"""
+    if df_excecoes_planilha is None or df_excecoes_planilha.empty:
+        return planos['excecoes_nfe'], planos['comissao_fixa']
+    excecoes_nfe = carregar_excecoes_nfe(df_planilha=df_excecoes_planilha)
+    return excecoes_nfe, com_excecoes_nfe(planos['regras_fixas'], excecoes_nfe)
+
+def _contagens_resultados(resultados):
+    """Contagens de cada destino (corretos e incorretos), para o resumo da planilha"""
+    df_regras = resultados['regras']
+    df_resultados_ofertas = resultados['ofertas']
+    status_ofertas = df_resultados_ofertas['Status'] if not df_resultados_ofertas.empty else pd.Series(dtype=object)
+    return {
+        'Comissao_Kg': len(resultados['comissao_kg']),
+        'Regras_Corretas': int((df_regras['Status'] == 'Correto').sum()),
+        'Regras_Incorretas': int((df_regras['Status'] == 'Incorreto').sum()),
+        'Ofertas_Corretas': int((status_ofertas == 'Correto').sum()),
+        'Ofertas_Incorretas': int((status_ofertas == 'Incorreto').sum()),
+        'Sem_Oferta': len(resultados['sem_oferta']),
+        'Erros': len(resultados['erros']),
+    }
+
+def processar_planilhas(caminho_origem=CAMINHO_ORIGEM_PADRAO, caminho_saida=None, planos=None,
+                        perfil=False, caminho_metricas=CAMINHO_METRICAS, incremental=False,
+                        caminho_historico=CAMINHO_HISTORICO):
+    """
+    Processa a planilha de origem medindo cada etapa (tempo, linhas, pico de memória).
+    As medições são impressas ao final e acrescentadas em `caminho_metricas` (JSON lines;
+    None desliga). Com perfil=True a execução roda sob o cProfile. Com incremental=True
+    só as linhas novas/alteradas desde a última execução são reprocessadas. As linhas
+    classificadas também vão para o histórico em `caminho_historico` (None desliga).
+
+    Sem caminho_saida o resultado vai para Downloads. `planos` (de compilar_planos) evita
+    recompilar as regras a cada planilha. Retorna o resumo de contagens da planilha.
+    """
+    if caminho_saida is None:
+        caminho_saida = os.path.join(os.path.expanduser('~'), 'Downloads', NOME_SAIDA_PADRAO)
+    medicoes = []
+    perfilador = cProfile.Profile() if perfil else None
     
     try:
         print("=== INÍCIO DO PROCESSAMENTO ===")
+        if perfilador is not None:
+            perfilador.enable()
         
-        # 1. Ler os dados da aba FEC_PQ com cabeçalho na linha 10 (A10)
-        df_base = pd.read_excel(caminho_origem, sheet_name='FEC_PQ', header=9)
-        print(f"TOTAL DE REGISTROS NA BASE: {len(df_base)}")
-        
-        # Mapeamento de colunas
-        colunas_necessarias = {
-            'CF': 'CF',
-            'RAZAO': 'RAZAO',
-            'GRUPO': 'GRUPO',
-            'NF-E': 'NF-E',
-            'DATA': 'DATA',
-            'VENDEDOR': 'VENDEDOR',
-            'CODPRODUTO': 'CODPRODUTO',
-            'GRUPO PRODUTO': 'GRUPO PRODUTO',
-            'DESCRICAO': 'DESCRICAO',
-            'P. Com': 'P. Com',
-            'Preço Venda': 'PRECO VENDA',
-            'Romaneio': 'ROMANEIO'
-        }
+        # 1 e 2. Ler as abas FEC_PQ e OFF_VOG (uma única abertura da planilha, com snapshot)
+        with medir_etapa(medicoes, 'leitura') as registro:
+            dados_origem = ler_planilha_origem(caminho_origem)
+            df_base = dados_origem['FEC_PQ']
+            df_ofertas_vog = dados_origem['OFF_VOG']
+            registro['linhas_saida'] = len(df_base)
+        print(f"Registros tratados da base: {len(df_base)}")
+        print(f"Ofertas VOG válidas: {len(df_ofertas_vog)}")
         
-        # Verificar e ajustar colunas
-        for col_original, col_nova in colunas_necessarias.items():
-            if col_nova not in df_base.columns:
-                print(f"ATENÇÃO: Coluna '{col_nova}' não encontrada na aba FEC_PQ")
-                colunas_encontradas = [c for c in df_base.columns if c.upper().strip() == col_nova.upper().strip()]
-                if colunas_encontradas:
-                    print(f"  Encontrada coluna similar: {colunas_encontradas[0]}")
-                    colunas_necessarias[col_original] = colunas_encontradas[0]
-                else:
-                    print(f"  Coluna não encontrada! Valores disponíveis: {list(df_base.columns)[:20]}")
-        
-        # Selecionar e renomear colunas
-        df_base = df_base[list(colunas_necessarias.values())].copy()
-        df_base = df_base.rename(columns={
-            colunas_necessarias['CF']: 'CF',
-            colunas_necessarias['RAZAO']: 'RAZAO',
-            colunas_necessarias['GRUPO']: 'GRUPO',
-            colunas_necessarias['NF-E']: 'NF-E',
-            colunas_necessarias['DATA']: 'DATA',
-            colunas_necessarias['VENDEDOR']: 'VENDEDOR',
-            colunas_necessarias['CODPRODUTO']: 'CODPRODUTO',
-            colunas_necessarias['GRUPO PRODUTO']: 'GRUPO PRODUTO',
-            colunas_necessarias['DESCRICAO']: 'DESCRICAO',
-            colunas_necessarias['P. Com']: 'P. Com',
-            colunas_necessarias['Preço Venda']: 'Preço_Venda',
-            colunas_necessarias['Romaneio']: 'Romaneio'
-        })
-        
-        # Converter e formatar dados
-        df_base['DATA'] = pd.to_datetime(df_base['DATA']).dt.date
-        df_base['CODPRODUTO'] = pd.to_numeric(df_base['CODPRODUTO'], errors='coerce').fillna(0).astype('int64')
-        df_base['P. Com'] = df_base['P. Com'].apply(
-            lambda x: _converter_valor_oferta(x) if pd.notna(x) else np.nan
-        )
-        df_base['Preço_Venda'] = df_base['Preço_Venda'].apply(
-            lambda x: _converter_valor_oferta(x) if pd.notna(x) else np.nan
-        )
+        if planos is None:
+            planos = compilar_planos()
+        
+        excecoes_nfe, plano_comissao_fixa = _plano_comissao_fixa(planos, dados_origem['EXC_NFE'])
+        tempos_regras = {}
+        
+        with medir_etapa(medicoes, 'indice_ofertas', len(df_ofertas_vog)) as registro:
+            indice_ofertas = carregar_indice_ofertas(df_ofertas_vog)
+            registro['linhas_saida'] = len(indice_ofertas['chave'])
         
-        # 2. Ler OFF_VOG
-        print("\n--- Lendo aba OFF_VOG ---")
-        df_ofertas_vog = pd.read_excel(caminho_origem, sheet_name='OFF_VOG')
-        colunas_vog_disponiveis = df_ofertas_vog.columns.tolist()
-        print(f"Colunas disponíveis em OFF_VOG: {colunas_vog_disponiveis}")
-        
-        colunas_ofertas_vog = []
-        if 'COD' in colunas_vog_disponiveis:
-            colunas_ofertas_vog.append('COD')
-        if 'ITENS' in colunas_vog_disponiveis:
-            colunas_ofertas_vog.append('ITENS')
-        if '3%' in colunas_vog_disponiveis:
-            colunas_ofertas_vog.append('3%')
-        if '2%' in colunas_vog_disponiveis:
-            colunas_ofertas_vog.append('2%')
-        if '1%' in colunas_vog_disponiveis:
-            colunas_ofertas_vog.append('1%')
-        
-        if 'DT_REF_OFF' in colunas_vog_disponiveis:
-            colunas_ofertas_vog.append('DT_REF_OFF')
-        elif 'Data' in colunas_vog_disponiveis:
-            colunas_ofertas_vog.append('Data')
-            df_ofertas_vog = df_ofertas_vog.rename(columns={'Data': 'DT_REF_OFF'})
+        # 3 a 5. Regras por kg, regras fixas e ofertas VOG (só nas linhas alteradas, se incremental)
+        if incremental:
+            resultados = reauditar_incremental(
+                df_base, df_ofertas_vog, planos['comissao_kg'], (planos['hash_regras'], excecoes_nfe),
+                plano_comissao_fixa, _caminho_estado(caminho_origem), medicoes, indice_ofertas, planos['ofertas'],
+                tempos_regras)
         else:
-            raise ValueError("Não encontrada coluna de data em OFF_VOG")
-        
-        for col in ['Coluna1', 'PK_OFF']:
-            if col in colunas_vog_disponiveis:
-                colunas_ofertas_vog.append(col)
-        
-        df_ofertas_vog = df_ofertas_vog[colunas_ofertas_vog].dropna(subset=['COD', 'DT_REF_OFF'])
-        df_ofertas_vog['DT_REF_OFF'] = pd.to_datetime(df_ofertas_vog['DT_REF_OFF']).dt.date
-        df_ofertas_vog['COD'] = pd.to_numeric(df_ofertas_vog['COD'], errors='coerce').fillna(0).astype('int64')
-        
-        if '3%' in colunas_ofertas_vog:
-            df_ofertas_vog['3%'] = df_ofertas_vog['3%'].apply(
-                lambda x: _converter_valor_oferta(x) if pd.notna(x) else np.nan
-            )
-        if '2%' in colunas_ofertas_vog:
-            df_ofertas_vog['2%'] = df_ofertas_vog['2%'].apply(
-                lambda x: _converter_valor_oferta(x) if pd.notna(x) else np.nan
-            )
-        if '1%' in colunas_ofertas_vog:
-            df_ofertas_vog['1%'] = df_ofertas_vog['1%'].apply(
-                lambda x: _converter_valor_oferta(x) if pd.notna(x) else np.nan
-            )
-        
-        print(f"Total de ofertas cadastradas: {len(df_ofertas_vog)}")
-        print(f"Colunas em OFF_VOG: {colunas_ofertas_vog}")
-        
-        # 3. Aplicar regras de comissão por kg
-        regras_comissao_kg = criar_regras_comissao_kg()
-        df_base['Comissao_Kg'] = df_base.apply(
-            lambda row: pertence_comissao_kg(row, regras_comissao_kg), axis=1)
-        
-        df_comissao_kg = df_base[df_base['Comissao_Kg'] == True].copy()
-        df_sem_kg = df_base[df_base['Comissao_Kg'] == False].copy()
+            resultados = executar_etapas(df_base, df_ofertas_vog, planos['comissao_kg'], plano_comissao_fixa, medicoes,
+                                         indice_ofertas, planos['ofertas'], tempos_regras)
+        df_comissao_kg = resultados['comissao_kg']
+        df_regras = resultados['regras']
+        df_resultados_ofertas = resultados['ofertas']
+        df_sem_oferta_final = resultados['sem_oferta']
+        df_logs_erros = resultados['erros']
         
-        print(f"- Itens para comissão por kg: {len(df_comissao_kg)}")
+        with medir_etapa(medicoes, 'resumo_diferencas', len(df_regras) + len(df_resultados_ofertas)) as registro:
+            df_diferencas = agregar_diferencas(resultados)
+            registro['linhas_saida'] = len(df_diferencas)
         
-        # 4. Aplicar regras fixas
-        regras_comissao_fixa = criar_regras_comissao_fixa()
-        df_sem_kg['Comissao_Esperada'] = df_sem_kg.apply(
-            lambda row: aplicar_regras_comissao_fixa(row, regras_comissao_fixa), axis=1)
+        with medir_etapa(medicoes, 'cobertura_regras', len(df_base)) as registro:
+            df_cobertura = relatorio_cobertura_regras(
+                contar_regras(resultados), planos['comissao_kg'], plano_comissao_fixa, tempos_regras)
+            registro['linhas_saida'] = len(df_cobertura)
+        imprimir_regras_nunca_usadas(df_cobertura)
         
-        mask_regras = df_sem_kg['Comissao_Esperada'].notna()
-        df_regras = df_sem_kg[mask_regras].copy()
-        df_sem_regra = df_sem_kg[~mask_regras].copy()
+        # 6. Exportar para Excel
+        print(f"\nSALVANDO RESULTADOS EM: {caminho_saida}")
+        with medir_etapa(medicoes, 'exportacao') as registro:
+            dfs_para_salvar = montar_abas_saida(
+                df_comissao_kg, df_regras, df_resultados_ofertas, df_sem_oferta_final, df_logs_erros, df_diferencas,
+                df_cobertura)
+            registro['linhas_entrada'] = sum(len(df) for df in dfs_para_salvar.values())
+            
+            # Tentar salvar com tratamento de erro
+            arquivo_salvo = salvar_com_alternativas(dfs_para_salvar, caminho_saida)
         
-        df_regras['Status'] = df_regras.apply(
-            lambda row: 'Correto' if _comparar_comissoes(row['P. Com'], row['Comissao_Esperada'], 4) else 'Incorreto', 
-            axis=1)
+        # 7. Gravar as linhas classificadas no histórico
+        if caminho_historico:
+            with medir_etapa(medicoes, 'historico') as registro:
+                try:
+                    registro['linhas_entrada'] = registrar_historico(
+                        resultados, caminho_origem, planos['hash_regras'], caminho_historico)
+                    print(f"Histórico atualizado: {caminho_historico}")
+                except (sqlite3.Error, OSError, ValueError) as e:
+                    print(f"⚠️  Não foi possível gravar o histórico em {caminho_historico}: {e}")
+
+        print("\n=== PROCESSAMENTO CONCLUÍDO COM SUCESSO ===")
+        print(f"Arquivo salvo em: {arquivo_salvo}")
         
-        df_regras_corretas = df_regras[df_regras['Status'] == 'Correto']
-        df_regras_incorretas = df_regras[df_regras['Status'] == 'Incorreto']
+        return {
+            'Arquivo': caminho_origem,
+            'Saida': arquivo_salvo,
+            'Registros': len(df_base),
+            **_contagens_resultados(resultados),
+            'Segundos': round(sum(registro['segundos'] for registro in medicoes), 3),
+        }
         
-        print(f"- Registros com regras fixas aplicadas: {len(df_regras)}")
-        print(f"  → Corretos: {len(df_regras_corretas)}")
-        print(f"  → Incorretos: {len(df_regras_incorretas)}")
+    except Exception as e:
+        print(f"\nERRO CRÍTICO DURANTE O PROCESSAMENTO: {str(e)}")
+        traceback.print_exc()
+        raise
+    
+    finally:
+        if perfilador is not None:
+            perfilador.disable()
+            _salvar_perfil(perfilador)
+        if medicoes:
+            imprimir_resumo_etapas(medicoes)
+            if caminho_metricas:
+                try:
+                    registrar_medicoes(medicoes, caminho_metricas, arquivo=caminho_origem)
+                except OSError as e:
+                    print(f"⚠️  Não foi possível gravar as medições em {caminho_metricas}: {e}")
+
+# ===== Processamento em blocos =====
+
+# Linhas da FEC_PQ lidas e processadas por vez no modo em blocos (--blocos)
+LINHAS_POR_BLOCO_LEITURA = 100_000
+ORDEM_ABAS_SAIDA = ['Comissão-kg', 'O Regras', 'X Regras', 'O Ofertas', 'X Ofertas', 'Sem Oferta',
+                    *ABAS_RESUMO, ABA_PIVO_RESUMO, ABA_COBERTURA_REGRAS, 'Logs Erros']
+ABAS_OFERTAS = ('O Ofertas', 'X Ofertas')
+
+def _valor_celula(valor):
+    """Mesma conversão de célula do pd.read_excel: vazia -> '', erro do Excel -> NaN, número inteiro -> int"""
+    if valor is None:
+        return ''
+    if isinstance(valor, float) and valor.is_integer():
+        return int(valor)
+    if isinstance(valor, str) and valor in ERROR_CODES:
+        return np.nan
+    return valor
+
+def ler_fec_pq_em_blocos(caminho_origem, linhas_por_bloco=LINHAS_POR_BLOCO_LEITURA):
+    """
+    Lê a aba FEC_PQ em blocos de até `linhas_por_bloco` linhas com o openpyxl em modo
+    read-only, sem carregar a aba inteira. Cada bloco sai com as colunas usadas e as
+    células convertidas como no pd.read_excel (vazias como NaN), ainda sem tratar: os
+    tipos das colunas de chave são fixados depois pelo _preparar_fec_pq, em qualquer bloco
+    """
+    nomes_fec_pq = {nome.upper().strip() for nome in [*COLUNAS_FEC_PQ.values(), COLUNA_QUANTIDADE_FEC_PQ]}
+    planilha = openpyxl.load_workbook(caminho_origem, read_only=True, data_only=True, keep_links=False)
+    try:
+        # Cabeçalho da FEC_PQ na linha 10 (A10)
+        linhas = planilha['FEC_PQ'].iter_rows(min_row=10, values_only=True)
+        cabecalho = [_valor_celula(valor) for valor in next(linhas, ())]
+        posicoes = [i for i, col in enumerate(cabecalho) if str(col).upper().strip() in nomes_fec_pq]
+        nomes = [cabecalho[i] for i in posicoes]
         
-        # 5. Verificação das ofertas VOG
-        resultados_ofertas = []
-        registros_sem_oferta = []
-        logs_erros = []
+        def montar_bloco(valores):
+            df_bloco = pd.DataFrame(valores, columns=nomes, dtype=object)
+            return df_bloco.mask(df_bloco == '').infer_objects()
         
-        ofertas_por_codigo = df_ofertas_vog.groupby('COD')
-        codigos_com_oferta = set(ofertas_por_codigo.groups.keys())
+        bloco, vazias = [], 0
+        for linha in linhas:
+            # Linhas vazias só entram se houver linha preenchida depois (o fim da aba é descartado)
+            if all(valor is None for valor in linha):
+                vazias += 1
+                continue
+            bloco.extend([''] * len(posicoes) for _ in range(vazias))
+            vazias = 0
+            bloco.append([_valor_celula(linha[i]) if i < len(linha) else '' for i in posicoes])
+            if len(bloco) >= linhas_por_bloco:
+                yield montar_bloco(bloco)
+                bloco = []
+        if bloco:
+            yield montar_bloco(bloco)
+    finally:
+        planilha.close()
+
+def ler_ofertas_e_excecoes(caminho_origem):
+    """Abas OFF_VOG (tratada) e EXC_NFE (None se não existir), lidas inteiras: são pequenas"""
+    with pd.ExcelFile(caminho_origem) as planilha:
+        return _ler_off_vog_e_excecoes(planilha)
+
+def _acumular_medicoes(acumuladas, medicoes_bloco):
+    """Soma as medições de um bloco às das mesmas etapas nos blocos anteriores (pico de memória: o maior)"""
+    for registro in medicoes_bloco:
+        total = acumuladas.setdefault(registro['etapa'], {
+            'etapa': registro['etapa'], 'linhas_entrada': None, 'linhas_saida': None, 'segundos': 0.0, 'pico_rss_mb': None})
+        for chave in ('linhas_entrada', 'linhas_saida'):
+            if registro.get(chave) is not None:
+                total[chave] = (total[chave] or 0) + registro[chave]
+        total['segundos'] += registro['segundos']
+        if registro.get('pico_rss_mb') is not None:
+            total['pico_rss_mb'] = max(total['pico_rss_mb'] or 0, registro['pico_rss_mb'])
+        total['segundos'] = round(total['segundos'], 4)
+        linhas = total['linhas_entrada'] or total['linhas_saida']
+        total['linhas_por_segundo'] = round(linhas / total['segundos']) if linhas and total['segundos'] > 0 else None
+
+def _reservar_abas(reserva, abas, df_resultados_ofertas):
+    """
+    Grava em disco (pickle) as abas de saída de um bloco e guarda as colunas, os
+    formatos e a primeira linha, entre todos os blocos, de cada preço de oferta
+    """
+    for nome, df in abas.items():
+        if df is None or df.empty:
+            continue
+        aba = reserva['abas'].setdefault(nome, {'arquivos': [], 'colunas': [], 'formatos': {}, 'linhas': 0})
+        caminho = os.path.join(reserva['diretorio'], f"{ORDEM_ABAS_SAIDA.index(nome)}_{len(aba['arquivos'])}.pkl")
+        df.to_pickle(caminho)
+        aba['arquivos'].append(caminho)
+        aba['linhas'] += len(df)
+        aba['colunas'] += [col for col in df.columns if col not in aba['colunas']]
+        for coluna, formato in _formatos_colunas(df).items():
+            aba['formatos'].setdefault(coluna, formato)
+    
+    for coluna in COLUNAS_PRECO_OFERTA.values():
+        if coluna in df_resultados_ofertas.columns:
+            preenchidas = np.flatnonzero(df_resultados_ofertas[coluna].notna().to_numpy())
+            if len(preenchidas):
+                reserva['precos'].setdefault(coluna, reserva['linhas_ofertas'] + int(preenchidas[0]))
+    reserva['linhas_ofertas'] += len(df_resultados_ofertas)
+
+def _colunas_reservadas(reserva, nome):
+    """Colunas finais da aba; nas de ofertas, os preços na ordem de _ordenar_colunas_ofertas"""
+    colunas = reserva['abas'][nome]['colunas']
+    if nome not in ABAS_OFERTAS:
+        return colunas
+    precos = list(COLUNAS_PRECO_OFERTA.values())
+    presentes = sorted(reserva['precos'], key=lambda col: (reserva['precos'][col], precos.index(col)))
+    return [col for col in colunas if col not in precos] + presentes
+
+def _blocos_reservados(reserva, nome):
+    colunas = _colunas_reservadas(reserva, nome)
+    for arquivo in reserva['abas'][nome]['arquivos']:
+        yield pd.read_pickle(arquivo).reindex(columns=colunas)
+
+def _escrever_reserva(reserva, caminho):
+    """Grava no Excel as abas reservadas, bloco a bloco, na ordem de sempre das abas"""
+    nomes = sorted(reserva['abas'], key=ORDEM_ABAS_SAIDA.index)
+    if xlsxwriter is None:
+        print("⚠️  Sem o xlsxwriter cada aba é montada inteira na memória para o openpyxl")
+        _escrever_excel_openpyxl({nome: pd.concat(_blocos_reservados(reserva, nome)) for nome in nomes}, caminho)
+        return
+    _escrever_abas_xlsxwriter({
+        nome: (_colunas_reservadas(reserva, nome), reserva['abas'][nome]['formatos'], _blocos_reservados(reserva, nome))
+        for nome in nomes
+    }, caminho)
+
+def processar_planilhas_em_blocos(caminho_origem=CAMINHO_ORIGEM_PADRAO, caminho_saida=None, planos=None,
+                                  linhas_por_bloco=LINHAS_POR_BLOCO_LEITURA, caminho_metricas=CAMINHO_METRICAS,
+                                  caminho_historico=CAMINHO_HISTORICO):
+    """
+    Processa planilhas grandes demais para a memória: a FEC_PQ é lida em blocos de
+    `linhas_por_bloco` linhas e cada bloco passa pelas regras por kg, regras fixas e
+    ofertas VOG (contra o índice de ofertas inteiro). As abas de saída de cada bloco
+    vão para arquivos temporários e, no fim, são gravadas no Excel em streaming, de
+    modo que a memória depende do tamanho do bloco e não da planilha. Cada bloco
+    também é inserido no histórico (confirmado bloco a bloco, para não prender os
+    outros processos do lote); se o processamento falhar, a execução é descartada.
+
+    Retorna o mesmo resumo de processar_planilhas.
+    """
+    if caminho_saida is None:
+        caminho_saida = os.path.join(os.path.expanduser('~'), 'Downloads', NOME_SAIDA_PADRAO)
+    medicoes = []
+    acumuladas = {}
+    contagens = {}
+    registros = 0
+    historico = None
+    df_diferencas = None
+    contagens_regras = {}
+    tempos_regras = {}
+    
+    try:
+        print(f"=== INÍCIO DO PROCESSAMENTO EM BLOCOS DE {linhas_por_bloco:,} LINHAS ===")
+        with medir_etapa(medicoes, 'leitura_ofertas') as registro:
+            df_ofertas_vog, df_excecoes = ler_ofertas_e_excecoes(caminho_origem)
+            registro['linhas_saida'] = len(df_ofertas_vog)
         
-        print(f"\n--- Processando ofertas VOG ---")
-        print(f"Códigos com oferta disponível: {len(codigos_com_oferta)}")
+        if planos is None:
+            planos = compilar_planos()
+        _, plano_comissao_fixa = _plano_comissao_fixa(planos, df_excecoes)
+        
+        with medir_etapa(medicoes, 'indice_ofertas', len(df_ofertas_vog)) as registro:
+            indice_ofertas = carregar_indice_ofertas(df_ofertas_vog)
+            registro['linhas_saida'] = len(indice_ofertas['chave'])
         
-        for idx, row in df_sem_regra.iterrows():
+        if caminho_historico:
             try:
-                cod = int(float(row['CODPRODUTO']))
-                data = pd.to_datetime(row['DATA']).date()
-                preco = float(row['Preço_Venda'])
-                is_devolucao = str(row['CF']).startswith('DEV')
-                grupo = str(row['GRUPO']).strip().upper()
-                grupo_produto = str(row['GRUPO PRODUTO']).strip().upper()
+                historico = abrir_historico(caminho_historico)
+                execucao = iniciar_execucao_historico(historico, caminho_origem, planos['hash_regras'])
+                historico.commit()
+            except (sqlite3.Error, OSError, ValueError) as e:
+                print(f"⚠️  Não foi possível gravar o histórico em {caminho_historico}: {e}")
+                historico = _fechar_historico(historico)
+        
+        with tempfile.TemporaryDirectory(prefix='averiguar_comissoes_') as diretorio:
+            reserva = {'diretorio': diretorio, 'abas': {}, 'precos': {}, 'linhas_ofertas': 0}
+            blocos = ler_fec_pq_em_blocos(caminho_origem, linhas_por_bloco)
+            
+            for numero in itertools.count(1):
+                medicoes_bloco = []
+                # Contagens de cada etapa só no primeiro bloco; os demais, uma linha cada (avisos sempre saem)
+                verboso = numero == 1
+                with medir_etapa(medicoes_bloco, 'leitura') as registro:
+                    df_bloco = next(blocos, None)
+                    if df_bloco is not None:
+                        df_bloco = _preparar_fec_pq(df_bloco, verboso)
+                        registro['linhas_saida'] = len(df_bloco)
+                if df_bloco is None:
+                    _acumular_medicoes(acumuladas, medicoes_bloco)
+                    break
                 
-                if cod in codigos_com_oferta:
-                    ofertas_cod = ofertas_por_codigo.get_group(cod)
-                    oferta = encontrar_oferta_mais_proxima(ofertas_cod, cod, data)
-                    
-                    if oferta is not None:
-                        preco_oferta_3 = oferta.get('3%')
-                        preco_oferta_2 = oferta.get('2%')
-                        preco_oferta_1 = oferta.get('1%')
-                        
-                        preco_oferta_3 = _converter_valor_oferta(preco_oferta_3) if preco_oferta_3 is not None else None
-                        preco_oferta_2 = _converter_valor_oferta(preco_oferta_2) if preco_oferta_2 is not None else None
-                        preco_oferta_1 = _converter_valor_oferta(preco_oferta_1) if preco_oferta_1 is not None else None
-                        
-                        comissao = classificar_comissao_por_oferta(
-                            preco, preco_oferta_3, preco_oferta_2, preco_oferta_1,
-                            grupo, grupo_produto, is_devolucao
-                        )
-                        
-                        if oferta['DT_REF_OFF'] == data:
-                            tipo_oferta = 'Exata'
-                        elif oferta['DT_REF_OFF'] < data:
-                            tipo_oferta = 'Data Proxima Ant'
-                        else:
-                            tipo_oferta = 'Data Proxima Pos'
-                        
-                        resultado = {
-                            **row.to_dict(),
-                            'Preço - 5%': preco * 0.95 if grupo in ['REDE STYLLUS', 'REDE ROD E RAF'] else None,
-                            'Data_Oferta': oferta['DT_REF_OFF'],
-                            'Comissão_Correta': comissao,
-                            'Status': 'Correto' if _comparar_comissoes(row['P. Com'], comissao, 4) else 'Incorreto',
-                            'Tipo': 'VOG',
-                            'Tipo_Oferta': tipo_oferta
-                        }
-                        
-                        if preco_oferta_3 is not None and not np.isnan(preco_oferta_3):
-                            resultado['Preço_Oferta_3%'] = preco_oferta_3
-                        if preco_oferta_2 is not None and not np.isnan(preco_oferta_2):
-                            resultado['Preço_Oferta_2%'] = preco_oferta_2
-                        if preco_oferta_1 is not None and not np.isnan(preco_oferta_1):
-                            resultado['Preço_Oferta_1%'] = preco_oferta_1
-                            
-                        resultados_ofertas.append(resultado)
-                    else:
-                        registros_sem_oferta.append(row.to_dict())
-                else:
-                    registros_sem_oferta.append(row.to_dict())
-                    
-            except Exception as e:
-                logs_erros.append({
-                    'CODPRODUTO': row['CODPRODUTO'],
-                    'DATA': row['DATA'],
-                    'GRUPO': row['GRUPO'],
-                    'RAZAO': row['RAZAO'],
-                    'Mensagem': f'Erro ao processar: {str(e)}'
-                })
-        
-        df_resultados_ofertas = pd.DataFrame(resultados_ofertas) if resultados_ofertas else pd.DataFrame()
-        df_sem_oferta_final = pd.DataFrame(registros_sem_oferta) if registros_sem_oferta else pd.DataFrame()
-        df_logs_erros = pd.DataFrame(logs_erros) if logs_erros else pd.DataFrame()
-
-        print(f"- Itens com oferta VOG encontrada: {len(df_resultados_ofertas)}")
-        print(f"- Itens sem oferta encontrada: {len(df_sem_oferta_final)}")
-        print(f"- Erros durante o processamento: {len(df_logs_erros)}")
+                resultados = executar_etapas(df_bloco, df_ofertas_vog, planos['comissao_kg'], plano_comissao_fixa,
+                                             medicoes_bloco, indice_ofertas, planos['ofertas'], tempos_regras, verboso)
+                # As somas em R$ de cada bloco se acumulam; as abas de resumo saem uma vez, no fim
+                with medir_etapa(medicoes_bloco, 'resumo_diferencas',
+                                 len(resultados['regras']) + len(resultados['ofertas'])) as registro:
+                    df_diferencas_bloco = agregar_diferencas(resultados)
+                    df_diferencas = _somar_diferencas([df_diferencas, df_diferencas_bloco])
+                    registro['linhas_saida'] = len(df_diferencas_bloco)
+                with medir_etapa(medicoes_bloco, 'reserva_abas') as registro:
+                    abas = montar_abas_saida(resultados['comissao_kg'], resultados['regras'], resultados['ofertas'],
+                                             resultados['sem_oferta'], resultados['erros'])
+                    registro['linhas_entrada'] = sum(len(df) for df in abas.values())
+                    _reservar_abas(reserva, abas, resultados['ofertas'])
+                if historico is not None:
+                    with medir_etapa(medicoes_bloco, 'historico') as registro:
+                        try:
+                            registro['linhas_entrada'] = gravar_historico(historico, execucao, resultados)
+                            historico.commit()
+                        except sqlite3.Error as e:
+                            print(f"⚠️  Não foi possível gravar o histórico em {caminho_historico}: {e}")
+                            historico = _descartar_historico_parcial(historico, execucao)
+            
+                _acumular_medicoes(acumuladas, medicoes_bloco)
+                registros += len(df_bloco)
+                for chave, valor in _contagens_resultados(resultados).items():
+                    contagens[chave] = contagens.get(chave, 0) + valor
+                for regra, linhas in contar_regras(resultados).items():
+                    contagens_regras[regra] = contagens_regras.get(regra, 0) + linhas
+                print(f"Bloco {numero}: {len(df_bloco):,} linhas ({registros:,} no total)")
+                del df_bloco, resultados, abas
+            
+            medicoes.extend(acumuladas.values())
+            
+            df_cobertura = relatorio_cobertura_regras(contagens_regras, planos['comissao_kg'], plano_comissao_fixa,
+                                                      tempos_regras)
+            imprimir_regras_nunca_usadas(df_cobertura)
+            
+            print(f"\nSALVANDO RESULTADOS EM: {caminho_saida}")
+            with medir_etapa(medicoes, 'exportacao') as registro:
+                _reservar_abas(reserva, {**montar_abas_resumo(df_diferencas), ABA_COBERTURA_REGRAS: df_cobertura},
+                               pd.DataFrame())
+                registro['linhas_entrada'] = sum(aba['linhas'] for aba in reserva['abas'].values())
+                arquivo_salvo = _gravar_com_alternativas(lambda caminho: _escrever_reserva(reserva, caminho),
+                                                         caminho_saida)
         
-        if not df_resultados_ofertas.empty:
-            df_ofertas_corretas = df_resultados_ofertas[df_resultados_ofertas['Status'] == 'Correto']
-            df_ofertas_incorretas = df_resultados_ofertas[df_resultados_ofertas['Status'] == 'Incorreto']
-            print(f"  → Ofertas Corretas: {len(df_ofertas_corretas)}")
-            print(f"  → Ofertas Incorretas: {len(df_ofertas_incorretas)}")
+        if historico is not None:
+            concluir_execucao_historico(historico, execucao)
+            print(f"Histórico atualizado: {caminho_historico}")
         
-        # 6. Exportar para Excel
-        print(f"\nSALVANDO RESULTADOS EM: {caminho_downloads}")
+        print("\n=== PROCESSAMENTO CONCLUÍDO COM SUCESSO ===")
+        print(f"Arquivo salvo em: {arquivo_salvo}")
         
-        # Função para salvar com tratamento de erro de permissão
-        def salvar_com_alternativas(df_dict, caminho_base):
-            caminho_atual = caminho_base
-            contador = 1
-            
-            while True:
+        return {
+            'Arquivo': caminho_origem,
+            'Saida': arquivo_salvo,
+            'Registros': registros,
+            **contagens,
+            'Segundos': round(sum(registro['segundos'] for registro in medicoes), 3),
+        }
+    
+    except Exception as e:
+        print(f"\nERRO CRÍTICO DURANTE O PROCESSAMENTO: {str(e)}")
+        traceback.print_exc()
+        if historico is not None:
+            historico = _descartar_historico_parcial(historico, execucao)
+        raise
+    
+    finally:
+        _fechar_historico(historico)
+        if medicoes:
+            imprimir_resumo_etapas(medicoes)
+            if caminho_metricas:
                 try:
-                    with pd.ExcelWriter(caminho_atual, engine='openpyxl') as writer:
-                        for sheet_name, df in df_dict.items():
-                            if df is not None and not df.empty:
-                                df.to_excel(writer, sheet_name=sheet_name, index=False)
-                        
-                        # Aplicar formatação de porcentagem
-                        workbook = writer.book
-                        for sheet_name in writer.sheets:
-                            worksheet = writer.sheets[sheet_name]
-                            for col_idx, col_name in enumerate(next(worksheet.iter_rows(min_row=1, max_row=1, values_only=True))):
-                                col_str = str(col_name)
-                                if any(keyword in col_str for keyword in ['Com', 'Com Atual', 'P. Com']):
-                                    for row in worksheet.iter_rows(min_row=2, min_col=col_idx+1, max_col=col_idx+1):
-                                        for cell in row:
-                                            cell.number_format = '0.00%'
-                    
-                    return caminho_atual
-                    
-                except PermissionError:
-                    nome_base, ext = os.path.splitext(caminho_base)
-                    caminho_atual = f"{nome_base}_{contador}{ext}"
-                    contador += 1
-                    print(f"⚠️  Arquivo {caminho_base} está aberto. Tentando salvar como: {caminho_atual}")
-                    
-                    if contador > 10:
-                        raise Exception("Não foi possível salvar o arquivo após várias tentativas")
-        
-        # Preparar dicionário com todos os DataFrames
-        dfs_para_salvar = {}
-        
-        # 1. Comissão por Kg
-        if not df_comissao_kg.empty:
-            df_comissao_kg = df_comissao_kg.drop(columns=['Comissao_Kg'], errors='ignore')
-            df_comissao_kg = padronizar_colunas(df_comissao_kg)
-            dfs_para_salvar['Comissão-kg'] = df_comissao_kg
-
-        # 2. Regras Corretas
-        if not df_regras_corretas.empty:
-            df_regras_corretas = df_regras_corretas.drop(columns=['Comissao_Kg', 'Status'], errors='ignore')
-            df_regras_corretas = padronizar_colunas(df_regras_corretas)
-            dfs_para_salvar['O Regras'] = df_regras_corretas
-
-        # 3. Regras Incorretas
-        if not df_regras_incorretas.empty:
-            df_regras_incorretas = df_regras_incorretas.drop(columns=['Comissao_Kg', 'Status'], errors='ignore')
-            df_regras_incorretas = padronizar_colunas(df_regras_incorretas)
-            dfs_para_salvar['X Regras'] = df_regras_incorretas
-
-        # 4. Ofertas Corretas
-        if not df_resultados_ofertas.empty:
-            df_ofertas_corretas = df_resultados_ofertas[df_resultados_ofertas['Status'] == 'Correto']
-            if not df_ofertas_corretas.empty:
-                df_ofertas_corretas = df_ofertas_corretas.drop(
-                    columns=['Comissao_Kg', 'Comissao_Esperada', 'Status', 'Tipo_Oferta'], 
-                    errors='ignore')
-                df_ofertas_corretas = padronizar_colunas(df_ofertas_corretas)
-                dfs_para_salvar['O Ofertas'] = df_ofertas_corretas
-
-        # 5. Ofertas Incorretas
-        if not df_resultados_ofertas.empty:
-            df_ofertas_incorretas = df_resultados_ofertas[df_resultados_ofertas['Status'] == 'Incorreto']
-            if not df_ofertas_incorretas.empty:
-                df_ofertas_incorretas = df_ofertas_incorretas.drop(
-                    columns=['Comissao_Kg', 'Comissao_Esperada', 'Status', 'Tipo_Oferta'], 
-                    errors='ignore')
-                df_ofertas_incorretas = padronizar_colunas(df_ofertas_incorretas)
-                dfs_para_salvar['X Ofertas'] = df_ofertas_incorretas
+                    registrar_medicoes(medicoes, caminho_metricas, arquivo=caminho_origem, linhas_por_bloco=linhas_por_bloco)
+                except OSError as e:
+                    print(f"⚠️  Não foi possível gravar as medições em {caminho_metricas}: {e}")
+
+# ===== Processamento em esteira =====
+
+def _ler_ofertas_esteira(caminho_origem):
+    """Lê OFF_VOG e EXC_NFE e carrega o índice das ofertas num processo da esteira; devolve também as medições"""
+    medicoes = []
+    with medir_etapa(medicoes, 'leitura_ofertas') as registro:
+        df_ofertas_vog, df_excecoes = ler_ofertas_e_excecoes(caminho_origem)
+        registro['linhas_saida'] = len(df_ofertas_vog)
+    
+    with medir_etapa(medicoes, 'indice_ofertas', len(df_ofertas_vog)) as registro:
+        indice_ofertas = carregar_indice_ofertas(df_ofertas_vog)
+        registro['linhas_saida'] = len(indice_ofertas['chave'])
+    
+    return df_ofertas_vog, df_excecoes, indice_ofertas, medicoes
 
-        # 6. Sem Oferta
-        if not df_sem_oferta_final.empty:
-            df_sem_oferta_final = df_sem_oferta_final.drop(
-                columns=['Comissao_Kg', 'Comissao_Esperada'], 
-                errors='ignore')
-            df_sem_oferta_final = padronizar_colunas(df_sem_oferta_final)
-            dfs_para_salvar['Sem Oferta'] = df_sem_oferta_final
+def _escrever_aba_esteira(workbook, estilos, nome_aba, df):
+    """Acrescenta uma aba ao workbook da esteira, na thread de gravação; devolve as medições"""
+    medicoes = []
+    with medir_etapa(medicoes, f"aba {nome_aba}", len(df)):
+        _escrever_aba_xlsxwriter(workbook, estilos, nome_aba, list(df.columns), _formatos_colunas(df), [df])
+    return medicoes
 
-        # 7. Logs de erros
-        if not df_logs_erros.empty:
-            dfs_para_salvar['Logs Erros'] = df_logs_erros
+def _registrar_historico_esteira(resultados, caminho_origem, hash_regras, caminho_historico):
+    """Grava as linhas classificadas no histórico num processo da esteira; devolve as medições"""
+    medicoes = []
+    with medir_etapa(medicoes, 'historico') as registro:
+        registro['linhas_entrada'] = registrar_historico(resultados, caminho_origem, hash_regras, caminho_historico)
+    return medicoes
 
-        # Tentar salvar com tratamento de erro
-        arquivo_salvo = salvar_com_alternativas(dfs_para_salvar, caminho_downloads)
+def processar_planilhas_em_esteira(caminho_origem=CAMINHO_ORIGEM_PADRAO, caminho_saida=None, planos=None,
+                                   caminho_metricas=CAMINHO_METRICAS, caminho_historico=CAMINHO_HISTORICO,
+                                   processos=None):
+    """
+    Mesmo resultado do processar_planilhas, com as etapas sobrepostas em `processos`
+    processos (padrão: núcleos da CPU). Sem snapshot da planilha, OFF_VOG e EXC_NFE são
+    lidas e o índice das ofertas é carregado num processo enquanto a FEC_PQ é lida e
+    classificada por kg, e o histórico é gravado num processo junto com as abas. Uma
+    thread de gravação acrescenta cada aba ao arquivo assim que ela fica pronta (a de
+    comissão por kg enquanto as regras fixas ainda rodam, por exemplo). A gravação divide
+    o GIL com a classificação, então só se sobrepõe de fato às partes do pandas que o
+    liberam e à leitura e ao histórico nos outros processos.
 
+    As medições de cada processo entram no resumo de etapas, cuja soma passa do tempo
+    total. Retorna o resumo de contagens da planilha, com o tempo de ponta a ponta.
+    """
+    if caminho_saida is None:
+        caminho_saida = os.path.join(os.path.expanduser('~'), 'Downloads', NOME_SAIDA_PADRAO)
+    medicoes = []
+    inicio = time.perf_counter()
+    
+    try:
+        print("=== INÍCIO DO PROCESSAMENTO (ESTEIRA) ===")
+        if planos is None:
+            planos = compilar_planos()
+        
+        # O arquivo é montado numa pasta temporária e só vai para caminho_saida no fim,
+        # para tentar nome_1, nome_2, ... se o destino estiver aberto
+        with tempfile.TemporaryDirectory(prefix='esteira_') as pasta_temporaria, \
+                ProcessPoolExecutor(max_workers=processos or os.cpu_count() or 1) as executor, \
+                ThreadPoolExecutor(max_workers=1) as gravacao:
+            abas_prontas = {}
+            caminho_temporario = os.path.join(pasta_temporaria, os.path.basename(caminho_saida))
+            workbook = estilos = None
+            if xlsxwriter is not None:
+                workbook, estilos = _abrir_workbook_xlsxwriter(caminho_temporario)
+            
+            # Cada aba pronta vai para a thread de gravação, que as escreve na ordem em que
+            # chegam (sem xlsxwriter, ficam para o fim)
+            def exportar(abas):
+                for nome_aba, df in abas.items():
+                    if df is None or df.empty:
+                        continue
+                    if workbook is None:
+                        abas_prontas[nome_aba] = df
+                    else:
+                        abas_prontas[nome_aba] = gravacao.submit(_escrever_aba_esteira, workbook, estilos, nome_aba, df)
+            
+            # 1 e 2. FEC_PQ aqui; OFF_VOG, EXC_NFE e índice das ofertas em outro processo
+            futuro_ofertas = None
+            with medir_etapa(medicoes, 'leitura') as registro:
+                chave = _chave_snapshot(caminho_origem)
+                dados_origem = _ler_snapshot_origem(os.path.join(DIRETORIO_CACHE, chave))
+                if dados_origem is not None:
+                    print(f"Planilha carregada do snapshot {chave}")
+                    df_base = dados_origem['FEC_PQ']
+                else:
+                    futuro_ofertas = executor.submit(_ler_ofertas_esteira, caminho_origem)
+                    with pd.ExcelFile(caminho_origem) as planilha:
+                        df_base = _ler_fec_pq(planilha)
+                    # A classificação acrescenta colunas em df_base; o snapshot guarda a aba como foi lida
+                    df_fec_pq = df_base.copy(deep=False)
+                registro['linhas_saida'] = len(df_base)
+            print(f"Registros tratados da base: {len(df_base)}")
+            
+            # 3. Regras por kg, enquanto as ofertas ainda são lidas
+            tempos_regras = {}
+            with medir_etapa(medicoes, 'comissao_kg', len(df_base)) as registro:
+                df_comissao_kg, linhas_sem_kg = separar_comissao_kg(df_base, planos['comissao_kg'], tempos_regras)
+                registro['linhas_saida'] = int(linhas_sem_kg.sum())
+            exportar(_abas_comissao_kg(df_comissao_kg))
+            
+            if futuro_ofertas is None:
+                df_ofertas_vog, df_excecoes = dados_origem['OFF_VOG'], dados_origem['EXC_NFE']
+                with medir_etapa(medicoes, 'indice_ofertas', len(df_ofertas_vog)) as registro:
+                    indice_ofertas = carregar_indice_ofertas(df_ofertas_vog)
+                    registro['linhas_saida'] = len(indice_ofertas['chave'])
+            else:
+                df_ofertas_vog, df_excecoes, indice_ofertas, medicoes_ofertas = futuro_ofertas.result()
+                medicoes.extend(medicoes_ofertas)
+                executor.submit(_gravar_snapshot_origem,
+                                {'FEC_PQ': df_fec_pq, 'OFF_VOG': df_ofertas_vog, 'EXC_NFE': df_excecoes},
+                                caminho_origem, chave)
+            print(f"Ofertas VOG válidas: {len(df_ofertas_vog)}")
+            
+            # 4. Regras fixas (dependem das exceções por NF-E da planilha)
+            excecoes_nfe, plano_comissao_fixa = _plano_comissao_fixa(planos, df_excecoes)
+            with medir_etapa(medicoes, 'regras_fixas', int(linhas_sem_kg.sum())) as registro:
+                df_regras, df_sem_regra = aplicar_regras_fixas(df_base, plano_comissao_fixa, tempos_regras,
+                                                               linhas_sem_kg)
+                registro['linhas_saida'] = len(df_regras)
+            exportar(_abas_regras(df_regras))
+            
+            # 5. Ofertas VOG
+            with medir_etapa(medicoes, 'ofertas_vog', len(df_sem_regra)) as registro:
+                df_resultados_ofertas, df_sem_oferta_final, df_logs_erros = processar_ofertas_vog(
+                    df_sem_regra, df_ofertas_vog, indice_ofertas, planos['ofertas'])
+                registro['linhas_saida'] = len(df_resultados_ofertas)
+            exportar(_abas_ofertas(df_resultados_ofertas, df_sem_oferta_final))
+            
+            resultados = {
+                'comissao_kg': df_comissao_kg,
+                'regras': df_regras,
+                'ofertas': df_resultados_ofertas,
+                'sem_oferta': df_sem_oferta_final,
+                'erros': df_logs_erros,
+            }
+            futuro_historico = None
+            if caminho_historico:
+                futuro_historico = executor.submit(_registrar_historico_esteira, resultados, caminho_origem,
+                                                   planos['hash_regras'], caminho_historico)
+            
+            with medir_etapa(medicoes, 'resumo_diferencas', len(df_regras) + len(df_resultados_ofertas)) as registro:
+                df_diferencas = agregar_diferencas(resultados)
+                registro['linhas_saida'] = len(df_diferencas)
+            exportar(montar_abas_resumo(df_diferencas))
+            
+            with medir_etapa(medicoes, 'cobertura_regras', len(df_base)) as registro:
+                df_cobertura = relatorio_cobertura_regras(
+                    contar_regras(resultados), planos['comissao_kg'], plano_comissao_fixa, tempos_regras)
+                registro['linhas_saida'] = len(df_cobertura)
+            imprimir_regras_nunca_usadas(df_cobertura)
+            exportar(_abas_cobertura_e_erros(df_cobertura, df_logs_erros))
+            
+            # 6. Fechar o arquivo depois da última aba
+            print(f"\nSALVANDO RESULTADOS EM: {caminho_saida}")
+            with medir_etapa(medicoes, 'fechar_arquivo') as registro:
+                if workbook is None:
+                    registro['linhas_entrada'] = sum(len(df) for df in abas_prontas.values())
+                    arquivo_salvo = salvar_com_alternativas(abas_prontas, caminho_saida)
+                else:
+                    for futuro_aba in abas_prontas.values():
+                        medicoes.extend(futuro_aba.result())
+                    workbook.close()
+                    arquivo_salvo = _gravar_com_alternativas(
+                        lambda caminho: shutil.move(caminho_temporario, caminho), caminho_saida)
+            
+            # 7. Histórico, gravado junto com as abas
+            if futuro_historico is not None:
+                try:
+                    medicoes.extend(futuro_historico.result())
+                    print(f"Histórico atualizado: {caminho_historico}")
+                except (sqlite3.Error, OSError, ValueError) as e:
+                    print(f"⚠️  Não foi possível gravar o histórico em {caminho_historico}: {e}")
+        
+        segundos = time.perf_counter() - inicio
         print("\n=== PROCESSAMENTO CONCLUÍDO COM SUCESSO ===")
         print(f"Arquivo salvo em: {arquivo_salvo}")
+        print(f"Tempo de ponta a ponta: {segundos:.3f}s")
+        
+        return {
+            'Arquivo': caminho_origem,
+            'Saida': arquivo_salvo,
+            'Registros': len(df_base),
+            **_contagens_resultados(resultados),
+            'Segundos': round(segundos, 3),
+        }
         
     except Exception as e:
         print(f"\nERRO CRÍTICO DURANTE O PROCESSAMENTO: {str(e)}")
-        import traceback
         traceback.print_exc()
         raise
+    
+    finally:
+        if medicoes:
+            imprimir_resumo_etapas(medicoes)
+            if caminho_metricas:
+                try:
+                    registrar_medicoes(medicoes, caminho_metricas, arquivo=caminho_origem)
+                except OSError as e:
+                    print(f"⚠️  Não foi possível gravar as medições em {caminho_metricas}: {e}")
+
+# ===== Processamento em lote =====
+
+EXTENSOES_PLANILHA = ('.xlsx', '.xlsm', '.xls')
+
+def listar_planilhas(origens):
+    """
+    Expande arquivos, pastas e padrões glob em planilhas (sem repetição e sem temporários ~$ do Excel).
+    Resultado, estado do --incremental e histórico de cada planilha são identificados
+    pelo nome do arquivo, por isso planilhas de pastas diferentes com o mesmo
+    nome (sem a extensão) são recusadas com ValueError: uma sobrescreveria a outra
+    """
+    planilhas = []
+    for origem in origens:
+        if os.path.isdir(origem):
+            candidatos = [os.path.join(origem, nome) for nome in os.listdir(origem)]
+        else:
+            candidatos = glob.glob(origem) or [origem]
+        for caminho in sorted(candidatos):
+            nome = os.path.basename(caminho)
+            if nome.lower().endswith(EXTENSOES_PLANILHA) and not nome.startswith('~$'):
+                caminho = os.path.abspath(caminho)
+                if caminho not in planilhas:
+                    planilhas.append(caminho)
+    
+    por_nome = {}
+    for caminho in planilhas:
+        por_nome.setdefault(os.path.splitext(os.path.basename(caminho))[0].lower(), []).append(caminho)
+    repetidas = [caminhos for caminhos in por_nome.values() if len(caminhos) > 1]
+    if repetidas:
+        detalhes = '; '.join(' e '.join(caminhos) for caminhos in repetidas)
+        raise ValueError(f"Planilhas com o mesmo nome em pastas diferentes (processe-as em lotes separados): "
+                         f"{detalhes}")
+    return planilhas
+
+def _caminho_saida_lote(caminho_origem, diretorio_saida):
+    nome = os.path.splitext(os.path.basename(caminho_origem))[0]
+    return os.path.join(diretorio_saida, f"Averiguar_Comissoes ({nome}).xlsx")
+
+_PLANOS_TRABALHADOR = None
+
+def _inicializar_trabalhador(planos):
+    """Recebe uma vez, em cada processo do lote, as regras já compiladas"""
+    global _PLANOS_TRABALHADOR
+    _PLANOS_TRABALHADOR = planos
+
+def _processar_planilha_lote(caminho_origem, caminho_saida, incremental=False, linhas_por_bloco=None,
+                             caminho_historico=CAMINHO_HISTORICO):
+    """
+    Processa uma planilha do lote com a saída do console num .log ao lado do resultado.
+    Erros viram uma linha do resumo em vez de interromper as demais planilhas.
+    """
+    caminho_log = os.path.splitext(caminho_saida)[0] + '.log'
+    inicio = time.perf_counter()
+    try:
+        with open(caminho_log, 'w', encoding='utf-8') as log, \
+                contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            if linhas_por_bloco:
+                return processar_planilhas_em_blocos(caminho_origem, caminho_saida, planos=_PLANOS_TRABALHADOR,
+                                                     linhas_por_bloco=linhas_por_bloco,
+                                                     caminho_historico=caminho_historico)
+            return processar_planilhas(caminho_origem, caminho_saida, planos=_PLANOS_TRABALHADOR,
+                                       incremental=incremental, caminho_historico=caminho_historico)
+    except Exception as e:
+        return {'Arquivo': caminho_origem, 'Saida': None, 'Segundos': round(time.perf_counter() - inicio, 3),
+                'Erro': f"{type(e).__name__}: {e} (detalhes em {caminho_log})"}
+
+def processar_lote(origens, diretorio_saida=None, processos=None, incremental=False, caminho_regras=CAMINHO_REGRAS,
+                   linhas_por_bloco=None, caminho_historico=CAMINHO_HISTORICO):
+    """
+    Processa várias planilhas (arquivos, pastas ou padrões glob) em paralelo, um processo
+    por planilha. Cada planilha gera seu próprio resultado e .log em `diretorio_saida`
+    (padrão: Downloads), e o resumo de corretos/incorretos por arquivo é salvo em
+    'Resumo_Lote.xlsx'. Com linhas_por_bloco, cada planilha é lida em blocos
+    (processar_planilhas_em_blocos). Todas as planilhas vão para o mesmo histórico
+    (`caminho_historico`; None desliga). Retorna o resumo como DataFrame.
+    """
+    planilhas = listar_planilhas(origens)
+    if not planilhas:
+        raise ValueError(f"Nenhuma planilha encontrada em: {', '.join(origens)}")
+    
+    if diretorio_saida is None:
+        diretorio_saida = os.path.join(os.path.expanduser('~'), 'Downloads')
+    os.makedirs(diretorio_saida, exist_ok=True)
+    processos = min(processos or os.cpu_count() or 1, len(planilhas))
+    
+    print(f"=== LOTE: {len(planilhas)} planilha(s) em {processos} processo(s) ===")
+    inicio = time.perf_counter()
+    planos = compilar_planos(caminho_regras)
+    resumos = []
+    
+    with ProcessPoolExecutor(max_workers=processos, initializer=_inicializar_trabalhador,
+                             initargs=(planos,)) as executor:
+        futuros = {executor.submit(_processar_planilha_lote, caminho, _caminho_saida_lote(caminho, diretorio_saida),
+                                   incremental, linhas_por_bloco, caminho_historico): caminho
+                   for caminho in planilhas}
+        for futuro in as_completed(futuros):
+            try:
+                resumo = futuro.result()
+            except Exception as e:  # Processo interrompido (ex.: falta de memória)
+                resumo = {'Arquivo': futuros[futuro], 'Saida': None, 'Erro': f"{type(e).__name__}: {e}"}
+            resumos.append(resumo)
+            situacao = f"ERRO - {resumo['Erro']}" if resumo.get('Erro') else f"OK ({resumo['Segundos']:.1f}s)"
+            print(f"[{len(resumos)}/{len(planilhas)}] {os.path.basename(resumo['Arquivo'])}: {situacao}")
+    
+    df_resumo = pd.DataFrame(resumos).set_index('Arquivo').reindex(planilhas).reset_index()
+    if 'Erro' not in df_resumo.columns:
+        df_resumo['Erro'] = None
+    colunas_contagem = ['Registros', 'Comissao_Kg', 'Regras_Corretas', 'Regras_Incorretas',
+                        'Ofertas_Corretas', 'Ofertas_Incorretas', 'Sem_Oferta', 'Erros']
+    colunas_contagem = [col for col in colunas_contagem if col in df_resumo.columns]
+    df_resumo[colunas_contagem] = df_resumo[colunas_contagem].astype('Int64')
+    
+    arquivo_resumo = salvar_com_alternativas({'Resumo': df_resumo}, os.path.join(diretorio_saida, 'Resumo_Lote.xlsx'))
+    falhas = df_resumo['Erro'].notna().sum()
+    print(f"\n=== LOTE CONCLUÍDO em {time.perf_counter() - inicio:.1f}s: "
+          f"{len(planilhas) - falhas} ok, {falhas} com erro ===")
+    print(f"Resumo salvo em: {arquivo_resumo}")
+    return df_resumo
+
+# ===== Vigia de pasta =====
+
+# Planilhas vigiadas, intervalo entre varreduras (s) e quanto tempo (s) o arquivo precisa
+# ficar sem mudar de tamanho nem de data de modificação para ser considerado gravado
+PADRAO_VIGIA = '*_MRG.xlsx'
+INTERVALO_VIGIA = 1.0
+ESPERA_ARQUIVO_PRONTO = 2.0
+
+def _assinatura_arquivo(caminho):
+    """(tamanho, data de modificação) do arquivo, ou None se ele não existir"""
+    try:
+        estado = os.stat(caminho)
+    except OSError:
+        return None
+    return estado.st_size, estado.st_mtime_ns
+
+def _planilhas_vigiadas(pasta, padrao):
+    return [os.path.abspath(caminho) for caminho in sorted(glob.glob(os.path.join(pasta, padrao)))
+            if not os.path.basename(caminho).startswith('~$')]
+
+def _saida_atualizada(caminho_origem, diretorio_saida):
+    """Se o resultado da planilha já existe e é mais novo que ela"""
+    origem = _assinatura_arquivo(caminho_origem)
+    saida = _assinatura_arquivo(_caminho_saida_lote(caminho_origem, diretorio_saida))
+    return origem is not None and saida is not None and saida[1] >= origem[1]
+
+def vigiar_pasta(pasta, diretorio_saida=None, padrao=PADRAO_VIGIA, incremental=False, caminho_regras=CAMINHO_REGRAS,
+                 caminho_historico=CAMINHO_HISTORICO, intervalo=INTERVALO_VIGIA, espera=ESPERA_ARQUIVO_PRONTO,
+                 ciclos=None):
+    """
+    Vigia `pasta` e averigua cada planilha `padrao` nova ou alterada, num único processo
+    que mantém carregados as bibliotecas, o plano das regras e os índices de ofertas.
+    O resultado e o .log de cada planilha vão para `diretorio_saida` (padrão: Downloads),
+    com os nomes do lote. Ao começar, só são processadas as planilhas sem resultado ou
+    com resultado mais antigo que elas.
+
+    A pasta é varrida a cada `intervalo` segundos. Uma planilha só é processada depois de
+    passar `espera` segundos sem mudar de tamanho nem de data e de estar completa (o .xlsx
+    é um zip, cujo diretório central só é gravado no fim). Várias gravações seguidas do
+    mesmo arquivo só reiniciam a espera, e cada versão é processada uma única vez. As
+    regras são recompiladas quando o arquivo de regras ou o CSV de exceções mudam; se a
+    nova versão for inválida, as anteriores continuam valendo.
+
+    Roda até Ctrl+C (ou por `ciclos` varreduras) e retorna os resumos das planilhas processadas
+    """
+    if not os.path.isdir(pasta):
+        raise ValueError(f"Pasta não encontrada: {pasta}")
+    if diretorio_saida is None:
+        diretorio_saida = os.path.join(os.path.expanduser('~'), 'Downloads')
+    os.makedirs(diretorio_saida, exist_ok=True)
+    
+    print(f"=== VIGIANDO {os.path.abspath(pasta)} ({padrao}); resultados em {diretorio_saida} ===")
+    print("Ctrl+C encerra")
+    processadas = {caminho: _assinatura_arquivo(caminho) for caminho in _planilhas_vigiadas(pasta, padrao)
+                   if _saida_atualizada(caminho, diretorio_saida)}
+    pendentes = {}  # caminho -> (assinatura, quando foi vista com ela pela primeira vez)
+    assinatura_regras = None
+    resumos = []
+    ciclo = 0
+    
+    try:
+        while ciclos is None or ciclo < ciclos:
+            if ciclo:
+                time.sleep(intervalo)
+            ciclo += 1
+            
+            assinatura = (_assinatura_arquivo(caminho_regras), _assinatura_arquivo(CAMINHO_EXCECOES_NFE))
+            if assinatura != assinatura_regras:
+                try:
+                    _inicializar_trabalhador(compilar_planos(caminho_regras))
+                except (OSError, ValueError) as e:
+                    if assinatura_regras is None:
+                        raise
+                    print(f"⚠️  Regras não recarregadas, continuam as anteriores: {e}")
+                assinatura_regras = assinatura
+            
+            agora = time.monotonic()
+            planilhas = _planilhas_vigiadas(pasta, padrao)
+            for caminho in set(pendentes) - set(planilhas):
+                del pendentes[caminho]
+            
+            for caminho in planilhas:
+                assinatura = _assinatura_arquivo(caminho)
+                if assinatura is None or processadas.get(caminho) == assinatura:
+                    continue
+                if caminho not in pendentes or pendentes[caminho][0] != assinatura:
+                    pendentes[caminho] = (assinatura, agora)
+                    continue
+                if agora - pendentes[caminho][1] < espera or not zipfile.is_zipfile(caminho):
+                    continue
+                
+                del pendentes[caminho]
+                processadas[caminho] = assinatura
+                print(f"[{datetime.now():%H:%M:%S}] {os.path.basename(caminho)}: processando")
+                resumo = _processar_planilha_lote(caminho, _caminho_saida_lote(caminho, diretorio_saida),
+                                                  incremental, caminho_historico=caminho_historico)
+                resumos.append(resumo)
+                situacao = (f"ERRO - {resumo['Erro']}" if resumo.get('Erro')
+                            else f"OK ({resumo['Segundos']:.1f}s) -> {resumo['Saida']}")
+                print(f"[{datetime.now():%H:%M:%S}] {os.path.basename(caminho)}: {situacao}")
+    except KeyboardInterrupt:
+        print("\n=== VIGIA ENCERRADA ===")
+    
+    return resumos
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Averigua as comissões de uma ou várias planilhas")
+    parser.add_argument('origens', nargs='*',
+                        help="planilhas, pastas ou padrões glob (sem argumentos usa CAMINHO_ORIGEM_PADRAO)")
+    parser.add_argument('--saida', help="pasta dos resultados do lote, da esteira ou da vigia (padrão: Downloads)")
+    parser.add_argument('--processos', type=int,
+                        help="processos em paralelo no lote ou na esteira (padrão: núcleos da CPU)")
+    parser.add_argument('--perfil', action='store_true', help="executa sob o cProfile (só a planilha padrão)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="reprocessa só as linhas novas ou alteradas desde a última execução")
+    parser.add_argument('--regras', default=CAMINHO_REGRAS,
+                        help="arquivo de regras de comissão (.json, .toml ou .yaml; padrão: regras_comissao.json)")
+    parser.add_argument('--blocos', type=int, metavar='LINHAS',
+                        help=f"lê a FEC_PQ em blocos de LINHAS linhas, com memória limitada "
+                             f"(ex.: {LINHAS_POR_BLOCO_LEITURA})")
+    parser.add_argument('--esteira', action='store_true',
+                        help="sobrepõe leitura, classificação e gravação das abas de cada planilha")
+    parser.add_argument('--vigiar', metavar='PASTA',
+                        help=f"fica vigiando PASTA e averigua cada {PADRAO_VIGIA} novo ou alterado "
+                             f"(resultados em --saida)")
+    parser.add_argument('--sem-historico', action='store_true',
+                        help=f"não grava as linhas classificadas no histórico ({CAMINHO_HISTORICO})")
+    args = parser.parse_args(argv)
+    if args.blocos is not None and args.blocos <= 0:
+        parser.error("--blocos precisa ser um número positivo de linhas")
+    if args.blocos and args.incremental:
+        parser.error("--blocos não pode ser combinado com --incremental")
+    if args.perfil and args.origens:
+        parser.error("--perfil vale para a planilha padrão, não para o lote")
+    if args.esteira and (args.blocos or args.incremental or args.perfil):
+        parser.error("--esteira não pode ser combinado com --blocos, --incremental ou --perfil")
+    
+    if args.vigiar and (args.origens or args.blocos or args.esteira or args.perfil):
+        parser.error("--vigiar não pode ser combinado com planilhas, --blocos, --esteira ou --perfil")
+    
+    caminho_historico = None if args.sem_historico else CAMINHO_HISTORICO
+    
+    if args.vigiar:
+        vigiar_pasta(args.vigiar, args.saida, incremental=args.incremental, caminho_regras=args.regras,
+                     caminho_historico=caminho_historico)
+    elif args.esteira and not args.origens:
+        processar_planilhas_em_esteira(planos=compilar_planos(args.regras), caminho_historico=caminho_historico,
+                                       processos=args.processos)
+    elif args.esteira:
+        # A esteira já ocupa os processos: as planilhas vão uma de cada vez, com os nomes de saída do lote
+        planilhas = listar_planilhas(args.origens)
+        if not planilhas:
+            parser.error(f"Nenhuma planilha encontrada em: {', '.join(args.origens)}")
+        diretorio_saida = args.saida or os.path.join(os.path.expanduser('~'), 'Downloads')
+        os.makedirs(diretorio_saida, exist_ok=True)
+        planos = compilar_planos(args.regras)
+        for caminho in planilhas:
+            processar_planilhas_em_esteira(caminho, _caminho_saida_lote(caminho, diretorio_saida), planos,
+                                           caminho_historico=caminho_historico, processos=args.processos)
+    elif args.origens:
+        processar_lote(args.origens, args.saida, args.processos, args.incremental, args.regras, args.blocos,
+                       caminho_historico)
+    elif args.blocos:
+        processar_planilhas_em_blocos(planos=compilar_planos(args.regras), linhas_por_bloco=args.blocos,
+                                      caminho_historico=caminho_historico)
+    else:
+        processar_planilhas(planos=compilar_planos(args.regras), perfil=args.perfil, incremental=args.incremental,
+                            caminho_historico=caminho_historico)
 
 if __name__ == "__main__":
-    processar_planilhas()
\ No newline at end of file
+    main()
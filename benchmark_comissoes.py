@@ -0,0 +1,187 @@
+"""
+Benchmark das etapas de averiguar_comissoes com planilhas sintéticas FEC_PQ/OFF_VOG.
+
+As bases são geradas com os nomes reais das regras (GRUPO, RAZAO, VENDEDOR),
+devoluções (CF 'DEV ...'), exceções por NF-E e produtos sem oferta. Cada etapa
+(ingestão, regras por kg, regras fixas, ofertas VOG, exportação) é cronometrada
+em cada tamanho, com o pico de memória alocada, e o resultado vai para um JSON
+que pode ser comparado com o de uma versão anterior.
+
+Uso:
+    python benchmark_comissoes.py
+    python benchmark_comissoes.py --tamanhos 10000 100000 1000000 5000000
+    python benchmark_comissoes.py --saida atual.json --comparar anterior.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import averiguar_comissoes as ac
+from planilhas_sinteticas import gerar_fec_pq, gerar_off_vog, gravar_planilha
+
+TAMANHOS_PADRAO = [10_000, 100_000, 1_000_000]
+LIMITE_LINHAS_EXCEL = 1_048_575  # Linhas de dados que cabem numa aba do Excel
+CAMINHO_SAIDA_PADRAO = 'benchmark_resultados.json'
+
+
+class Cronometro:
+    """Mede tempo e pico de memória alocada (tracemalloc) de cada etapa"""
+
+    def __init__(self, medir_memoria=True):
+        self.medir_memoria = medir_memoria
+        self.etapas = []
+
+    @contextlib.contextmanager
+    def etapa(self, nome, linhas_entrada, **extras):
+        registro = {'etapa': nome, 'linhas_entrada': int(linhas_entrada), **extras}
+        if self.medir_memoria:
+            tracemalloc.start()
+        inicio = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                yield registro
+        finally:
+            registro['segundos'] = round(time.perf_counter() - inicio, 6)
+            registro['linhas_por_segundo'] = (
+                round(registro['linhas_entrada'] / registro['segundos']) if registro['segundos'] else None)
+            if self.medir_memoria:
+                registro['pico_memoria_mb'] = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+                tracemalloc.stop()
+            self.etapas.append(registro)
+
+
+def executar_tamanho(n_linhas, diretorio, medir_memoria=True, limite_excel=100_000, semente=0):
+    """Roda o pipeline completo sobre n_linhas sintéticas e devolve a medição de cada etapa"""
+    df_fec_pq = gerar_fec_pq(n_linhas, semente)
+    df_off_vog = gerar_off_vog(df_fec_pq, semente)
+    cronometro = Cronometro(medir_memoria)
+
+    if n_linhas <= limite_excel:
+        caminho = os.path.join(diretorio, f'FEC_PQ_{n_linhas}.xlsx')
+        gravar_planilha(df_fec_pq, df_off_vog, caminho)
+        with cronometro.etapa('ingestao', n_linhas, fonte='excel') as registro:
+            dados = ac.ler_planilha_origem(caminho, usar_cache=False)
+            registro['linhas_saida'] = len(dados['FEC_PQ'])
+    else:
+        # Planilha grande demais para gerar em tempo razoável: mede só o tratamento das abas
+        with cronometro.etapa('ingestao', n_linhas, fonte='memoria') as registro:
+            dados = {
+                'FEC_PQ': ac._preparar_fec_pq(df_fec_pq),
+                'OFF_VOG': ac._preparar_off_vog(df_off_vog),
+            }
+            registro['linhas_saida'] = len(dados['FEC_PQ'])
+    df_base, df_ofertas_vog = dados['FEC_PQ'], dados['OFF_VOG']
+    del df_fec_pq, df_off_vog
+
+    with cronometro.etapa('regras_kg', len(df_base)) as registro:
+        plano_regras = ac.carregar_plano_regras(diretorio_cache=None)
+        df_comissao_kg, linhas_sem_kg = ac.separar_comissao_kg(df_base, plano_regras['comissao_kg'])
+        registro['linhas_saida'] = int(linhas_sem_kg.sum())
+
+    with cronometro.etapa('regras_fixas', int(linhas_sem_kg.sum())) as registro:
+        plano_fixa = ac.com_excecoes_nfe(plano_regras['comissao_fixa'], ac.carregar_excecoes_nfe())
+        df_regras, df_sem_regra = ac.aplicar_regras_fixas(df_base, plano_fixa, linhas=linhas_sem_kg)
+        registro['linhas_saida'] = len(df_regras)
+
+    with cronometro.etapa('ofertas_vog', len(df_sem_regra)) as registro:
+        df_resultados, df_sem_oferta, df_erros = ac.processar_ofertas_vog(
+            df_sem_regra, df_ofertas_vog, plano_ofertas=plano_regras['ofertas'])
+        registro['linhas_saida'] = len(df_resultados)
+        registro['linhas_sem_oferta'] = len(df_sem_oferta)
+
+    abas = ac.montar_abas_saida(df_comissao_kg, df_regras, df_resultados, df_sem_oferta, df_erros)
+    maior_aba = max((len(df) for df in abas.values()), default=0)
+    if maior_aba <= LIMITE_LINHAS_EXCEL:
+        with cronometro.etapa('exportacao', sum(len(df) for df in abas.values())) as registro:
+            ac.salvar_com_alternativas(abas, os.path.join(diretorio, f'saida_{n_linhas}.xlsx'))
+            registro['abas'] = len(abas)
+    else:
+        cronometro.etapas.append({'etapa': 'exportacao', 'linhas_entrada': maior_aba,
+                                  'ignorada': 'aba com mais linhas do que o Excel suporta'})
+
+    for registro in cronometro.etapas:
+        registro['linhas'] = n_linhas
+    return cronometro.etapas
+
+
+def _versao_codigo():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def comparar_resultados(atual, anterior):
+    """Imprime a razão de tempo atual/anterior por (linhas, etapa); > 1 indica regressão"""
+    tempos_anteriores = {(r['linhas'], r['etapa']): r.get('segundos') for r in anterior['resultados']}
+    print(f"\nComparação com {anterior.get('versao_codigo')} ({anterior.get('data')}):")
+    for registro in atual['resultados']:
+        antes = tempos_anteriores.get((registro['linhas'], registro['etapa']))
+        if antes and registro.get('segundos'):
+            razao = registro['segundos'] / antes
+            alerta = '  <-- REGRESSÃO' if razao > 1.2 else ''
+            print(f"  {registro['linhas']:>9} {registro['etapa']:<13} {antes:>9.3f}s -> "
+                  f"{registro['segundos']:>9.3f}s ({razao:.2f}x){alerta}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tamanhos', type=int, nargs='+', default=TAMANHOS_PADRAO,
+                        help='quantidades de linhas da FEC_PQ sintética')
+    parser.add_argument('--saida', default=CAMINHO_SAIDA_PADRAO, help='arquivo JSON com os resultados')
+    parser.add_argument('--comparar', help='JSON de uma execução anterior para comparar os tempos')
+    parser.add_argument('--limite-excel', type=int, default=100_000,
+                        help='acima deste tamanho a ingestão é medida sem gerar/ler o .xlsx')
+    parser.add_argument('--sem-memoria', action='store_true',
+                        help='não mede memória (tracemalloc deixa as etapas mais lentas)')
+    parser.add_argument('--semente', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    resultados = []
+    with tempfile.TemporaryDirectory() as diretorio:
+        for n_linhas in args.tamanhos:
+            print(f"=== {n_linhas} linhas ===")
+            for registro in executar_tamanho(n_linhas, diretorio, not args.sem_memoria,
+                                             args.limite_excel, args.semente):
+                resultados.append(registro)
+                if 'segundos' in registro:
+                    memoria = f"{registro['pico_memoria_mb']:>9.1f} MB" if 'pico_memoria_mb' in registro else ''
+                    print(f"  {registro['etapa']:<13} {registro['segundos']:>9.3f}s "
+                          f"{registro['linhas_por_segundo'] or 0:>12,} linhas/s {memoria}")
+                else:
+                    print(f"  {registro['etapa']:<13} ignorada: {registro['ignorada']}")
+
+    relatorio = {
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'versao_codigo': _versao_codigo(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'plataforma': platform.platform(),
+        'pico_rss_processo_mb': ac._pico_rss_mb(),
+        'resultados': resultados,
+    }
+    with open(args.saida, 'w', encoding='utf-8') as arquivo:
+        json.dump(relatorio, arquivo, ensure_ascii=False, indent=2)
+    print(f"\nResultados salvos em: {args.saida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as arquivo:
+            comparar_resultados(relatorio, json.load(arquivo))
+
+
+if __name__ == '__main__':
+    main()
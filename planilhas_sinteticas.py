@@ -0,0 +1,115 @@
+"""
+Planilhas sintéticas FEC_PQ/OFF_VOG usadas pelo benchmark e pelos testes.
+
+As bases são geradas com os nomes reais das regras (GRUPO, RAZAO, VENDEDOR),
+devoluções (CF 'DEV ...'), exceções por NF-E, P. Com em decimal e em
+percentual e produtos sem oferta.
+"""
+import contextlib
+import io
+
+import numpy as np
+import pandas as pd
+
+import averiguar_comissoes as ac
+
+
+def _nomes_das_regras():
+    """Grupos, razões, vendedores e códigos que aparecem no arquivo de regras"""
+    regras = ac.carregar_regras()
+    grupos, razoes, vendedores, codigos, grupos_produto = set(), set(), {'PROPRIO'}, set(), set()
+    valores_por_coluna = {'GRUPO': grupos, 'RAZAO': razoes, 'VENDEDOR': vendedores,
+                          'CODPRODUTO': codigos, 'GRUPO PRODUTO': grupos_produto}
+
+    for vendedor, regras_vendedor in regras['comissao_kg'].items():
+        if vendedor != 'TODOS':
+            vendedores.add(vendedor)
+        grupos.update(regras_vendedor.get('grupo', []))
+        for grupo, cods in regras_vendedor.get('grupo_codigos', {}).items():
+            grupos.add(grupo)
+            codigos.update(c for c in cods if isinstance(c, int))
+        for razao, cods in regras_vendedor.get('razao_codigos', {}).items():
+            razoes.add(razao)
+            codigos.update(c for c in cods if isinstance(c, int))
+
+    for regra in regras['regras_fixas']:
+        for coluna, valores in regra.get('quando', {}).items():
+            valores_por_coluna[coluna].update(valores)
+        for coluna, trecho in regra.get('contem', {}).items():
+            valores_por_coluna[coluna].add(trecho)
+
+    grupos.update(regras['ofertas'].get('grupos_desconto_5', []))
+    for grupo, gps in regras['ofertas'].get('grupo_produto_desconto_5', {}).items():
+        grupos.add(grupo)
+        grupos_produto.update(gps)
+
+    return sorted(grupos), sorted(razoes), sorted(vendedores), sorted(codigos), sorted(grupos_produto)
+
+
+def gerar_fec_pq(n_linhas, semente=0):
+    """Aba FEC_PQ sintética, com as colunas (e algumas a mais) como vêm da planilha"""
+    rng = np.random.default_rng(semente)
+    grupos, razoes, vendedores, codigos, grupos_produto = _nomes_das_regras()
+
+    # Metade das linhas com nomes das regras, metade com clientes/vendedores genéricos
+    grupos = grupos + [f'REDE GENERICA {i}' for i in range(len(grupos))]
+    razoes = razoes + [f'CLIENTE {i} LTDA' for i in range(5_000)]
+    vendedores = vendedores + [f'VENDEDOR {i}' for i in range(len(vendedores))]
+    codigos = np.array(codigos + list(range(3_000, 3_000 + 2 * len(codigos))))
+    grupos_produto = grupos_produto + ['OUTROS', 'LATICINIOS', 'BEBIDAS']
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        excecoes = list(ac.carregar_excecoes_nfe())
+    nfe = rng.integers(100_000, 200_000, n_linhas).astype(str).astype(object)
+    cod = rng.choice(codigos, n_linhas)
+    if excecoes:
+        # ~1% das linhas caem numa exceção por NF-E
+        linhas_excecao = np.flatnonzero(rng.random(n_linhas) < 0.01)
+        escolhidas = rng.integers(0, len(excecoes), len(linhas_excecao))
+        nfe[linhas_excecao] = [excecoes[i][0] for i in escolhidas]
+        cod[linhas_excecao] = [excecoes[i][1] for i in escolhidas]
+
+    p_com = rng.choice(np.array([0.0, 0.01, 0.02, 0.03, 3, 1, -0.01, -0.03], dtype=object), n_linhas)
+    p_com[rng.random(n_linhas) < 0.01] = '-'
+
+    return pd.DataFrame({
+        'CF': np.where(rng.random(n_linhas) < 0.05, 'DEV VENDA', 'VENDA'),
+        'RAZAO': rng.choice(razoes, n_linhas),
+        'GRUPO': rng.choice(grupos, n_linhas),
+        'NF-E': nfe,
+        'DATA': pd.Timestamp('2026-07-01') + pd.to_timedelta(rng.integers(0, 31, n_linhas), unit='D'),
+        'VENDEDOR': rng.choice(vendedores, n_linhas),
+        'CODPRODUTO': cod,
+        'GRUPO PRODUTO': rng.choice(grupos_produto, n_linhas),
+        'DESCRICAO': rng.choice(['PURURUCA 1KG', 'LINGUICA TOSCANA', 'PICANHA', 'BACON'], n_linhas),
+        'P. Com': p_com,
+        'PRECO VENDA': np.round(rng.uniform(5, 60, n_linhas), 2),
+        'ROMANEIO': rng.integers(1_000, 100_000, n_linhas),
+        'CIDADE': 'SAO PAULO',
+        'UF': 'SP',
+        'QTDE': rng.integers(1, 50, n_linhas),
+    })
+
+
+def gerar_off_vog(df_fec_pq, semente=0, fracao_sem_oferta=0.2):
+    """Aba OFF_VOG sintética: ofertas semanais para ~80% dos códigos vendidos"""
+    rng = np.random.default_rng(semente + 1)
+    codigos = np.unique(df_fec_pq['CODPRODUTO'])
+    codigos = codigos[rng.random(len(codigos)) >= fracao_sem_oferta]
+    datas = pd.date_range('2026-06-24', '2026-08-05', freq='7D')
+
+    ofertas = pd.DataFrame([(cod, data) for cod in codigos for data in datas], columns=['COD', 'DT_REF_OFF'])
+    preco_1 = np.round(rng.uniform(5, 40, len(ofertas)), 2)
+    ofertas['ITENS'] = 'PRODUTO ' + ofertas['COD'].astype(str)
+    ofertas['1%'] = preco_1
+    ofertas['2%'] = np.round(preco_1 * 1.1, 2)
+    ofertas['3%'] = np.round(preco_1 * 1.2, 2).astype(object)
+    ofertas.loc[rng.random(len(ofertas)) < 0.05, '3%'] = '-'
+    return ofertas[['COD', 'ITENS', '3%', '2%', '1%', 'DT_REF_OFF']]
+
+
+def gravar_planilha(df_fec_pq, df_off_vog, caminho):
+    """Grava a planilha de origem no layout real (cabeçalho da FEC_PQ na linha 10)"""
+    with pd.ExcelWriter(caminho, engine='xlsxwriter' if ac.xlsxwriter else 'openpyxl') as writer:
+        df_fec_pq.to_excel(writer, sheet_name='FEC_PQ', index=False, startrow=9)
+        df_off_vog.to_excel(writer, sheet_name='OFF_VOG', index=False)
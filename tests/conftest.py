@@ -0,0 +1,45 @@
+"""
+Configuração dos testes: pasta pessoal temporária e planilha sintética compartilhada.
+
+Cache das planilhas, índices de ofertas, estado do --incremental, histórico e métricas
+ficam na pasta pessoal (caminhos resolvidos na importação do módulo), por isso HOME é
+trocada antes de importar averiguar_comissoes.
+"""
+import os
+import sys
+import tempfile
+
+_PASTA_PESSOAL = tempfile.mkdtemp(prefix='averiguar_testes_')
+os.environ['HOME'] = _PASTA_PESSOAL
+os.environ['USERPROFILE'] = _PASTA_PESSOAL
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import averiguar_comissoes as ac
+from planilhas_sinteticas import gerar_fec_pq, gerar_off_vog, gravar_planilha
+
+LINHAS_PLANILHA_TESTE = 2_000
+
+
+@pytest.fixture(scope='session')
+def planos():
+    return ac.compilar_planos()
+
+
+@pytest.fixture(scope='session')
+def planilha_sintetica(tmp_path_factory):
+    """Planilha de origem sintética (FEC_PQ + OFF_VOG) no layout real"""
+    df_fec_pq = gerar_fec_pq(LINHAS_PLANILHA_TESTE)
+    caminho = tmp_path_factory.mktemp('origem') / 'Sintetica_MRG.xlsx'
+    gravar_planilha(df_fec_pq, gerar_off_vog(df_fec_pq), caminho)
+    return str(caminho)
+
+
+@pytest.fixture(scope='session')
+def saida_normal(planilha_sintetica, planos, tmp_path_factory):
+    """Resultado do processamento normal da planilha sintética, referência dos outros modos"""
+    caminho = str(tmp_path_factory.mktemp('normal') / 'resultado.xlsx')
+    ac.processar_planilhas(planilha_sintetica, caminho, planos=planos,
+                           caminho_metricas=None, caminho_historico=None)
+    return caminho
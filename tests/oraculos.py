@@ -0,0 +1,472 @@
+"""
+Versões linha a linha das classificações, como eram antes da vetorização. Servem só de
+oráculo: os testes conferem que as versões em lote do averiguar_comissoes dão o mesmo
+resultado, linha por linha.
+"""
+import numpy as np
+import pandas as pd
+
+
+def encontrar_oferta_mais_proxima(df_ofertas, codproduto, data_venda):
+    """
+    Encontra a oferta mais próxima no tempo (anterior ou posterior)
+    Prioridade: data exata > mais recente anterior > mais próxima futura
+    """
+    try:
+        cod = int(float(codproduto))
+        data = pd.to_datetime(data_venda).date()
+
+        # Filtrar ofertas para o código do produto
+        ofertas_cod = df_ofertas[df_ofertas['COD'] == cod].copy()
+
+        if ofertas_cod.empty:
+            return None
+
+        # Converter datas
+        ofertas_cod['DT_REF_OFF'] = pd.to_datetime(ofertas_cod['DT_REF_OFF']).dt.date
+
+        # 1. Buscar oferta na data exata
+        oferta_exata = ofertas_cod[ofertas_cod['DT_REF_OFF'] == data]
+        if not oferta_exata.empty:
+            return oferta_exata.iloc[0]
+
+        # 2. Buscar a oferta mais recente ANTERIOR
+        ofertas_anteriores = ofertas_cod[ofertas_cod['DT_REF_OFF'] < data]
+        if not ofertas_anteriores.empty:
+            # Ordenar por data DESCENDENTE (mais recente primeiro)
+            ofertas_anteriores = ofertas_anteriores.sort_values('DT_REF_OFF', ascending=False)
+            return ofertas_anteriores.iloc[0]
+
+        # 3. Se não houver anteriores, buscar a PRIMEIRA oferta POSTERIOR
+        ofertas_posteriores = ofertas_cod[ofertas_cod['DT_REF_OFF'] > data]
+        if not ofertas_posteriores.empty:
+            # Ordenar por data ASCENDENTE (mais próxima no futuro)
+            ofertas_posteriores = ofertas_posteriores.sort_values('DT_REF_OFF', ascending=True)
+            return ofertas_posteriores.iloc[0]
+
+        return None
+
+    except Exception as e:
+        print(f"Erro ao buscar oferta para {codproduto}: {str(e)}")
+        return None
+
+
+def pertence_comissao_kg(row, regras):
+    """Verifica se o registro pertence à comissão por kg"""
+    vendedor = str(row['VENDEDOR']).strip().upper()
+    grupo = str(row['GRUPO']).strip().upper()
+    razao = str(row['RAZAO']).strip().upper()
+    codproduto = row['CODPRODUTO']
+    descricao = str(row['DESCRICAO']).strip().upper()
+
+    # Primeiro verifica a regra geral (LOURENCINI)
+    if 'TODOS' in regras:
+        if 'grupo' in regras['TODOS']:
+            if grupo in regras['TODOS']['grupo']:
+                return True
+
+    # Depois verifica as regras específicas por vendedor
+    if vendedor in regras:
+        regras_vendedor = regras[vendedor]
+
+        # Verifica por grupo com códigos específicos
+        if 'grupo_codigos' in regras_vendedor:
+            for grp, codigos in regras_vendedor['grupo_codigos'].items():
+                if grupo == grp and (codproduto in codigos or 'TODOS' in codigos):
+                    return True
+
+        # Verifica por razão social com códigos específicos
+        if 'razao_codigos' in regras_vendedor:
+            for rz, codigos in regras_vendedor['razao_codigos'].items():
+                if razao == rz:
+                    if 'PURURUCA 1KG' in codigos:  # Caso especial do produto
+                        return 'PURURUCA 1KG' in descricao
+                    return codproduto in codigos
+    return False
+
+
+def criar_regras_comissao_fixa():
+    return {
+        'geral': {
+            0.00: {
+                'grupos': [
+                    'REDE AKKI', 'VAREJO ANDORINHA', 'VAREJO BERGAMINI', 'REDE DA PRACA', 'REDE DOVALE',
+                    'REDE REIMBERG', 'REDE SEMAR', 'REDE TRIMAIS', 'REDE VOVO ZUZU',
+                    'REDE BENGALA', 'VAREJO OURINHOS', 'REDE RICOY', 'REDE MERCADAO'
+                ],
+                'razoes': [
+                    'COMERCIO DE CARNES E ROTISSERIE DUTRA LT',
+                    'COMERCIO DE CARNES E ROTISSERIE DUTRA LTDA',
+                    'DISTRIBUIDORA E COMERCIO UAI SP LTDA',
+                    "LATICINIO SOBERANO LTDA VILA ALPINA",
+                    "SAO LORENZO ALIMENTOS LTDA",
+                    "QUE DELICIA MENDES COMERCIO DE ALIMENTOS",
+                    "MARIANA OLIVEIRA MAZZEI",
+                    "LS SANTOS COMERCIO DE ALIMENTOS LTDA",
+                    "MERCADINHO LESSA LTDA",
+                    "JSV SUPERMERCADOS EIRELI- LOJA 3"
+                ]
+            },
+            0.03: {
+                'grupos': ['VAREJO CALVO', 'REDE CHAMA', 'REDE ESTRELA AZUL', 'REDE TENDA', 'REDE HIGAS']
+            },
+            0.01: {
+                'razoes': ['SHOPPING FARTURA VALINHOS COMERCIO LTDA']
+            }
+        },
+        'grupos_especificos': {
+            'REDE ROSSI': {
+                0.03: {
+                    'codigos': [937, 1698, 1701, 1587, 1700, 1586, 1699, 943, 1735, 1624, 1134]
+                },
+                0.01: {
+                    'grupos_produto': [
+                        'CORTES BOVINOS'
+                    ],
+                    'codigos': [1265, 1266, 812, 1115, 798, 1211],
+                },
+                0.00: {
+                    'grupos_produto': [
+                        'EMBUTIDOS', 'EMBUTIDOS NOBRE', 'EMBUTIDOS SADIA',
+                        'EMBUTIDOS PERDIGAO', 'EMBUTIDOS AURORA', 'EMBUTIDOS SEARA',
+                        'SALAME UAI'
+                    ],
+                    'codigos': [1139]
+                },
+                0.02: {
+                    'grupos_produto': ['MIUDOS BOVINOS', 'SUINOS', 'SALGADOS SUINOS A GRANEL'],
+                    'codigos': [700]
+                },
+
+                0.03: {
+                    'grupos_produto': ['TORRESMO'],
+                }
+            },
+            'REDE PLUS': {
+                0.03: {
+                    'grupos_produto': ['TEMPERADOS'],
+                    'codigos': [812]
+                }
+            },
+            'REDE CENCOSUD': {
+                0.01: {
+                    'grupos_produto': ['SALAME UAI']
+                },
+            },
+            'REDE AYUMI': {
+                0.03: {
+                    'grupos_produto': ['SALAME UAI']
+                },
+            },
+            'REDE ROLDAO': {
+                0.02: {
+                    'grupos_produto': [
+                        'CONGELADOS', 'CORTES BOVINOS', 'CORTES DE FRANGO', 'EMBUTIDOS',
+                        'EMBUTIDOS AURORA', 'EMBUTIDOS NOBRE', 'EMBUTIDOS PERDIGÃO',
+                        'EMBUTIDOS SADIA', 'EMBUTIDOS SEARA', 'EMPANADOS',
+                        'KITS FEIJOADA', 'MIUDOS BOVINOS', 'SUINOS', 'TEMPERADOS'
+                    ]
+                },
+                0.00: {
+                    'todos_exceto': [
+                        'CONGELADOS', 'CORTES BOVINOS', 'CORTES DE FRANGO', 'EMBUTIDOS',
+                        'EMBUTIDOS AURORA', 'EMBUTIDOS NOBRE', 'EMBUTIDOS PERDIGÃO',
+                        'EMBUTIDOS SADIA', 'EMBUTIDOS SEARA', 'EMPANADOS',
+                        'KITS FEIJOADA', 'MIUDOS BOVINOS', 'SUINOS', 'TEMPERADOS'
+                    ]
+                }
+            }
+        },
+        'razoes_especificas': {
+            'PAES E DOCES LEKA LTDA': {
+                0.03: [1893, 1886]
+            },
+            'PAES E DOCES MICHELLI LTDA': {
+                0.03: [1893, 1886]
+            },
+            'WANDERLEY GOMES MORENO': {
+                0.03: [1893, 1886]
+            }
+        }
+    }
+
+
+def aplicar_regras_comissao_fixa(row, regras):
+    """Aplica as regras de comissão fixa de forma dinâmica"""
+    vendedor = str(row['VENDEDOR']).strip().upper()
+    grupo = str(row['GRUPO']).strip().upper()
+    razao = str(row['RAZAO']).strip().upper()
+    codproduto = row['CODPRODUTO']
+    grupo_produto = str(row['GRUPO PRODUTO']).strip().upper()
+    nfe = str(row['NF-E']).strip()
+    is_devolucao = str(row['CF']).startswith('DEV')
+
+    if nfe == '131009' and codproduto == 1477:
+            return _ajustar_para_devolucao(0.03, is_devolucao)
+    if nfe == '136119' and codproduto == 4011:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '136129' and codproduto == 1384:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '136130' and codproduto == 4011:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '136130' and codproduto == 1384:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '136148' and codproduto == 4011:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '136148' and codproduto == 1384:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '136150' and codproduto == 4011:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '136150' and codproduto == 1384:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '136169' and codproduto == 1384:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '136171' and codproduto == 1384:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '136171' and codproduto == 1874:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '136172' and codproduto == 4011:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '136172' and codproduto == 1384:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '136173' and codproduto == 1384:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '136949' and codproduto == 1878:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '137033' and codproduto == 1878:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '137271' and codproduto == 1584:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '137319' and codproduto == 1584:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '137426' and codproduto == 1584:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '137560' and codproduto == 1567:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '137596' and codproduto == 1878:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '137596' and codproduto == 1567:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '137842' and codproduto == 8006:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '137933' and codproduto == 1584:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '137939' and codproduto == 2198:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '137939' and codproduto == 1584:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '137939' and codproduto == 1567:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '137941' and codproduto == 1584:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '137943' and codproduto == 1584:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '137992' and codproduto == 1584:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '138031' and codproduto == 1567:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '138067' and codproduto == 1584:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '138078' and codproduto == 1567:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '138143' and codproduto == 1567:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '138378' and codproduto == 1584:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '138521' and codproduto == 1584:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+    if nfe == '138753' and codproduto == 2198:
+            return _ajustar_para_devolucao(0.005, is_devolucao)
+
+
+
+    if codproduto == 1807 or codproduto == 947 or codproduto == 1914 or codproduto == 2000 or codproduto == 3002 or codproduto == 2094:
+        return _ajustar_para_devolucao(0.01, is_devolucao)
+
+    if vendedor == "PROPRIO":
+        return _ajustar_para_devolucao(0.00, is_devolucao)
+
+    if grupo == 'REDE RICOY':
+        return _ajustar_para_devolucao(0.00, is_devolucao)
+
+    if grupo == 'REDE ROLDAO':
+        grupos_2_percent = [
+            'CONGELADOS', 'CORTES BOVINOS', 'CORTES DE FRANGO', 'EMBUTIDOS',
+            'EMBUTIDOS AURORA', 'EMBUTIDOS NOBRE', 'EMBUTIDOS PERDIGÃO',
+            'EMBUTIDOS SADIA', 'EMBUTIDOS SEARA', 'EMPANADOS',
+            'KITS FEIJOADA', 'MIUDOS BOVINOS', 'SUINOS', 'TEMPERADOS'
+        ]
+
+        if grupo_produto in grupos_2_percent:
+            return _ajustar_para_devolucao(0.02, is_devolucao)
+        else:
+            return _ajustar_para_devolucao(0.00, is_devolucao)
+
+
+    if grupo == 'VAREJO CALVO':
+        if grupo_produto in ['MIUDOS BOVINOS', 'CORTES DE FRANGO', 'SUINOS']:
+            return None  # Processar por ofertas
+
+        return _ajustar_para_devolucao(0.03, is_devolucao)
+
+    if 'REDE CENCOSUD' in grupo:
+        if 'SALAME UAI' in grupo_produto:
+            return _ajustar_para_devolucao(0.01, is_devolucao)
+        return _ajustar_para_devolucao(0.03, is_devolucao)
+
+    if grupo == 'REDE ROSSI':
+        if codproduto in [937, 1698, 1701, 1587, 1700, 1586, 1699, 943, 1735, 1624, 1134]:
+            return _ajustar_para_devolucao(0.03, is_devolucao)
+
+        if grupo_produto in ["CORTES BOVINOS"]:
+            return _ajustar_para_devolucao(0.01, is_devolucao)
+
+        if codproduto == 1139:
+            return _ajustar_para_devolucao(0.00, is_devolucao)
+
+        if grupo_produto in ['EMBUTIDOS', 'EMBUTIDOS NOBRE', 'EMBUTIDOS SADIA',
+                           'EMBUTIDOS PERDIGAO', 'EMBUTIDOS AURORA', 'EMBUTIDOS SEARA',
+                           'SALAME UAI']:
+            return _ajustar_para_devolucao(0.00, is_devolucao)
+
+        if grupo_produto in ["MIUDOS BOVINOS", "SUINOS", "SALGADOS SUINOS A GRANEL",
+                             "SALGADOS SUINOS EMBALADOS", "CORTES DE FRANGO"]:
+            return _ajustar_para_devolucao(0.02, is_devolucao)
+
+        if grupo_produto in ['TORRESMO']:
+                    return _ajustar_para_devolucao(0.03, is_devolucao)
+
+        if codproduto == 700:
+            return _ajustar_para_devolucao(0.02, is_devolucao)
+
+        if codproduto in [1265, 1266, 812, 1115, 798, 1211]:
+            return _ajustar_para_devolucao(0.01, is_devolucao)
+
+    if grupo == 'REDE PLUS':
+        if grupo_produto in ['TEMPERADOS']:
+            return _ajustar_para_devolucao(0.03, is_devolucao)
+
+        if codproduto == 812:
+            return _ajustar_para_devolucao(0.03, is_devolucao)
+
+    if grupo in regras['grupos_especificos']:
+        regras_grupo = regras['grupos_especificos'][grupo]
+
+        for porcentagem in [0.00, 0.02, 0.01, 0.03]:
+            if porcentagem in regras_grupo:
+                condicoes = regras_grupo[porcentagem]
+
+                if isinstance(condicoes, list):
+                    if codproduto in condicoes:
+                        return _ajustar_para_devolucao(porcentagem, is_devolucao)
+
+                elif isinstance(condicoes, dict):
+                    match = True
+
+                    if 'grupos_produto' in condicoes:
+                        if grupo_produto not in condicoes['grupos_produto']:
+                            match = False
+
+                    if 'codigos' in condicoes and match:
+                        if codproduto not in condicoes['codigos']:
+                            match = False
+
+                    if match:
+                        return _ajustar_para_devolucao(porcentagem, is_devolucao)
+
+    for porcentagem, condicoes in regras['geral'].items():
+        if 'grupos' in condicoes:
+            if grupo in condicoes['grupos']:
+                return _ajustar_para_devolucao(porcentagem, is_devolucao)
+
+        if 'razoes' in condicoes:
+            if razao in condicoes['razoes']:
+                return _ajustar_para_devolucao(porcentagem, is_devolucao)
+
+    return None
+
+
+def _ajustar_para_devolucao(valor, is_devolucao):
+    return valor if not is_devolucao else -valor
+
+
+def _converter_para_decimal_percentual(valor):
+    try:
+        if pd.isna(valor):
+            return None
+
+        if isinstance(valor, str):
+            valor = valor.replace(',', '.').replace('%', '').strip()
+
+        valor_float = float(valor)
+
+        if valor_float > 1:
+            return valor_float / 100.0
+        else:
+            return valor_float
+
+    except Exception as e:
+        print(f"Erro ao converter valor '{valor}': {str(e)}")
+        return None
+
+
+def _comparar_comissoes(comissao_atual, comissao_esperada, decimal_places=4):
+    try:
+        atual = _converter_para_decimal_percentual(comissao_atual)
+        esperada = _converter_para_decimal_percentual(comissao_esperada)
+
+        if atual is None or esperada is None:
+            return False
+
+        atual_rounded = round(atual, decimal_places)
+        esperada_rounded = round(esperada, decimal_places)
+
+        return atual_rounded == esperada_rounded
+    except (ValueError, TypeError) as e:
+        print(f"Erro na comparação: {str(e)}, atual={comissao_atual}, esperada={comissao_esperada}")
+        return False
+
+
+def classificar_comissao_por_oferta(preco, preco_oferta_3, preco_oferta_2, preco_oferta_1, grupo, grupo_produto, is_devolucao):
+    """
+    Classifica a comissão baseada nos preços de oferta
+    Lógica:
+    - Se preço >= oferta_3%: 3%
+    - Se preço >= oferta_2%: 2%
+    - Se preço >= oferta_1%: 1%
+    - Caso contrário: 1% (fallback)
+
+    Aplica -5% para grupos especiais antes da comparação
+    """
+
+    # Aplicar desconto de 5% para grupos especiais
+    grupos_especiais = ['REDE STYLLUS', 'REDE ROD E RAF']
+    if grupo == 'VAREJO CALVO' and grupo_produto in ['MIUDOS BOVINOS', 'CORTES DE FRANGO', 'SUINOS']:
+        grupos_especiais.append('VAREJO CALVO')
+
+    if grupo in grupos_especiais:
+        # Aplicar desconto de 5% e ARREDONDAR para 2 casas decimais
+        preco_comparacao = round(preco * 0.95, 2)
+    else:
+        preco_comparacao = preco
+
+    # Verificar se os preços de oferta são válidos
+    preco_oferta_3_valido = preco_oferta_3 is not None and not np.isnan(preco_oferta_3) and preco_oferta_3 > 0
+    preco_oferta_2_valido = preco_oferta_2 is not None and not np.isnan(preco_oferta_2) and preco_oferta_2 > 0
+    preco_oferta_1_valido = preco_oferta_1 is not None and not np.isnan(preco_oferta_1) and preco_oferta_1 > 0
+
+    # Lógica de classificação
+    if preco_oferta_3_valido and preco_comparacao >= preco_oferta_3:
+        comissao = 0.03
+    elif preco_oferta_2_valido and preco_comparacao >= preco_oferta_2:
+        comissao = 0.02
+    elif preco_oferta_1_valido:
+        comissao = 0.01
+    else:
+        comissao = 0.01  # Fallback padrão
+
+    # Ajustar para devolução
+    if is_devolucao:
+        comissao *= -1
+
+    return comissao
@@ -0,0 +1,20 @@
+"""Comparação dos resultados gravados pelos diferentes modos de execução"""
+import pandas as pd
+
+import averiguar_comissoes as ac
+
+
+def ler_saida(caminho):
+    """Abas do resultado, sem os tempos da cobertura de regras (mudam a cada execução)"""
+    abas = pd.read_excel(caminho, sheet_name=None)
+    if ac.ABA_COBERTURA_REGRAS in abas:
+        abas[ac.ABA_COBERTURA_REGRAS] = abas[ac.ABA_COBERTURA_REGRAS].drop(columns=['Segundos Etapa'])
+    return abas
+
+
+def comparar_saidas(caminho_esperado, caminho_obtido):
+    """Falha se os dois resultados não tiverem as mesmas abas, na mesma ordem, com o mesmo conteúdo"""
+    esperado, obtido = ler_saida(caminho_esperado), ler_saida(caminho_obtido)
+    assert list(obtido) == list(esperado)
+    for aba, df_esperado in esperado.items():
+        pd.testing.assert_frame_equal(obtido[aba], df_esperado, obj=aba)
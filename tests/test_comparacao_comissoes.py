@@ -0,0 +1,25 @@
+"""Conferência da comissão paga contra a esperada (normalização percentual e arredondamento)"""
+import numpy as np
+
+import averiguar_comissoes as ac
+from oraculos import _comparar_comissoes
+
+
+def test_comparar_comissoes_em_lote_igual_a_comparacao_linha_a_linha():
+    # Empates na 5ª casa (0.00025, 1,015%, 1.145), percentuais, textos com vírgula, vazios e inválidos
+    atuais = [0.00025, '1,015%', 1.145, 0.00035, 0.03, 3, '3%', '3,0', 0.025, -0.01, -1, None, '-', 'abc', 0.0]
+    esperadas = [0.0003, 0.0101, 0.0115, 0.0004, 0.03, 0.03, 0.03, 0.03, 0.0003, -0.01, -0.01, 0.03, 0.03, 0.03, -0.0]
+
+    obtido = ac.comparar_comissoes_em_lote(atuais, esperadas)
+
+    esperado = [_comparar_comissoes(atual, esperada) for atual, esperada in zip(atuais, esperadas)]
+    assert obtido.tolist() == esperado
+    assert obtido[:3].all()  # Com o np.round essas linhas dariam 'Incorreto'
+
+
+def test_arredondar_como_python():
+    valores = np.array([0.00005, 0.00025, 0.00035, 0.125, 2.675, -0.00025, 1.005, np.nan, 12.5])
+    for casas in (0, 2, 4):
+        obtido = ac._arredondar_como_python(valores, casas)
+        esperado = [round(float(valor), casas) for valor in valores]
+        np.testing.assert_array_equal(obtido, esperado)
@@ -0,0 +1,27 @@
+"""Lote: planilhas de várias pastas, cada uma com o seu resultado"""
+import shutil
+
+import pytest
+
+import averiguar_comissoes as ac
+
+
+def test_lote_recusa_planilhas_com_o_mesmo_nome(planilha_sintetica, tmp_path):
+    for pasta in ('janeiro', 'fevereiro'):
+        (tmp_path / pasta).mkdir()
+        shutil.copy(planilha_sintetica, tmp_path / pasta / 'Semana_MRG.xlsx')
+    # Mesmo nome com outra extensão também geraria o mesmo resultado
+    shutil.copy(planilha_sintetica, tmp_path / 'fevereiro' / 'Outra_MRG.xlsx')
+    shutil.copy(planilha_sintetica, tmp_path / 'janeiro' / 'Outra_MRG.xlsm')
+
+    with pytest.raises(ValueError, match='mesmo nome') as erro:
+        ac.processar_lote([str(tmp_path / 'janeiro'), str(tmp_path / 'fevereiro')], str(tmp_path / 'saida'))
+    assert 'Semana_MRG' in str(erro.value) and 'Outra_MRG' in str(erro.value)
+    assert not (tmp_path / 'saida').exists()
+
+    assert len(ac.listar_planilhas([str(tmp_path / 'janeiro')])) == 2
+
+
+def test_perfil_nao_vale_no_lote(planilha_sintetica):
+    with pytest.raises(SystemExit):
+        ac.main([planilha_sintetica, '--perfil'])
@@ -0,0 +1,164 @@
+"""Os modos de execução (blocos, esteira, incremental, vigia) dão o mesmo resultado do processamento normal"""
+import shutil
+
+import numpy as np
+import pandas as pd
+
+import averiguar_comissoes as ac
+from planilhas_sinteticas import gerar_fec_pq, gerar_off_vog, gravar_planilha
+from saidas import comparar_saidas
+
+
+def test_blocos_igual_ao_normal(planilha_sintetica, planos, saida_normal, tmp_path):
+    caminho_saida = str(tmp_path / 'blocos.xlsx')
+    ac.processar_planilhas_em_blocos(planilha_sintetica, caminho_saida, planos=planos, linhas_por_bloco=300,
+                                     caminho_metricas=None, caminho_historico=None)
+    comparar_saidas(saida_normal, caminho_saida)
+
+
+def test_esteira_igual_ao_normal(planilha_sintetica, planos, saida_normal, tmp_path):
+    caminho_saida = str(tmp_path / 'esteira.xlsx')
+    ac.processar_planilhas_em_esteira(planilha_sintetica, caminho_saida, planos=planos,
+                                      caminho_metricas=None, caminho_historico=None, processos=2)
+    comparar_saidas(saida_normal, caminho_saida)
+
+
+def test_esteira_pela_linha_de_comando_com_planilha(planilha_sintetica, saida_normal, tmp_path):
+    ac.main(['--esteira', planilha_sintetica, '--saida', str(tmp_path), '--processos', '2', '--sem-historico'])
+    comparar_saidas(saida_normal, ac._caminho_saida_lote(planilha_sintetica, str(tmp_path)))
+
+
+def test_incremental_igual_ao_normal(planos, tmp_path):
+    df_fec_pq = gerar_fec_pq(1_500, semente=7)
+    df_off_vog = gerar_off_vog(df_fec_pq, semente=7)
+    (tmp_path / 'v1').mkdir()
+    (tmp_path / 'v2').mkdir()
+    caminho_v1 = str(tmp_path / 'v1' / 'Incremental_MRG.xlsx')
+    gravar_planilha(df_fec_pq, df_off_vog, caminho_v1)
+
+    # Primeira execução (sem estado) e repetição com tudo reaproveitado
+    for execucao in ('primeira', 'repetida'):
+        caminho_saida = str(tmp_path / f'incremental_{execucao}.xlsx')
+        ac.processar_planilhas(caminho_v1, caminho_saida, planos=planos, incremental=True,
+                               caminho_metricas=None, caminho_historico=None)
+        comparar_saidas(str(tmp_path / 'incremental_primeira.xlsx'), caminho_saida)
+    caminho_completo = str(tmp_path / 'completo_v1.xlsx')
+    ac.processar_planilhas(caminho_v1, caminho_completo, planos=planos, caminho_metricas=None, caminho_historico=None)
+    comparar_saidas(caminho_completo, str(tmp_path / 'incremental_primeira.xlsx'))
+
+    # Nova versão da planilha (mesmo nome): linhas alteradas, removidas e novas, e ofertas com preço novo
+    rng = np.random.default_rng(7)
+    df_fec_pq.loc[rng.choice(len(df_fec_pq), 100, replace=False), 'P. Com'] = 0.02
+    df_fec_pq = df_fec_pq.drop(index=rng.choice(len(df_fec_pq), 50, replace=False))
+    novas = gerar_fec_pq(80, semente=8)
+    df_fec_pq = pd.concat([df_fec_pq, novas], ignore_index=True)
+    df_off_vog.loc[df_off_vog['COD'].isin(df_off_vog['COD'].unique()[:10]), '1%'] += 1
+    caminho_v2 = str(tmp_path / 'v2' / 'Incremental_MRG.xlsx')
+    gravar_planilha(df_fec_pq, df_off_vog, caminho_v2)
+
+    caminho_incremental = str(tmp_path / 'incremental_v2.xlsx')
+    ac.processar_planilhas(caminho_v2, caminho_incremental, planos=planos, incremental=True,
+                           caminho_metricas=None, caminho_historico=None)
+    caminho_completo = str(tmp_path / 'completo_v2.xlsx')
+    ac.processar_planilhas(caminho_v2, caminho_completo, planos=planos, caminho_metricas=None, caminho_historico=None)
+    comparar_saidas(caminho_completo, caminho_incremental)
+
+
+def test_incremental_sem_linhas_nas_regras_fixas(planos, tmp_path):
+    """Destinos que ficam vazios (aqui, regras fixas) mantêm as colunas, na primeira execução e nas seguintes"""
+    df_fec_pq = gerar_fec_pq(300, semente=11).assign(
+        GRUPO='REDE GENERICA', RAZAO='CLIENTE SEM REGRA LTDA', VENDEDOR='VENDEDOR 1', CODPRODUTO=5000)
+    caminho_origem = str(tmp_path / 'Sem_Regras_MRG.xlsx')
+    gravar_planilha(df_fec_pq, gerar_off_vog(df_fec_pq, semente=11), caminho_origem)
+    caminho_completo = str(tmp_path / 'completo.xlsx')
+    ac.processar_planilhas(caminho_origem, caminho_completo, planos=planos, caminho_metricas=None,
+                           caminho_historico=None)
+
+    for execucao in ('primeira', 'segunda'):
+        caminho_saida = str(tmp_path / f'incremental_{execucao}.xlsx')
+        ac.processar_planilhas(caminho_origem, caminho_saida, planos=planos, incremental=True,
+                               caminho_metricas=None, caminho_historico=None)
+        comparar_saidas(caminho_completo, caminho_saida)
+
+
+def test_vigia_igual_ao_normal(planilha_sintetica, saida_normal, tmp_path):
+    pasta = tmp_path / 'entrada'
+    pasta.mkdir()
+    shutil.copy(planilha_sintetica, pasta / 'Vigiada_MRG.xlsx')
+
+    resumos = ac.vigiar_pasta(str(pasta), str(tmp_path / 'saida'), caminho_historico=None,
+                              intervalo=0.05, espera=0, ciclos=3)
+
+    assert len(resumos) == 1 and not resumos[0].get('Erro')
+    comparar_saidas(saida_normal, resumos[0]['Saida'])
+
+
+def test_vendas_sem_data_vao_para_os_logs_de_erros(planos, tmp_path):
+    df_fec_pq = gerar_fec_pq(600, semente=13)
+    df_off_vog = gerar_off_vog(df_fec_pq, semente=13)
+    df_fec_pq['DATA'] = df_fec_pq['DATA'].astype(object)
+    df_fec_pq.loc[::50, 'DATA'] = 'sem data'
+    df_fec_pq.loc[25::50, 'DATA'] = None
+    caminho_origem = str(tmp_path / 'Datas_MRG.xlsx')
+    gravar_planilha(df_fec_pq, df_off_vog, caminho_origem)
+
+    caminho_normal = str(tmp_path / 'normal.xlsx')
+    resumo = ac.processar_planilhas(caminho_origem, caminho_normal, planos=planos, caminho_metricas=None,
+                                    caminho_historico=None)
+
+    abas = pd.read_excel(caminho_normal, sheet_name=None)
+    logs = abas['Logs Erros']
+    # Só as vendas sem data que não ficaram na comissão por kg nem nas regras fixas chegam às ofertas
+    sem_data = df_fec_pq['DATA'].map(lambda data: not isinstance(data, pd.Timestamp))
+    assert 0 < len(logs) <= sem_data.sum()
+    assert resumo['Erros'] == len(logs)
+    assert set(logs['Mensagem']) == {ac.MENSAGEM_SEM_DATA}
+    assert logs['DATA'].isna().all()
+    assert abas['Sem Oferta']['DATA'].notna().all()
+
+    for modo, processar in (('blocos', lambda saida: ac.processar_planilhas_em_blocos(
+                                caminho_origem, saida, planos=planos, linhas_por_bloco=200,
+                                caminho_metricas=None, caminho_historico=None)),
+                            ('esteira', lambda saida: ac.processar_planilhas_em_esteira(
+                                caminho_origem, saida, planos=planos, caminho_metricas=None,
+                                caminho_historico=None, processos=2)),
+                            ('incremental', lambda saida: ac.processar_planilhas(
+                                caminho_origem, saida, planos=planos, incremental=True,
+                                caminho_metricas=None, caminho_historico=None))):
+        caminho_saida = str(tmp_path / f'{modo}.xlsx')
+        processar(caminho_saida)
+        comparar_saidas(caminho_normal, caminho_saida)
+
+
+def test_blocos_mostram_os_avisos_de_todos_os_blocos(planos, tmp_path, capsys):
+    df_fec_pq = gerar_fec_pq(600, semente=14)
+    df_fec_pq['DATA'] = df_fec_pq['DATA'].astype(object)
+    df_fec_pq.loc[500, 'DATA'] = 'sem data'
+    caminho_origem = str(tmp_path / 'Aviso_MRG.xlsx')
+    gravar_planilha(df_fec_pq, gerar_off_vog(df_fec_pq, semente=14), caminho_origem)
+
+    ac.processar_planilhas_em_blocos(caminho_origem, str(tmp_path / 'blocos.xlsx'), planos=planos,
+                                     linhas_por_bloco=200, caminho_metricas=None, caminho_historico=None)
+
+    # O aviso vem do terceiro bloco; as contagens de cada etapa, só do primeiro
+    saida = capsys.readouterr().out
+    assert "ATENÇÃO: 1 datas inválidas em 'DATA'" in saida
+    assert saida.count('- Itens para comissão por kg') == 1
+
+
+def test_blocos_com_nfe_de_numeros_e_texto_igual_ao_normal(planos, tmp_path):
+    """Os tipos das colunas de chave não dependem de quais linhas caem em cada bloco"""
+    df_fec_pq = gerar_fec_pq(600, semente=15)
+    # Só o último bloco tem NF-E em texto, e o primeiro tem NF-E vazia (coluna com números e vazios)
+    df_fec_pq.loc[df_fec_pq.index[-5:], 'NF-E'] = df_fec_pq['NF-E'].iloc[-5:] + '/1'
+    df_fec_pq.loc[3, 'NF-E'] = None
+    caminho_origem = str(tmp_path / 'Nfe_Mista_MRG.xlsx')
+    gravar_planilha(df_fec_pq, gerar_off_vog(df_fec_pq, semente=15), caminho_origem)
+
+    caminho_normal = str(tmp_path / 'normal.xlsx')
+    ac.processar_planilhas(caminho_origem, caminho_normal, planos=planos, caminho_metricas=None,
+                           caminho_historico=None)
+    caminho_blocos = str(tmp_path / 'blocos.xlsx')
+    ac.processar_planilhas_em_blocos(caminho_origem, caminho_blocos, planos=planos, linhas_por_bloco=200,
+                                     caminho_metricas=None, caminho_historico=None)
+    comparar_saidas(caminho_normal, caminho_blocos)
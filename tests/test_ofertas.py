@@ -0,0 +1,99 @@
+"""Associação de cada venda à oferta VOG mais próxima no tempo"""
+import numpy as np
+import pandas as pd
+
+import averiguar_comissoes as ac
+from oraculos import classificar_comissao_por_oferta, encontrar_oferta_mais_proxima
+from planilhas_sinteticas import gerar_fec_pq, gerar_off_vog
+
+
+def test_associar_ofertas_em_lote_igual_a_busca_linha_a_linha():
+    df_vendas = gerar_fec_pq(400, semente=3)
+    df_ofertas = gerar_off_vog(df_vendas, semente=3)
+    # Vendas antes da primeira oferta (oferta futura) e exatamente nas datas das ofertas
+    df_vendas.loc[:49, 'DATA'] = pd.Timestamp('2026-06-01')
+    df_vendas.loc[50:99, 'DATA'] = pd.Timestamp('2026-07-08')
+
+    resultado = ac.associar_ofertas_em_lote(df_vendas, df_ofertas)
+    assert set(resultado['Tipo_Oferta'].dropna()) == {'Exata', 'Data Proxima Ant', 'Data Proxima Pos'}
+
+    for posicao, venda in df_vendas.iterrows():
+        oferta = encontrar_oferta_mais_proxima(df_ofertas, venda['CODPRODUTO'], venda['DATA'])
+        obtida = resultado.loc[posicao]
+        if oferta is None:
+            assert pd.isna(obtida['DT_REF_OFF']), posicao
+            continue
+        assert obtida['DT_REF_OFF'] == oferta['DT_REF_OFF'], posicao
+        for coluna in ac.COLUNAS_PRECO_VOG:
+            esperado = pd.to_numeric(oferta[coluna], errors='coerce')
+            assert obtida[coluna] == esperado or (np.isnan(esperado) and np.isnan(obtida[coluna])), (posicao, coluna)
+
+
+def test_classificar_comissao_por_oferta_em_lote_igual_a_classificacao_linha_a_linha(planos):
+    rng = np.random.default_rng(5)
+    n = 3_000
+    # Preços com centavos e ofertas em volta deles: empates, ofertas vazias, zeradas e negativas
+    preco = np.round(rng.uniform(5, 30, n), 2)
+    ofertas = {coluna: np.round(preco * rng.choice([0.9, 0.95, 1.0, 1.05], n), 2) for coluna in ac.COLUNAS_PRECO_VOG}
+    for valores in ofertas.values():
+        valores[rng.random(n) < 0.1] = np.nan
+        valores[rng.random(n) < 0.05] = rng.choice([0.0, -1.0])
+    grupo = rng.choice(['REDE STYLLUS', 'REDE ROD E RAF', 'VAREJO CALVO', 'REDE ROSSI'], n)
+    grupo_produto = rng.choice(['MIUDOS BOVINOS', 'SUINOS', 'CORTES DE FRANGO', 'EMBUTIDOS'], n)
+    is_devolucao = rng.random(n) < 0.2
+
+    obtido = ac.classificar_comissao_por_oferta_em_lote(preco, ofertas['3%'], ofertas['2%'], ofertas['1%'], grupo,
+                                                        grupo_produto, is_devolucao, planos['ofertas'])
+
+    esperado = [classificar_comissao_por_oferta(*valores) for valores in zip(
+        preco.tolist(), ofertas['3%'].tolist(), ofertas['2%'].tolist(), ofertas['1%'].tolist(),
+        grupo, grupo_produto, is_devolucao)]
+    np.testing.assert_array_equal(obtido, esperado)
+
+
+def test_indice_de_ofertas_reaproveitado_pela_planilha_da_semana_seguinte(tmp_path, capsys):
+    df_vendas = gerar_fec_pq(400, semente=21)
+    df_ofertas = gerar_off_vog(df_vendas, semente=21)
+    # A OFF_VOG da semana seguinte é a desta com as ofertas novas no fim
+    nova = pd.to_datetime(df_ofertas['DT_REF_OFF']) >= pd.Timestamp('2026-07-29')
+    semana_1 = df_ofertas[~nova]
+    semana_2 = pd.concat([semana_1, df_ofertas[nova]], ignore_index=True)
+
+    ac._INDICES_OFERTAS.clear()
+    ac.carregar_indice_ofertas(semana_1, diretorio=str(tmp_path))
+    ac._INDICES_OFERTAS.clear()
+    indice = ac.carregar_indice_ofertas(semana_2, diretorio=str(tmp_path))
+    assert f"+{nova.sum()} ofertas acrescentadas" in capsys.readouterr().out
+
+    esperado = ac.construir_indice_ofertas(semana_2)
+    assert set(indice) == set(esperado)
+    for coluna, valores in esperado.items():
+        np.testing.assert_array_equal(indice[coluna], valores, err_msg=coluna)
+
+    # Sem mudanças, o índice gravado é aberto com memmap, sem cópia para a memória
+    ac._INDICES_OFERTAS.clear()
+    indice = ac.carregar_indice_ofertas(semana_2, diretorio=str(tmp_path))
+    assert 'Índice de ofertas carregado' in capsys.readouterr().out
+    assert all(isinstance(valores, np.memmap) for valores in indice.values())
+
+
+def test_indices_de_ofertas_em_memoria_so_os_mais_recentes(tmp_path, capsys):
+    ofertas = [gerar_off_vog(gerar_fec_pq(200, semente=semente), semente=semente) for semente in (31, 32, 33)]
+    ac._INDICES_OFERTAS.clear()
+
+    # A semana seguinte (mesma OFF_VOG com ofertas novas no fim) ocupa o lugar da anterior
+    ac.carregar_indice_ofertas(ofertas[0].iloc[:-10], diretorio=str(tmp_path))
+    ac.carregar_indice_ofertas(ofertas[0], diretorio=str(tmp_path))
+    assert len(ac._INDICES_OFERTAS) == 1
+
+    for df_ofertas in ofertas[1:]:
+        ac.carregar_indice_ofertas(df_ofertas, diretorio=str(tmp_path))
+    assert len(ac._INDICES_OFERTAS) == ac.INDICES_OFERTAS_EM_MEMORIA
+
+    # O mais antigo saiu da memória e volta do disco; o mais recente continua em memória
+    capsys.readouterr()
+    ac.carregar_indice_ofertas(ofertas[2], diretorio=str(tmp_path))
+    assert 'Índice de ofertas em memória' in capsys.readouterr().out
+    ac.carregar_indice_ofertas(ofertas[0], diretorio=str(tmp_path))
+    assert 'Índice de ofertas carregado' in capsys.readouterr().out
+    ac._INDICES_OFERTAS.clear()
@@ -0,0 +1,96 @@
+"""Regras fixas compiladas (busca por hash) contra a função de regras linha a linha original"""
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import averiguar_comissoes as ac
+from oraculos import aplicar_regras_comissao_fixa, criar_regras_comissao_fixa
+from planilhas_sinteticas import gerar_off_vog, gravar_planilha
+
+GRUPO_SEM_REGRA = 'REDE GENERICA'
+GRUPO_PRODUTO_SEM_REGRA = 'OUTROS'
+CODIGO_SEM_REGRA = 5000
+GRUPOS_PRODUTO_E_CODIGO = ['REDE ROSSI', 'REDE PLUS', ' rede rossi ']  # Regras por GRUPO PRODUTO e por código
+
+
+def gerar_fec_pq_todas_as_regras():
+    """
+    FEC_PQ com as combinações GRUPO x GRUPO PRODUTO e GRUPO x CODPRODUTO citadas nas
+    regras fixas (e valores fora delas), GRUPO x GRUPO PRODUTO x CODPRODUTO nos grupos
+    com regras por produto e por código, cada razão social e vendedor das regras e cada
+    exceção por NF-E, em vendas e devoluções
+    """
+    valores = {coluna: set() for coluna in ac.COLUNAS_REGRA_FIXA}
+    for regra in ac.carregar_regras()['regras_fixas']:
+        for coluna, nomes in regra.get('quando', {}).items():
+            valores[coluna].update(nomes)
+        for coluna, trecho in regra.get('contem', {}).items():
+            valores[coluna].update([trecho, f'{trecho} NORTE'])  # 'contem': o nome exato e um que o contém
+    grupos = sorted(valores['GRUPO']) + [GRUPO_SEM_REGRA, ' rede rossi ']
+    grupos_produto = sorted(valores['GRUPO PRODUTO']) + [GRUPO_PRODUTO_SEM_REGRA]
+    codigos = sorted(valores['CODPRODUTO']) + [CODIGO_SEM_REGRA]
+
+    linhas = [{'GRUPO': grupo, 'GRUPO PRODUTO': grupo_produto}
+              for grupo, grupo_produto in itertools.product(grupos, grupos_produto)]
+    linhas += [{'GRUPO': grupo, 'CODPRODUTO': cod} for grupo, cod in itertools.product(grupos, codigos)]
+    linhas += [{'GRUPO': grupo, 'GRUPO PRODUTO': grupo_produto, 'CODPRODUTO': cod}
+               for grupo, grupo_produto, cod in itertools.product(GRUPOS_PRODUTO_E_CODIGO, grupos_produto, codigos)]
+    linhas += [{'RAZAO': razao} for razao in sorted(valores['RAZAO'])]
+    linhas += [{'VENDEDOR': vendedor, 'GRUPO': grupo}
+               for vendedor in sorted(valores['VENDEDOR']) for grupo in ('REDE ROSSI', GRUPO_SEM_REGRA)]
+    for nfe, cod in ac.carregar_excecoes_nfe():
+        linhas += [{'NF-E': nfe, 'CODPRODUTO': cod, 'GRUPO': 'REDE ROSSI'},
+                   {'NF-E': nfe, 'CODPRODUTO': CODIGO_SEM_REGRA, 'GRUPO': 'REDE ROSSI'}]
+
+    df = pd.DataFrame(linhas).reindex(columns=['CF', 'RAZAO', 'GRUPO', 'NF-E', 'DATA', 'VENDEDOR', 'CODPRODUTO',
+                                               'GRUPO PRODUTO', 'DESCRICAO', 'P. Com', 'PRECO VENDA', 'ROMANEIO'])
+    # Linhas repetidas em venda e devolução
+    df = pd.concat([df.assign(CF='VENDA'), df.assign(CF='DEV VENDA')], ignore_index=True)
+    df = df.fillna({
+        'RAZAO': 'CLIENTE SEM REGRA LTDA', 'GRUPO': GRUPO_SEM_REGRA, 'NF-E': '100000', 'VENDEDOR': 'VENDEDOR 1',
+        'CODPRODUTO': CODIGO_SEM_REGRA, 'GRUPO PRODUTO': GRUPO_PRODUTO_SEM_REGRA, 'DESCRICAO': 'PRODUTO',
+        'P. Com': 0.01, 'PRECO VENDA': 10.0,
+    })
+    return df.assign(DATA=pd.Timestamp('2026-07-01'), ROMANEIO=np.arange(len(df)))
+
+
+@pytest.fixture(scope='module')
+def fec_pq_todas_as_regras(tmp_path_factory):
+    """FEC_PQ de gerar_fec_pq_todas_as_regras gravada numa planilha e lida como na execução normal"""
+    df_fec_pq = gerar_fec_pq_todas_as_regras()
+    caminho = str(tmp_path_factory.mktemp('regras') / 'Regras_MRG.xlsx')
+    gravar_planilha(df_fec_pq, gerar_off_vog(df_fec_pq), caminho)
+    return ac.ler_planilha_origem(caminho, usar_cache=False)['FEC_PQ']
+
+
+@pytest.fixture(scope='module')
+def plano_comissao_fixa():
+    """Regras fixas do arquivo de regras, compiladas, com as exceções do CSV na frente"""
+    return ac.com_excecoes_nfe(ac.compilar_regras_comissao_fixa(ac.carregar_regras()['regras_fixas']),
+                               ac.carregar_excecoes_nfe())
+
+
+def test_regras_fixas_compiladas_iguais_as_originais(fec_pq_todas_as_regras, plano_comissao_fixa):
+    resultado = ac.aplicar_regras_comissao_fixa_em_lote(fec_pq_todas_as_regras, plano_comissao_fixa)
+
+    regras = criar_regras_comissao_fixa()
+    esperado = pd.Series([aplicar_regras_comissao_fixa(linha, regras) for _, linha in fec_pq_todas_as_regras.iterrows()],
+                         index=fec_pq_todas_as_regras.index, dtype='float64', name='Comissao_Esperada')
+    # A função original comparava os nomes com acento: a REDE ROLDAO só reconhecia 'EMBUTIDOS
+    # PERDIGÃO' e a REDE ROSSI só 'EMBUTIDOS PERDIGAO'. Hoje os nomes são comparados sem acento
+    com_acento = ac._chave(fec_pq_todas_as_regras, 'GRUPO PRODUTO') == 'EMBUTIDOS PERDIGAO'
+    pd.testing.assert_series_equal(resultado['Comissao_Esperada'][~com_acento], esperado[~com_acento])
+    # Todas as regras e exceções decidiram alguma linha, e sobraram linhas sem regra
+    assert resultado['Regra_Comissao'].nunique() == len(plano_comissao_fixa['regras'])
+    assert esperado.isna().any()
+
+
+def test_grupo_produto_com_e_sem_acento_tem_a_mesma_comissao(fec_pq_todas_as_regras, plano_comissao_fixa):
+    resultado = ac.aplicar_regras_comissao_fixa_em_lote(fec_pq_todas_as_regras, plano_comissao_fixa)
+    df = fec_pq_todas_as_regras.assign(Comissao=resultado['Comissao_Esperada'])
+    perdigao = df[df['GRUPO PRODUTO'].astype(str).isin(['EMBUTIDOS PERDIGÃO', 'EMBUTIDOS PERDIGAO'])]
+    comissoes = perdigao.groupby(['CF', 'GRUPO', 'CODPRODUTO'], observed=True)['Comissao'].nunique(dropna=False)
+    assert (comissoes == 1).all()
+    assert set(perdigao.loc[perdigao['GRUPO'] == 'REDE ROLDAO', 'Comissao'].abs()) == {0.02}
@@ -0,0 +1,48 @@
+"""Regras de comissão por kg compiladas contra a verificação linha a linha original"""
+import itertools
+
+import numpy as np
+import pandas as pd
+
+import averiguar_comissoes as ac
+from oraculos import pertence_comissao_kg
+
+# Casos que o arquivo de regras não usa, mas que as regras por kg aceitam
+REGRAS_KG_EXTRAS = {
+    'VENDEDOR TESTE': {
+        'grupo_codigos': {'REDE TESTE': ['TODOS']},
+        'razao_codigos': {'PADARIA TESTE LTDA': ['PURURUCA 1KG']},
+    },
+}
+
+
+def test_regras_kg_compiladas_iguais_as_originais():
+    regras = {**ac.carregar_regras()['comissao_kg'], **REGRAS_KG_EXTRAS}
+    vendedores, grupos, razoes, codigos = {'VENDEDOR 1'}, {'REDE GENERICA'}, {'CLIENTE LTDA'}, {5000}
+    for vendedor, regras_vendedor in regras.items():
+        vendedores.add(vendedor)
+        grupos.update(regras_vendedor.get('grupo', []))
+        for grupo, cods in regras_vendedor.get('grupo_codigos', {}).items():
+            grupos.add(grupo)
+            codigos.update(cod for cod in cods if isinstance(cod, int))
+        for razao, cods in regras_vendedor.get('razao_codigos', {}).items():
+            razoes.add(razao)
+            codigos.update(cod for cod in cods if isinstance(cod, int))
+
+    linhas = [(vendedor, grupo, 'CLIENTE LTDA', cod, descricao)
+              for vendedor, grupo, cod, descricao in itertools.product(
+                  sorted(vendedores), sorted(grupos), sorted(codigos), ['PURURUCA 1KG', 'BACON'])]
+    linhas += [(vendedor, 'REDE GENERICA', razao, cod, descricao)
+               for vendedor, razao, cod, descricao in itertools.product(
+                   sorted(vendedores), sorted(razoes), sorted(codigos), ['PURURUCA 1KG', 'BACON'])]
+    df = pd.DataFrame(linhas, columns=['VENDEDOR', 'GRUPO', 'RAZAO', 'CODPRODUTO', 'DESCRICAO']).assign(**{
+        'CF': 'VENDA', 'NF-E': '100000', 'DATA': pd.Timestamp('2026-07-01'), 'GRUPO PRODUTO': 'OUTROS',
+        'P. Com': 0.01, 'PRECO VENDA': 10.0})
+    df_base = ac._preparar_fec_pq(df.assign(ROMANEIO=np.arange(len(df))))
+
+    obtido = ac.regras_comissao_kg_em_lote(df_base, ac.compilar_regras_comissao_kg(regras)).notna()
+
+    esperado = pd.Series([bool(pertence_comissao_kg(linha, regras)) for _, linha in df_base.iterrows()],
+                         index=df_base.index, name='Regra_Comissao')
+    pd.testing.assert_series_equal(obtido, esperado)
+    assert esperado.any() and not esperado.all()
@@ -0,0 +1,76 @@
+"""Impacto em R$ das comissões incorretas (base das abas de resumo)"""
+import pandas as pd
+import pytest
+
+import averiguar_comissoes as ac
+from planilhas_sinteticas import gerar_fec_pq, gerar_off_vog, gravar_planilha
+
+
+def _linhas_conferidas(p_com, comissao_esperada, preco, quantidade=None):
+    df = pd.DataFrame({
+        'VENDEDOR': 'VENDEDOR 1', 'GRUPO': 'REDE GENERICA', 'RAZAO': 'CLIENTE LTDA',
+        'DATA': pd.Timestamp('2026-07-15'), 'P. Com': p_com, 'Preço_Venda': preco,
+        'Comissao_Esperada': comissao_esperada,
+    })
+    if quantidade is not None:
+        df[ac.COLUNA_QUANTIDADE_FEC_PQ] = quantidade
+    df['Status'] = ac._status_comissao(df['P. Com'], df['Comissao_Esperada'])
+    return df
+
+
+def _resultados(df_regras):
+    return {'regras': df_regras, 'ofertas': pd.DataFrame()}
+
+
+def test_p_com_em_percentual_igual_a_decimal():
+    # Mesmas vendas com o P. Com em decimal e em percentual (3 = 3%; valores até 1 já são fração)
+    decimal = ac.agregar_diferencas(_resultados(_linhas_conferidas([0.03, 0.015, 0.02], [0.01, 0.03, 0.02],
+                                                                   [10.0, 20.0, 30.0], [5, 2, 1])))
+    percentual = ac.agregar_diferencas(_resultados(_linhas_conferidas([3, '1,5%', 2], [0.01, 0.03, 0.02],
+                                                                      [10.0, 20.0, 30.0], [5, 2, 1])))
+
+    pd.testing.assert_frame_equal(percentual, decimal)
+    linha = percentual.iloc[0]
+    assert linha['Linhas'] == 3 and linha['Linhas Incorretas'] == 2
+    assert linha['Vendas R$'] == pytest.approx(10 * 5 + 20 * 2 + 30 * 1)
+    assert linha['Pago a Mais R$'] == pytest.approx(0.02 * 10 * 5)
+    assert linha['Pago a Menos R$'] == pytest.approx(0.015 * 20 * 2)
+    assert linha['Diferença R$'] == pytest.approx(0.02 * 10 * 5 - 0.015 * 20 * 2)
+
+
+def test_sem_quantidade_vale_o_preco_unitario():
+    df_diferencas = ac.agregar_diferencas(_resultados(_linhas_conferidas([3, 0.01], [0.01, 0.01], [10.0, 20.0])))
+
+    assert df_diferencas['Vendas R$'].iloc[0] == pytest.approx(30.0)
+    assert df_diferencas['Diferença R$'].iloc[0] == pytest.approx(0.02 * 10)
+
+
+def test_planilha_com_p_com_em_percentual(planos, tmp_path):
+    """
+    A mesma planilha com o P. Com em decimal (0.03), em percentual (3) e em texto com '%'
+    ('3%', '1,5%') dá os mesmos resumos em R$
+    """
+    df_fec_pq = gerar_fec_pq(800, semente=17)
+    df_off_vog = gerar_off_vog(df_fec_pq, semente=17)
+    p_com = df_fec_pq['P. Com'].replace({3: 0.03, 1: 0.01})
+    em_percentual = p_com.isin([0.02, 0.03])
+    # Em texto, as comissões vão como na planilha digitada à mão, com vírgula decimal
+    p_com[p_com == 0.01] = 0.015
+    em_texto = p_com.map(lambda valor: f"{valor * 100:g}%".replace('.', ',') if isinstance(valor, float) else valor)
+    saidas = {}
+    for forma, valores in (('decimal', p_com), ('percentual', p_com.where(~em_percentual, p_com * 100)),
+                           ('texto', em_texto)):
+        caminho_origem = str(tmp_path / f'{forma}.xlsx')
+        gravar_planilha(df_fec_pq.assign(**{'P. Com': valores}), df_off_vog, caminho_origem)
+        saidas[forma] = str(tmp_path / f'resultado_{forma}.xlsx')
+        ac.processar_planilhas(caminho_origem, saidas[forma], planos=planos, caminho_metricas=None,
+                               caminho_historico=None)
+
+    for aba in [*ac.ABAS_RESUMO, ac.ABA_PIVO_RESUMO]:
+        for forma in ('percentual', 'texto'):
+            pd.testing.assert_frame_equal(pd.read_excel(saidas[forma], sheet_name=aba),
+                                          pd.read_excel(saidas['decimal'], sheet_name=aba), obj=f"{aba} ({forma})")
+    resumo = pd.read_excel(saidas['percentual'], sheet_name='Resumo Vendedor')
+    assert resumo['Linhas Incorretas'].sum() > 0
+    # |P. Com - esperada| fica em poucos pontos percentuais do valor vendido
+    assert (resumo['Diferença R$'].abs() <= 0.1 * resumo['Vendas R$'].abs()).all()
@@ -0,0 +1,48 @@
+"""Snapshot da planilha de origem: releitura igual ao que foi gravado e limpeza só dos snapshots do mesmo arquivo"""
+import os
+import shutil
+
+import pandas as pd
+
+import averiguar_comissoes as ac
+from planilhas_sinteticas import gerar_fec_pq, gerar_off_vog, gravar_planilha
+
+
+def test_snapshot_mantem_colunas_de_tipos_misturados(tmp_path):
+    # Com o pandas 2 a leitura do Excel mantém números e texto na mesma coluna
+    dados = {
+        'FEC_PQ': pd.DataFrame({
+            'NF-E': pd.Series([123456, '123457/1', None, 123458], dtype=object),
+            'RAZAO': pd.Series([1001, 'CLIENTE A', 'CLIENTE A', 1001], dtype='category'),
+            'P. Com': [0.01, 0.02, 0.03, 0.01],
+        }),
+        'OFF_VOG': pd.DataFrame({'COD': [1, 2], 'ITENS': ['PRODUTO 1', 'PRODUTO 2']}),
+        'EXC_NFE': None,
+    }
+    ac._salvar_snapshot(dados, str(tmp_path / 'snapshot'))
+    relidos = ac._carregar_snapshot(str(tmp_path / 'snapshot'))
+
+    pd.testing.assert_frame_equal(relidos['FEC_PQ'], dados['FEC_PQ'])
+    pd.testing.assert_frame_equal(relidos['OFF_VOG'], dados['OFF_VOG'])
+    assert relidos['EXC_NFE'] is None
+
+
+def test_snapshot_so_apaga_os_do_mesmo_arquivo(tmp_path):
+    df_fec_pq = gerar_fec_pq(300, semente=12)
+    caminhos = {nome: str(tmp_path / f'{nome}.xlsx') for nome in ('Semana', 'Semana_1', 'Semana_MRG')}
+    gravar_planilha(df_fec_pq, gerar_off_vog(df_fec_pq, semente=12), caminhos['Semana'])
+    for nome in ('Semana_1', 'Semana_MRG'):
+        shutil.copyfile(caminhos['Semana'], caminhos[nome])
+    for caminho in caminhos.values():
+        ac.ler_planilha_origem(caminho)
+    chaves = {nome: ac._chave_snapshot(caminho) for nome, caminho in caminhos.items()}
+
+    # Nova versão de Semana.xlsx: o snapshot antigo dela sai, os das outras planilhas ficam
+    df_fec_pq = gerar_fec_pq(300, semente=13)
+    gravar_planilha(df_fec_pq, gerar_off_vog(df_fec_pq, semente=13), caminhos['Semana'])
+    ac.ler_planilha_origem(caminhos['Semana'])
+
+    snapshots = set(os.listdir(ac.DIRETORIO_CACHE))
+    assert chaves['Semana'] not in snapshots
+    assert ac._chave_snapshot(caminhos['Semana']) in snapshots
+    assert {chaves['Semana_1'], chaves['Semana_MRG']} <= snapshots